@@ -28,12 +28,15 @@ function cydraw(elements) {
                 }
             }
         ],
-        layout: {
-            name: 'cose',
-            numIter: 100,
-            directed: true,
-            nodeDimensionsIncludeLabels: true
-        }
+        // Graph files saved with node positions are drawn with preset layout
+        layout: elements.nodes.length > 0 && elements.nodes[0].position ?
+            { name: 'preset' } :
+            {
+                name: 'cose',
+                numIter: 100,
+                directed: true,
+                nodeDimensionsIncludeLabels: true
+            }
     });
 
     if (typeof(cy.navigator) !== 'undefined')
@@ -1,5 +1,5 @@
 #!/usr/bin/env python
-""" Index Ensembl regulatory build GFF files with Elasticsearch"""
+""" Index Ensembl regulatory build GFF files with Elasticsearch or MongoDB"""
 from __future__ import print_function
 
 import argparse
@@ -7,11 +7,45 @@ from os import path
 
 import gffutils
 from elasticsearch.helpers import streaming_bulk
+from pymongo import IndexModel
 
 from nosqlbiosets.dbutils import DBconnection
 
 chunksize = 2048
 
+# UCSC binning scheme, 5 levels of bins from 128kb to 512Mb
+# http://genome.cshlp.org/content/12/6/996.full
+BIN_OFFSETS = [512 + 64 + 8 + 1, 64 + 8 + 1, 8 + 1, 1, 0]
+BIN_FIRSTSHIFT = 17
+BIN_NEXTSHIFT = 3
+
+
+def binfromrange(start, end):
+    """ Return the smallest UCSC bin that fully contains given range,
+     start and end are 1-based inclusive GFF coordinates """
+    startbin = (start - 1) >> BIN_FIRSTSHIFT
+    endbin = (end - 1) >> BIN_FIRSTSHIFT
+    for offset in BIN_OFFSETS:
+        if startbin == endbin:
+            return offset + startbin
+        startbin >>= BIN_NEXTSHIFT
+        endbin >>= BIN_NEXTSHIFT
+    raise ValueError("Range %d-%d is out of binning scheme limits"
+                     % (start, end))
+
+
+def overlappingbins(start, end):
+    """ Return all UCSC bins that may include features
+     overlapping given range """
+    startbin = (start - 1) >> BIN_FIRSTSHIFT
+    endbin = (end - 1) >> BIN_FIRSTSHIFT
+    bins = []
+    for offset in BIN_OFFSETS:
+        bins.extend(range(offset + startbin, offset + endbin + 1))
+        startbin >>= BIN_NEXTSHIFT
+        endbin >>= BIN_NEXTSHIFT
+    return bins
+
 
 # Return db connection to the gffutils sqlite db for the given gff file
 def connectgffdb(gff):
@@ -56,20 +90,33 @@ def regregions_reader(db):
         yield r
 
 
-def checkindex(es, index):
+def checkindex(es, index, doctype):
     if es.indices.exists(index=index):
         es.indices.delete(index=index, params={"timeout": "10s"})
-    indxcfg = {"settings": {
-        "index.number_of_replicas": 0, "index.refresh_interval": '360s'}}
+    # Feature locations are indexed as integer ranges
+    # to support overlap queries with single range conditions
+    mappings = {doctype: {"properties": {
+        "chr": {"type": "keyword"},
+        "loc": {"type": "integer_range"}}}}
     es.indices.create(index=index, params={"timeout": "10s"},
+                      body={"mappings": mappings},
                       ignore=400, wait_for_active_shards=1)
+    indxcfg = {"settings": {
+        "index.number_of_replicas": 0, "index.refresh_interval": '360s'}}
     es.indices.put_settings(index=index, body=indxcfg)
 
 
+# Add integer range field 'loc' to features read by given reader
+def es_reader(reader, gffdb):
+    for r in reader(gffdb):
+        r['loc'] = {"gte": r['start'], "lte": r['end']}
+        yield r
+
+
 def es_index(es, index, gffdb, reader, doctype):
-    checkindex(es, index)
+    checkindex(es, index, doctype)
     for ok, result in streaming_bulk(
-            es, reader(gffdb),
+            es, es_reader(reader, gffdb),
             index=index, doc_type=doctype, chunk_size=chunksize
     ):
         if not ok:
@@ -80,43 +127,69 @@ def es_index(es, index, gffdb, reader, doctype):
     return
 
 
+# Index features with MongoDB, 'bin' field is set with UCSC binning scheme
+def mongodb_index(mdbc, gffdb, reader):
+    mdbc.delete_many({})
+    entries = list()
+    for r in reader(gffdb):
+        r['bin'] = binfromrange(r['start'], r['end'])
+        entries.append(r)
+        if len(entries) == chunksize:
+            mdbc.insert_many(entries)
+            entries = list()
+    if len(entries) > 0:
+        mdbc.insert_many(entries)
+    mongodb_indices(mdbc)
+
+
+def mongodb_indices(mdbc):
+    index = IndexModel([("chr", 1), ("bin", 1), ("start", 1)],
+                       name="chr-bin-start")
+    mdbc.create_indexes([index])
+    mdbc.create_index("tf")
+    mdbc.create_index("feature_type")
+
+
 def main(db, infile, index, gfftype, host=None, port=None):
-    if db in ["Elasticsearch"]:
+    if gfftype == "transcriptionfactor":
+        reader = tfs_reader
+        doctype = "transcriptionfactor"
+    elif gfftype == "regulatoryregion":
+        reader = regregions_reader
+        doctype = "regulatoryregion"
+    else:
+        print("gfftype should be 'transcriptionfactor'"
+              " or 'regulatoryregion'")
+        return
+    gffdb = connectgffdb(infile)
+    if db == "Elasticsearch":
         con = DBconnection("Elasticsearch", index,
                            host=host, port=port)
-        gffdb = connectgffdb(infile)
-        if gfftype == "transcriptionfactor":
-            reader = tfs_reader
-            doctype = "transcriptionfactor"
-        elif gfftype == "regulatoryregion":
-            reader = regregions_reader
-            doctype = "regulatoryregion"
-        else:
-            print("gfftype should be 'transcriptionfactor'"
-                  " or 'regulatoryregion'")
-            return
-        es_index(con.es, index, gffdb, reader, doctype)
         es_index(con.es, index, gffdb, reader, doctype)
+    else:  # assume MongoDB
+        con = DBconnection("MongoDB", index, host=host, port=port)
+        mongodb_index(con.mdbi[doctype], gffdb, reader)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Index Ensembl regulatory build '
-                    'gff files using Elasticsearch')
+                    'gff files using Elasticsearch or MongoDB')
     parser.add_argument('--infile',
                         help='Transcription factors binding sites or '
                              'Regulatory regions gff file')
     parser.add_argument('--index',
                         default="ensregbuild",
-                        help='Name of the Elasticsearch index')
+                        help='Name of the Elasticsearch index'
+                             ' or MongoDB database')
     parser.add_argument('--gfftype',
                         help='Type of the gff file, should be'
                              ' "transcriptionfactor" or "regulatoryregion"')
     parser.add_argument('--db', default='Elasticsearch',
-                        help="Database: only 'Elasticsearch' is supported")
+                        help="Database: 'Elasticsearch' or 'MongoDB'")
     parser.add_argument('--host',
-                        help='Elasticsearch server hostname')
+                        help='Elasticsearch or MongoDB server hostname')
     parser.add_argument('--port',
-                        help="Elasticsearch server port")
+                        help="Elasticsearch or MongoDB server port")
     args = parser.parse_args()
     main(args.db, args.infile, args.index, args.gfftype, args.host, args.port)
@@ -8,6 +8,7 @@ from pprint import pprint
 
 from elasticsearch.helpers import streaming_bulk
 from nosqlbiosets.dbutils import DBconnection
+from nosqlbiosets.xrefs import XrefWriter
 from pymongo.errors import BulkWriteError
 from sqlalchemy import (Column, Integer, Date, create_engine)
 from sqlalchemy import Text
@@ -77,10 +78,26 @@ def es_index_genes(dbc, genes):
     return r
 
 
-def mongodb_index_genes(mdbc, genes):
+# HGNC columns saved in the xref collection, with their namespaces
+XREF_COLUMNS = [("hgnc_id", "hgnc"), ("symbol", "genename"),
+                ("entrez_id", "geneid"), ("ensembl_gene_id", "ensembl"),
+                ("uniprot_ids", "uniprotkb"), ("refseq_accession", "refseq"),
+                ("rna_central_id", "rnacentral"), ("omim_id", "mim")]
+
+
+def hgnc_xrefs(gene):
+    for column, ns in XREF_COLUMNS:
+        v = gene.get(column)
+        for id_ in v if isinstance(v, list) else [v]:
+            yield ns, id_
+
+
+def mongodb_index_genes(mdbc, genes, xrefw=None):
     entries = list()
     try:
         for entry in read_genes(genes):
+            if xrefw is not None:
+                xrefw.add(entry['_id'], hgnc_xrefs(entry))
             entries.append(entry)
             if len(entries) == CHUNKSIZE:
                 mdbc.insert_many(entries)
@@ -172,7 +189,7 @@ def pgsql_index_genes(session, genes):
 
 
 def main(db, infile, index, doctype,
-         user=None, password=None, host=None, port=None):
+         user=None, password=None, host=None, port=None, xrefs=False):
     if db in ["Elasticsearch",  "MongoDB"]:
         dbc = DBconnection(db, index, collection=doctype, host=host, port=port,
                            recreateindex=True)
@@ -180,8 +197,12 @@ def main(db, infile, index, doctype,
             read_and_index_hgnc_file(infile, dbc, es_index_genes)
             dbc.es.indices.refresh(index=index)
         elif dbc.db == "MongoDB":
-            read_and_index_hgnc_file(infile, dbc.mdbi[doctype],
-                                     mongodb_index_genes)
+            xrefw = XrefWriter(dbc.mdbi, doctype) if xrefs else None
+            read_and_index_hgnc_file(
+                infile, dbc.mdbi[doctype],
+                lambda mdbc, genes: mongodb_index_genes(mdbc, genes, xrefw))
+            if xrefw is not None:
+                xrefw.close()
     else:
         session = pgsql_connect(host, port, user, password, index)
         session.query(GeneInfo).delete()
@@ -214,6 +235,9 @@ if __name__ == '__main__':
     parser.add_argument('--password',
                         help="Password for the database user, "
                              " supported with PostgreSQL option only")
+    parser.add_argument('--xrefs', default=False, action='store_true',
+                        help="Save gene ids and symbols in the shared 'xref'"
+                             " collection as well, MongoDB only")
     args = parser.parse_args()
     main(args.db, args.infile, args.index, args.doctype,
-         args.user, args.password, args.host, args.port)
+         args.user, args.password, args.host, args.port, args.xrefs)
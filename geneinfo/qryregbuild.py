@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+""" Query Ensembl regulatory build features indexed with MongoDB
+ or Elasticsearch, for features overlapping given genomic regions """
+# Server connection details are read from conf/dbservers.json file
+
+from bisect import bisect_left, bisect_right
+
+import argh
+
+from geneinfo.ensembl_regbuild import overlappingbins
+from nosqlbiosets.qryutils import Query
+
+REGREGIONS = "regulatoryregion"  # MongoDB collection or ES document type
+TFS = "transcriptionfactor"
+
+
+def read_bed_regions(bedfile):
+    """ Read regions in BED file as (chr, start, end) tuples,
+     BED coordinates are converted to 1-based inclusive GFF coordinates """
+    with open(bedfile) as inf:
+        for line in inf:
+            if line.startswith(('#', 'track', 'browser')) or not line.strip():
+                continue
+            a = line.split('\t')
+            yield a[0], int(a[1]) + 1, int(a[2])
+
+
+def _es_feature(hit):
+    f = hit['_source']
+    f['_id'] = hit['_id']
+    return f
+
+
+class IntervalCache(object):
+    """ In-memory overlap search for features of a set of chromosomes.
+     Features are kept sorted by their start positions per chromosome,
+     together with the length of the longest feature of the chromosome,
+     candidates for an overlap query are found by binary search """
+
+    def __init__(self, features):
+        bychr = dict()
+        for f in features:
+            bychr.setdefault(f['chr'], []).append(f)
+        self.features = dict()
+        self.starts = dict()
+        self.maxlength = dict()
+        for chr_, fl in bychr.items():
+            fl.sort(key=lambda f: f['start'])
+            self.features[chr_] = fl
+            self.starts[chr_] = [f['start'] for f in fl]
+            self.maxlength[chr_] = max(f['end'] - f['start'] for f in fl)
+
+    def overlaps(self, chr_, start, end):
+        """ Features overlapping given region, coordinates are inclusive """
+        if chr_ not in self.starts:
+            return []
+        starts = self.starts[chr_]
+        i = bisect_left(starts, start - self.maxlength[chr_])
+        j = bisect_right(starts, end)
+        return [f for f in self.features[chr_][i:j] if f['end'] >= start]
+
+    def __len__(self):
+        return sum(len(fl) for fl in self.features.values())
+
+
+class QueryRegBuild(Query):
+
+    def __init__(self, dbtype="MongoDB", index="biosets",
+                 mdbcollection=REGREGIONS, **kwargs):
+        super(QueryRegBuild, self).__init__(dbtype, index,
+                                            mdbcollection, **kwargs)
+        self.cache = None
+
+    def load_cache(self, qc=None):
+        """ Read features selected by the query clause qc to memory,
+        following overlap queries are answered from memory """
+        if self.dbc.db == 'Elasticsearch':
+            from elasticsearch.helpers import scan
+            query = {"query": qc if qc is not None else {"match_all": {}}}
+            hits = scan(self.dbc.es, index=self.index, query=query)
+            features = [_es_feature(hit) for hit in hits]
+        else:
+            features = list(self.query({} if qc is None else qc))
+        self.cache = IntervalCache(features)
+        return self.cache
+
+    def overlaps(self, regions, size=1000):
+        """ Find features overlapping each of the given regions,
+        all regions are queried with a single request to the database server
+        :param regions: list of (chr, start, end) tuples,
+                        coordinates are 1-based and inclusive
+        :param size: number of features returned per region with the
+                     first request, Elasticsearch only; features of regions
+                     with more features are read with following requests
+        :return: list of feature lists, in the same order with the regions
+        """
+        regions = list(regions)
+        if self.cache is not None:
+            return [self.cache.overlaps(c, s, e) for c, s, e in regions]
+        if len(regions) == 0:
+            return []
+        if self.dbc.db == 'Elasticsearch':
+            r = self.es_overlaps(regions, size)
+        else:
+            r = self.mdb_overlaps(regions)
+        return r
+
+    def es_overlaps(self, regions, size):
+        # First pages of all regions are read with one msearch request
+        queries = []
+        body = []
+        for chr_, start, end in regions:
+            qc = [
+                {"term": {"chr": chr_}},
+                {"range": {"loc": {"gte": start, "lte": end,
+                                   "relation": "intersects"}}}
+            ]
+            queries.append(qc)
+            body.append({"index": self.index})
+            body.append({"size": size, "sort": [{"start": "asc"}],
+                         "query": {"bool": {"filter": qc}}})
+        rs = self.dbc.es.msearch(body=body)
+        return [self.es_nextpages(qc, r['hits']['hits'], size)
+                for qc, r in zip(queries, rs['responses'])]
+
+    def es_nextpages(self, qc, hits, size):
+        """ Features of the first page, and the following pages when the
+        pages are full; pages are sorted by start positions, following pages
+        start from the last start position, excluding features already read
+        with that start position """
+        features = [_es_feature(hit) for hit in hits]
+        while len(hits) == size:
+            last = features[-1]['start']
+            seen = []
+            for f in reversed(features):
+                if f['start'] != last:
+                    break
+                seen.append(f['_id'])
+            query = {"bool": {
+                "filter": qc + [{"range": {"start": {"gte": last}}}],
+                "must_not": [{"ids": {"values": seen}}]}}
+            hits = self.dbc.es.search(
+                index=self.index, body={"size": size,
+                                        "sort": [{"start": "asc"}],
+                                        "query": query})['hits']['hits']
+            features.extend(_es_feature(hit) for hit in hits)
+        return features
+
+    def mdb_overlaps(self, regions):
+        # Matching features are assigned to regions
+        # with an interval cache of the returned features
+        qc = {"$or": [
+            {"chr": chr_, "bin": {"$in": overlappingbins(start, end)},
+             "start": {"$lte": end}, "end": {"$gte": start}}
+            for chr_, start, end in regions]}
+        cache = IntervalCache(self.query(qc))
+        return [cache.overlaps(c, s, e) for c, s, e in regions]
+
+    def overlaps_bedfile(self, bedfile):
+        """ Find features overlapping the regions in given BED file """
+        regions = list(read_bed_regions(bedfile))
+        return zip(regions, self.overlaps(regions))
+
+
+def annotate_bedfile(bedfile, dbtype="MongoDB", index="biosets",
+                     collection=REGREGIONS, cache=False):
+    """ Print features overlapping the regions in given BED file
+
+    :param bedfile: BED file with the regions to annotate
+    :param dbtype: 'MongoDB' or 'Elasticsearch'
+    :param index: MongoDB database or Elasticsearch index name
+    :param collection: 'regulatoryregion' or 'transcriptionfactor'
+    :param cache: read all features to memory before the queries
+    """
+    qry = QueryRegBuild(dbtype, index, collection)
+    if cache:
+        qry.load_cache()
+    for (chr_, start, end), features in qry.overlaps_bedfile(bedfile):
+        for f in features:
+            print("%s\t%d\t%d\t%s\t%d\t%d\t%s" % (
+                chr_, start - 1, end, f['_id'], f['start'], f['end'],
+                f['tf'] if collection == TFS else f['feature_type']))
+
+
+if __name__ == '__main__':
+    argh.dispatch_commands([
+        annotate_bedfile
+    ])
@@ -12,6 +12,7 @@ from pymongo import IndexModel
 from pymongo.errors import BulkWriteError
 
 from nosqlbiosets.dbutils import DBconnection
+from nosqlbiosets.xrefs import XrefWriter
 
 DOCTYPE = "rnacentral"
 INDEX = "biosets"  # default name for Elasticsearch-index or MongoDB-database
@@ -66,11 +67,22 @@ def es_index_idmappings(es, csvfile):
     return
 
 
-def mongodb_index_idmappings(mdbi, csvfile):
+# (namespace, id) pairs of RNAcentral entry for the xref collection,
+# 'rnacentral' for RNAcentral ids, and the mapped databases such as 'ena'
+def rnacentral_xrefs(entry):
+    yield 'rnacentral', entry['_id']
+    for m in entry['mappings']:
+        yield m['db'], m['id']
+
+
+def mongodb_index_idmappings(mdbi, csvfile, xrefs=False):
     entries = list()
     mdbi[DOCTYPE].delete_many({})
+    xrefw = XrefWriter(mdbi, DOCTYPE) if xrefs else None
     try:
         for entry in mappingreader(csvfile):
+            if xrefw is not None:
+                xrefw.add(entry['_id'], rnacentral_xrefs(entry))
             entries.append(entry)
             if len(entries) == CHUNKSIZE:
                 mdbi[DOCTYPE].insert_many(entries)
@@ -78,6 +90,8 @@ def mongodb_index_idmappings(mdbi, csvfile):
         mdbi[DOCTYPE].insert_many(entries)
     except BulkWriteError as bwe:
         pprint(bwe.details)
+    if xrefw is not None:
+        xrefw.close()
     return
 
 
@@ -90,14 +104,14 @@ def mongodb_indices(mdb):
     return
 
 
-def main(dbc, infile, index):
+def main(dbc, infile, index, xrefs=False):
     if dbc.db == "Elasticsearch":
         dbc.es.delete_by_query(index=index, doc_type=DOCTYPE, timeout="2m",
                                body={"query": {"match_all": {}}})
         es_index_idmappings(dbc.es, infile)
         dbc.es.indices.refresh(index=index)
     else:  # "MongoDB"
-        mongodb_index_idmappings(dbc.mdbi, infile)
+        mongodb_index_idmappings(dbc.mdbi, infile, xrefs)
         mongodb_indices(dbc.mdbi[DOCTYPE])
 
 
@@ -119,7 +133,10 @@ if __name__ == '__main__':
                         help="Elasticsearch or MongoDB server port")
     parser.add_argument('--db', default='MongoDB',
                         help="Database: 'Elasticsearch' or 'MongoDB'")
+    parser.add_argument('--xrefs', default=False, action='store_true',
+                        help="Save id mappings in the shared 'xref'"
+                             " collection as well, MongoDB only")
     args = parser.parse_args()
     dbc_ = DBconnection(args.db, args.index, host=args.host,
                         port=args.port)
-    main(dbc_, args.infile, args.index)
+    main(dbc_, args.infile, args.index, args.xrefs)
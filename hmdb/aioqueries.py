@@ -0,0 +1,57 @@
+""" Asyncio counterparts of DrugBank and HMDB queries, with the aggregation
+ pipelines of the sync QueryDrugBank and QueryHMDB queries """
+import asyncio
+
+from hmdb.index import DOCTYPE_METABOLITE
+from hmdb.queries import DATABASE, db, drugbank_entity_aggq, \
+    metabolites_protein_functions_aggq
+from nosqlbiosets.aioqryutils import AsyncQuery
+from nosqlbiosets.qryutils import prefixquery
+
+
+class AsyncQueryDrugBank(AsyncQuery):
+    """ Async counterparts of QueryDrugBank queries """
+
+    def __init__(self, dbtype=db, index=DATABASE, mdbcollection="drugbank",
+                 **kwargs):
+        super(AsyncQueryDrugBank, self).__init__(dbtype, index, mdbcollection,
+                                                 **kwargs)
+
+    async def autocomplete_drugnames(self, qterm, **kwargs):
+        return await self.query(prefixquery(qterm), projection=['name'],
+                                **kwargs)
+
+    async def kegg_target_id_to_drugbank_entity_id(
+            self, keggtid, etype='targets', uniprotcollection='uniprot'):
+        """ See QueryDrugBank.kegg_target_id_to_drugbank_entity_id,
+        UniProt collection should be in the same database """
+        uniprotid = await self.distinct('name', {"dbReference.id": keggtid},
+                                        collection=uniprotcollection)
+        assert len(uniprotid) == 1
+        r = await self.aggregate_query(drugbank_entity_aggq(uniprotid[0],
+                                                            etype))
+        assert 1 == len(r)
+        return uniprotid[0], r[0][etype]["id"]
+
+    async def kegg_target_ids_to_drugbank_entity_ids(
+            self, keggtids, etype='targets', uniprotcollection='uniprot'):
+        """ Concurrent queries for list of KEGG target ids """
+        return await asyncio.gather(*[
+            self.kegg_target_id_to_drugbank_entity_id(
+                keggtid, etype, uniprotcollection)
+            for keggtid in keggtids])
+
+
+class AsyncQueryHMDB(AsyncQuery):
+    """ Async counterparts of QueryHMDB queries """
+
+    def __init__(self, index=DATABASE, **kwargs):
+        super(AsyncQueryHMDB, self).__init__(db, index, DOCTYPE_METABOLITE,
+                                             **kwargs)
+
+    async def metabolites_protein_functions(self, mq):
+        """
+        Functions of associated proteins for selected set of Metabolites
+        """
+        return await self.aggregate_query(
+            metabolites_protein_functions_aggq(mq))
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 """ Index DrugBank xml dataset with MongoDB or Elasticsearch,
-    can also save drug interactions as graph files (experimental) """
+    can also save drug interactions as graph files (experimental)
+    or as files for the Neo4j bulk importer """
 
 from __future__ import print_function
 
@@ -16,6 +17,7 @@ from pymongo import IndexModel
 
 from nosqlbiosets.dbutils import DBconnection
 from nosqlbiosets.objutils import *
+from nosqlbiosets.xrefs import XrefWriter
 
 SOURCE_URL = "https://www.drugbank.ca/releases/latest"
 DOCTYPE = 'drugbank'  # MongoDB default collection name
@@ -25,6 +27,8 @@ LIST_ATTRS = ["transporters", "drug-interactions", "food-interactions",
               "carriers", "groups", "salts", "products",
               'pathways', 'go-classifiers', 'external-links',
               'external-identifiers']
+# Drug-target connection types
+DRUGTARGET_CONNECTIONS = ["targets", "enzymes", "transporters", "carriers"]
 
 
 # Update DrugBank entry for better database representation
@@ -56,6 +60,7 @@ def update_entry_forindexing(e, slim=True):
                             del i['polypeptide']['amino-acid-sequence']
                             del i['polypeptide']['gene-sequence']
                         unifylistattributes(i['polypeptide'], LIST_ATTRS)
+    e[NAMEKEYS] = drugnamekeys(e)
     if slim is True:
         if 'sequences' in e:
             del e['sequences']
@@ -69,6 +74,17 @@ def update_entry_forindexing(e, slim=True):
             e['salts'][att] = float(e['salts'][att])
 
 
+# Name keys for prefix queries; drug names, synonyms, product names,
+# and international brand names
+def drugnamekeys(e):
+    synonyms = (e.get('synonyms') or {}).get('synonym')
+    brands = (e.get('international-brands') or {}).get('international-brand')
+    brands = brands if isinstance(brands, list) else [brands] if brands else []
+    return namekeys(e.get('name'), synonyms,
+                    [p.get('name') for p in e.get('products', [])],
+                    [b.get('name') for b in brands])
+
+
 # Read DrugBank xml files, index using the function indexf
 def parse_drugbank_xmlfile(infile, indexf):
     infile = str(infile)
@@ -86,16 +102,33 @@ def parse_drugbank_xmlfile(infile, indexf):
     print("\nCompleted")
 
 
+# (namespace, id) pairs of DrugBank entry for the xref collection,
+# 'drugbank' for DrugBank ids, and external identifier resources
+# such as 'uniprotkb', 'chebi', 'pubchem compound'
+def drugbank_xrefs(e):
+    ids = e['drugbank-id']
+    for id_ in ids if isinstance(ids, list) else [ids]:
+        yield 'drugbank', id_['#text'] if isinstance(id_, dict) else id_
+    for xref in e.get('external-identifiers', []):
+        yield xref['resource'], xref['identifier']
+
+
 class Indexer(DBconnection):
 
-    def __init__(self, db, index, host, port, doctype, slim=True):
+    def __init__(self, db, index, host, port, doctype, slim=True,
+                 xrefs=False):
         self.doctype = doctype
         self.index = index
         self.slim = slim
+        self.xrefw = None
         super(Indexer, self).__init__(db, index, host, port,
-                                      mdbcollection=doctype, recreateindex=True)
+                                      mdbcollection=doctype,
+                                      recreateindex=True,
+                                      es_indexmappings=NAMEKEYS_ES_MAPPINGS)
         if db == "MongoDB":
             self.mcl = self.mdbi[doctype]
+            if xrefs:
+                self.xrefw = XrefWriter(self.mdbi, doctype)
 
     # Index DrugBank entry with MongoDB
     def mongodb_index_entry(self, _, entry):
@@ -104,6 +137,8 @@ class Indexer(DBconnection):
             docid = self.getdrugid(entry)
             entry["_id"] = docid
             self.mcl.insert_one(entry)
+            if self.xrefw is not None:
+                self.xrefw.add(docid, drugbank_xrefs(entry))
             self.reportprogress()
             r = True
         except Exception as e:
@@ -134,9 +169,19 @@ class Indexer(DBconnection):
         return eid
 
     interactions = set()
+    drugs = dict()        # DrugBank drug ids -> drug names
+    targets = dict()      # DrugBank target ids -> target names
+    drugtargets = set()   # (drug id, target id, connection type) tuples
 
     def saveinteractions(self, _, e):
         eid = self.getdrugid(e)
+        self.drugs[eid] = e['name']
+        unifylistattributes(e, DRUGTARGET_CONNECTIONS)
+        for connection in DRUGTARGET_CONNECTIONS:
+            if connection in e:
+                for t in e[connection]:
+                    self.targets[t['id']] = t['name']
+                    self.drugtargets.add((eid, t['id'], connection))
         if e['drug-interactions'] is not None:
             if isinstance(e['drug-interactions']['drug-interaction'], list):
                 for i in e['drug-interactions']['drug-interaction']:
@@ -157,6 +202,18 @@ class Indexer(DBconnection):
         nx.write_gml(graph, self.index + ".gml")
         return graph
 
+    # Save drugs, targets, drug-drug and drug-target interactions
+    # as files for the Neo4j bulk importer
+    def save_neo4j_csvfiles(self):
+        files = self.neo4jfiles
+        files.write_nodes("Drug", self.drugs.items(), ["name"])
+        files.write_nodes("Target", self.targets.items(), ["name"])
+        files.write_relationships("Interacts", "Drug", "Drug",
+                                  self.interactions)
+        files.write_relationships("Targets", "Drug", "Target",
+                                  self.drugtargets, ["type"])
+        files.save_importscript()
+
 
 # Fields for text indexing
 TEXT_FIELDS = ["description", "atc-codes.level.#text",
@@ -175,7 +232,7 @@ def mongodb_indices(mdb):
     mdb.create_indexes([IndexModel(indx,
                                    name="text-index-for-selected-fields")])
     indx_fields = [
-        "name", "products.name",
+        "name", "products.name", NAMEKEYS,
         "classification.class", "drug-interactions.name",
         "targets.polypeptide.gene-name",
         "protein_associations.protein.protein_accession",
@@ -188,14 +245,22 @@ def mongodb_indices(mdb):
         mdb.create_index(field)
 
 
-def main(infile, db, index, doctype=DOCTYPE, host=None, port=None, slim=True):
-    indxr = Indexer(db, index, host, port, doctype, slim)
+def main(infile, db, index, doctype=DOCTYPE, host=None, port=None, slim=True,
+         xrefs=False):
+    indxr = Indexer(db, index, host, port, doctype, slim, xrefs)
     if db == 'MongoDB':
         parse_drugbank_xmlfile(infile, indxr.mongodb_index_entry)
         mongodb_indices(indxr.mdbi[doctype])
+        if indxr.xrefw is not None:
+            indxr.xrefw.close()
+        indxr.bump_generation(doctype)
     elif db == 'Elasticsearch':
         parse_drugbank_xmlfile(infile, indxr.es_index_entry)
         indxr.es.indices.refresh(index=index)
+        indxr.bump_generation(index)
+    elif db == 'Neo4jCSV':
+        parse_drugbank_xmlfile(infile, indxr.saveinteractions)
+        indxr.save_neo4j_csvfiles()
     else:
         parse_drugbank_xmlfile(infile, indxr.saveinteractions)
         indxr.saveasgraph()
@@ -213,7 +278,8 @@ if __name__ == '__main__':
     parser.add_argument('--index',
                         default="biosets",
                         help='Name of the MongoDB database or Elasticsearch'
-                             ' index, or filename for NetworkX graph')
+                             ' index, or filename for NetworkX graph,'
+                             ' or output folder with the Neo4jCSV option')
     parser.add_argument('--mdbcollection',
                         default=DOCTYPE,
                         help='MongoDB collection name')
@@ -223,6 +289,8 @@ if __name__ == '__main__':
                         help="MongoDB or Elasticsearch server port number")
     parser.add_argument('--db', default='Elasticsearch',
                         help="Database: 'MongoDB' or 'Elasticsearch',"
+                             " or 'Neo4jCSV' for saving files for"
+                             " 'neo4j-admin database import' command,"
                              " if not set drug-drug interaction"
                              " network is saved to a graph file specified with"
                              " the '--graphfile' option")
@@ -234,6 +302,9 @@ if __name__ == '__main__':
                         help="By default sequence fields"
                              " and the patents field is not indexed."
                              " Select this option to index all fields")
+    parser.add_argument('--xrefs', default=False, action='store_true',
+                        help="Save external identifiers of the drugs in the"
+                             " shared 'xref' collection, MongoDB only")
     args = parser.parse_args()
     main(args.infile, args.db, args.index, args.mdbcollection,
-         args.host, args.port, not args.allfields)
+         args.host, args.port, not args.allfields, args.xrefs)
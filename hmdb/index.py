@@ -17,6 +17,9 @@ from nosqlbiosets.objutils import unifylistattributes
 
 DOCTYPE_METABOLITE = 'hmdbmetabolite'
 DOCTYPE_PROTEIN = 'hmdbprotein'
+# Flat metabolite-protein association collection, saved with proteins
+DOCTYPE_EDGES = 'hmdbmetabolite_protein'
+BATCHSIZE = 10000
 
 
 # Read HMDB Metabolites/Proteins files, index using the function indexf
@@ -38,15 +41,34 @@ def parse_hmdb_xmlfile(infile, indexf):
     print("\nCompleted")
 
 
+# Metabolite-protein association rows of HMDB protein entry,
+# with the gene name, type and general function of the protein
+def metabolite_protein_edges(entry):
+    associations = entry.get('metabolite_associations') or {}
+    metabolites = associations.get('metabolite') or []
+    if isinstance(metabolites, dict):
+        metabolites = [metabolites]
+    return [{"metabolite": m['accession'], "metabolite_name": m.get('name'),
+             "protein": entry['accession'], "gene": entry.get('gene_name'),
+             "type": entry.get('protein_type'),
+             "function": entry.get('general_function')}
+            for m in metabolites]
+
+
 class Indexer(DBconnection):
 
     def __init__(self, db, index, host, port, doctype):
         self.doctype = doctype
         self.index = index
         super(Indexer, self).__init__(db, index, host, port, recreateindex=True)
+        self.edgecl = None
+        self.edges = []
         if db == "MongoDB":
             self.mcl = self.mdbi[doctype]
             self.mcl.drop()
+            if doctype == DOCTYPE_PROTEIN:
+                self.edgecl = self.mdbi[DOCTYPE_EDGES]
+                self.edgecl.drop()
 
     # Tune entries for better data representation
     def tune(self, entry):
@@ -89,8 +111,29 @@ class Indexer(DBconnection):
         except Exception as e:
             print(e)
             r = False
+        if r and self.edgecl is not None:
+            self.add_edges(entry)
         return r
 
+    # Edge write errors are reported separately from the protein entries,
+    # which are saved before their edges
+    def add_edges(self, entry):
+        try:
+            self.edges.extend(metabolite_protein_edges(entry))
+        except Exception as e:
+            print("Failed to read metabolite associations of %s: %s"
+                  % (entry['accession'], e))
+        if len(self.edges) >= BATCHSIZE:
+            self.save_edges()
+
+    def save_edges(self):
+        if self.edges:
+            try:
+                self.edgecl.insert_many(self.edges, ordered=False)
+            except Exception as e:
+                print("Failed to save metabolite-protein edges: %s" % e)
+            self.edges = []
+
 
 def mongodb_indices(mdb, doctype):
     if doctype == DOCTYPE_METABOLITE:
@@ -111,6 +154,12 @@ def mongodb_indices(mdb, doctype):
     return
 
 
+def mongodb_edge_indices(mdb):
+    mdb.create_index("metabolite")
+    mdb.create_index("protein")
+    mdb.create_index("gene")
+
+
 def main(infile, index, doctype, db, host=None, port=None):
     if doctype is None:
         if 'protein' in infile:
@@ -121,9 +170,15 @@ def main(infile, index, doctype, db, host=None, port=None):
     if db == 'Elasticsearch':
         parse_hmdb_xmlfile(infile, indxr.es_index_hmdb_entry)
         indxr.es.indices.refresh(index=index)
+        indxr.bump_generation(index)
     else:
         parse_hmdb_xmlfile(infile, indxr.mongodb_index_hmdb_entry)
         mongodb_indices(indxr.mcl, doctype)
+        indxr.bump_generation(doctype)
+        if indxr.edgecl is not None:
+            indxr.save_edges()
+            mongodb_edge_indices(indxr.edgecl)
+            indxr.bump_generation(DOCTYPE_EDGES)
 
 
 if __name__ == '__main__':
@@ -1,17 +1,76 @@
 #!/usr/bin/env python
 """ Queries with HMDB and DrugBank data indexed with MongoDB """
 
+from collections import Counter
+
 import argh
 
-from hmdb.index import DOCTYPE_METABOLITE, DOCTYPE_PROTEIN
+from hmdb.index import DOCTYPE_EDGES, DOCTYPE_METABOLITE, DOCTYPE_PROTEIN
 from nosqlbiosets.dbutils import DBconnection
 from nosqlbiosets.graphutils import *
-from nosqlbiosets.qryutils import parseinputquery, Query
+from nosqlbiosets.qryutils import parseinputquery, prefixquery, Query
 from nosqlbiosets.uniprot.query import QueryUniProt
 
 db = "MongoDB"        # Elasticsearch support has not been implemented
 DATABASE = "biosets"  # MongoDB database
 
+# DrugBank drug-entity relations, and colors of the graph nodes
+RELATIONS = ["targets", "enzymes", "transporters", "carriers"]
+COLORS = {
+    "drug": 'yellowgreen',
+    "targets": 'orchid',
+    "enzymes": 'sienna',
+    "transporters": 'coral',
+    "carriers": 'blue'
+}
+
+
+# Aggregation pipelines shared by the sync and async query classes
+
+def drugbank_entity_aggq(uniprotid, etype):
+    # DrugBank target/enzyme id for given UniProt id
+    qc = {
+        etype+".polypeptide.external-identifiers.identifier": uniprotid}
+    return [
+        {"$match": qc},
+        {'$unwind': "$"+etype},
+        {'$unwind': "$"+etype+".polypeptide"},
+        {"$match": qc},
+        {"$limit": 1},
+        {"$project": {etype+".id": 1}}
+    ]
+
+
+def metabolites_protein_functions_aggq(mq):
+    # Functions of associated proteins for selected set of metabolites
+    return [
+        {'$match': mq},
+        {'$unwind':
+            {
+                'path': '$protein_associations.protein'
+            }},
+        {'$project': {
+            "accession": 1,
+            "protein_associations.protein": 1}},
+        {'$lookup': {
+            'from': DOCTYPE_PROTEIN,
+            'let': {'a': "$protein_associations.protein.protein_accession"},
+            'as': 'proteins',
+            'pipeline': [
+                {'$match': {
+                        "$expr": {"$eq": ["$accession", "$$a"]}
+                }},
+                {'$project': {
+                    "general_function": 1}}
+            ]
+        }},
+        {'$unwind': "$proteins"},
+        {'$group': {
+            "_id": "$proteins.general_function",
+            "count": {'$sum': 1}}},
+        {"$sort": {"count": -1}}
+    ]
+
 
 class QueryDrugBank(Query):
 
@@ -21,14 +80,7 @@ class QueryDrugBank(Query):
         :param qterm: partial drug name
         :return: list of possible names
         """
-        qc = {"$or": [
-            {"name": {
-                "$regex": "^%s" % qterm, "$options": "i"}},
-            {"abbreviation": {
-                "$regex": "^%s" % qterm, "$options": "i"}},
-            {"products.name": {
-                "$regex": "^%s" % qterm, "$options": "i"}}
-        ]}
+        qc = prefixquery(qterm)
         cr = self.query(qc, projection=['name'], **kwargs)
         return cr
 
@@ -77,17 +129,8 @@ class QueryDrugBank(Query):
         uniprotid = qryuniprot.dbc.mdbi[uniprotcollection].distinct(key,
                                                                     filter=qc)
         assert len(uniprotid) == 1
-        qc = {
-            etype+".polypeptide.external-identifiers.identifier": uniprotid[0]}
-        aggq = [
-            {"$match": qc},
-            {'$unwind': "$"+etype},
-            {'$unwind': "$"+etype+".polypeptide"},
-            {"$match": qc},
-            {"$limit": 1},
-            {"$project": {etype+".id": 1}}
-        ]
-        r = list(self.aggregate_query(aggq))
+        r = list(self.aggregate_query(drugbank_entity_aggq(uniprotid[0],
+                                                           etype)))
         assert 1 == len(r)
         return uniprotid[0], r[0][etype]["id"]
 
@@ -121,31 +164,106 @@ class QueryDrugBank(Query):
     def get_connections_graph(self, qc, connections, outfile=None):
         interactions = self.get_connections(qc, connections)
         graph = nx.MultiDiGraph(name=connections, query=json.dumps(qc))
-        colors = {
-            "drug": 'yellowgreen',
-            "targets": 'orchid',
-            "enzymes": 'sienna',
-            "transporters": 'coral',
-            "carriers": 'blue'
-        }
         _type = 'drug' if connections == 'drug-interactions' else connections
         for u, v in interactions:
             graph.add_node(u, type='drug', viz_color='green')
             graph.add_node(v,
                            type=_type,
-                           viz_color=colors[_type])
+                           viz_color=COLORS[_type])
             graph.add_edge(u, v)
         if outfile is not None:
             save_graph(graph, outfile)
         return graph
 
-    def get_allgraphs(self, qc):
-        connections = ["targets", "enzymes", "transporters", "carriers"]
-        graphs = []
-        for connection in connections:
-            graphs.append(self.get_connections_graph(qc, connection))
-        r = nx.compose_all(graphs)
-        return r
+    # Drug names and names of the related entities, for all relation
+    # types at once, with one aggregation query
+    def get_multirelation_connections(self, qc, relations=None):
+        relations = RELATIONS if relations is None else relations
+        project = {"_id": 0, "name": 1}
+        for relation in relations:
+            project[relation] = "$" + relation + ".name"
+        return self.aggregate_query([
+            {"$match": qc},
+            {"$project": project}
+        ])
+
+    # Multi-relation graph of the DrugBank entries selected by qc, built in
+    # one pass; edges are typed with the relation names, which are used
+    # as the edge keys, and entity nodes are typed with the relation names
+    def get_allgraphs(self, qc, relations=None, outfile=None):
+        relations = RELATIONS if relations is None else relations
+        graph = nx.MultiDiGraph(name=','.join(relations), query=json.dumps(qc))
+        for d in self.get_multirelation_connections(qc, relations):
+            u = d['name']
+            graph.add_node(u, type='drug', viz_color='green')
+            for relation in relations:
+                for v in d.get(relation) or []:
+                    _type = 'drug' if relation == 'drug-interactions' \
+                        else relation
+                    graph.add_node(v, type=_type, viz_color=COLORS[_type])
+                    graph.add_edge(u, v, key=relation, type=relation)
+        if outfile is not None:
+            save_graph(graph, outfile)
+        return graph
+
+
+class MetaboliteProteinEdges(object):
+    """ Metabolite -> edges and protein -> edges tables of the flat
+     metabolite-protein association collection, cached in memory for each
+     collection generation, see DBconnection.bump_generation().
+     Edge collection is saved when HMDB proteins are indexed with MongoDB """
+    tables = dict()  # (database, collection) -> (generation, tables)
+
+    def __init__(self, dbc, collection=DOCTYPE_EDGES):
+        self.dbc = dbc
+        self.collection = collection
+
+    def available(self):
+        return self.dbc.get_generation(self.collection) > 0
+
+    def adjacency(self):
+        key = self.dbc.index, self.collection
+        g = self.dbc.get_generation(self.collection)
+        if key in self.tables and self.tables[key][0] == g:
+            return self.tables[key][1]
+        metabolites, proteins = dict(), dict()
+        for e in self.dbc.mdbi[self.collection].find(
+                {}, projection={"_id": 0}):
+            metabolites.setdefault(e['metabolite'], []).append(e)
+            proteins.setdefault(e['protein'], []).append(e)
+        self.tables[key] = g, (metabolites, proteins)
+        return metabolites, proteins
+
+    def protein_functions(self, accessions):
+        """ Histogram of the general functions of the proteins
+        associated with given metabolites """
+        metabolites, _ = self.adjacency()
+        counts = Counter(e['function'] for acc in accessions
+                         for e in metabolites.get(acc, []))
+        return [{"_id": f, "count": n} for f, n in counts.most_common()]
+
+    def connected_metabolites(self, metabolites, max_associations=-1):
+        """ Metabolite-gene-metabolite triples for given
+        (accession, name) pairs of metabolites, in the same form as the
+        earlier aggregation results; gene names, types and names of the
+        connected metabolites are read from the protein entries
+        :param max_associations: proteins associated with more metabolites
+                                 are not included, if not -1
+        """
+        medges, pedges = self.adjacency()
+        r = set()
+        for acc, name in metabolites:
+            for e in medges.get(acc, []):
+                associations = pedges[e['protein']]
+                if max_associations != -1 and \
+                        len(associations) > max_associations:
+                    continue
+                for e2 in associations:
+                    if e2['metabolite_name'] != name:
+                        r.add((name, e['gene'], e['type'],
+                               e2['metabolite_name']))
+        return [{"m1": m1, "gene": gene, "type": type_, "m2": m2}
+                for m1, gene, type_, m2 in r]
 
 
 class QueryHMDB:
@@ -154,44 +272,31 @@ class QueryHMDB:
         self.index = index
         self.dbc = DBconnection(db, self.index, **kwargs)
         self.mdb = self.dbc.mdbi
+        self.edges = MetaboliteProteinEdges(self.dbc)
+
+    def _metabolites(self, mq):
+        # (accession, name) pairs of selected metabolites
+        cr = self.mdb[DOCTYPE_METABOLITE].find(
+            mq, projection={"_id": 0, "accession": 1, "name": 1})
+        return [(c['accession'], c.get('name')) for c in cr]
 
     def metabolites_protein_functions(self, mq):
         """
         Functions of associated proteins for selected set of Metabolites
         """
-        agpl = [
-            {'$match': mq},
-            {'$unwind':
-                {
-                    'path': '$protein_associations.protein'
-                }},
-            {'$project': {
-                "accession": 1,
-                "protein_associations.protein": 1}},
-            {'$lookup': {
-                'from': DOCTYPE_PROTEIN,
-                'let': {'a': "$protein_associations.protein.protein_accession"},
-                'as': 'proteins',
-                'pipeline': [
-                    {'$match': {
-                            "$expr": {"$eq": ["$accession", "$$a"]}
-                    }},
-                    {'$project': {
-                        "general_function": 1}}
-                ]
-            }},
-            {'$unwind': "$proteins"},
-            {'$group': {
-                "_id": "$proteins.general_function",
-                "count": {'$sum': 1}}},
-            {"$sort": {"count": -1}}
-        ]
+        if self.edges.available():
+            return self.edges.protein_functions(
+                [acc for acc, _ in self._metabolites(mq)])
+        agpl = metabolites_protein_functions_aggq(mq)
         r = self.mdb[DOCTYPE_METABOLITE].aggregate(agpl)
         return r
 
     def getconnectedmetabolites(self, qc, max_associations=-1):
         # Return pairs of connected metabolites
         # together with associated proteins and their types
+        if self.edges.available():
+            return self.edges.connected_metabolites(self._metabolites(qc),
+                                                    max_associations)
         graphlookup = True
         agpl = [
             {'$match': qc},
@@ -291,11 +396,15 @@ def savegraph(query, graphfile, connections='targets'):
                     ' in GraphML, GML, Cytoscape.js or d3js formats,'
                     ' see readme.md for details'
     :param connections: "targets", "enzymes", "transporters" or
-                              "carriers
+                              "carriers, or "all" for the graph of
+                              all four relations
     """
     qry = QueryDrugBank(db, DATABASE, 'drugbank')
     qc = parseinputquery(query)
-    g = qry.get_connections_graph(qc, connections, graphfile)
+    if connections == 'all':
+        g = qry.get_allgraphs(qc, outfile=graphfile)
+    else:
+        g = qry.get_connections_graph(qc, connections, graphfile)
     print(nx.info(g))
 
 
@@ -9,7 +9,7 @@ from nosqlbiosets.graphutils import neighbors_graph
 from nosqlbiosets.graphutils import remove_highly_connected_nodes
 from nosqlbiosets.graphutils import remove_small_subgraphs
 from nosqlbiosets.graphutils import save_graph
-from .queries import QueryDrugBank
+from .queries import QueryDrugBank, RELATIONS
 
 DrugBank = 'drugbank-5.1.8'  # MongoDB collection name
 MDBDB = 'pathdes'            # MongoDB database for the test queries
@@ -355,6 +355,12 @@ class TestQueryDrugBank(unittest.TestCase):
             g = self.qry.get_allgraphs(qc)
             self.assertAlmostEqual(g.number_of_edges(), nedges, delta=nedges/8)
             self.assertAlmostEqual(g.number_of_nodes(), nnodes, delta=nnodes/8)
+            g_ = nx.compose_all([self.qry.get_connections_graph(qc, relation)
+                                 for relation in RELATIONS])
+            self.assertEqual(set(g_.nodes), set(g.nodes))
+            self.assertEqual(set(g_.edges()), set(g.edges()))
+            assert all(k == d['type'] for _, _, k, d in
+                       g.edges(keys=True, data=True))
 
     def test_drug_enzymes_graph(self):
         qc = {"affected-organisms": {
@@ -0,0 +1,94 @@
+""" Asyncio counterparts of the DBconnection and Query classes,
+ with Motor and AsyncElasticsearch clients.
+ Independent queries, such as queries of different datasets,
+ can run concurrently in one event loop, with asyncio.gather() """
+# Server connection details are read from conf/dbservers.json file
+import json
+import logging
+
+from nosqlbiosets.dbutils import dbserversconf
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDBconnection(object):
+
+    def __init__(self, db, index, host=None, port=None):
+        """ Clients are created without connecting to the servers,
+        connections are made with the first requests """
+        self.db = db
+        self.index = index
+        conf = dbserversconf()
+        if db == 'Elasticsearch':
+            from elasticsearch import AsyncElasticsearch
+            if host is None:
+                host = conf['es_host']
+            if port is None:
+                port = conf['es_port'] if 'es_port' in conf else 9200
+            self.es = AsyncElasticsearch(hosts=[{"host": host,
+                                                 "port": int(port)}],
+                                         timeout=220)
+            logger.info("New async Elasticsearch client for '%s'" % host)
+        elif db == 'MongoDB':
+            from motor.motor_asyncio import AsyncIOMotorClient
+            if host is None:
+                host = conf['mongodb_host']
+            if port is None and 'mongodb_port' in conf:
+                port = conf['mongodb_port']
+            self.mc = AsyncIOMotorClient(
+                host, None if port is None else int(port))
+            self.mdbi = self.mc[index]
+            logger.info("New async MongoDB client for '%s'" % host)
+        else:
+            raise ValueError("Async queries are supported with"
+                             " MongoDB and Elasticsearch only")
+
+    async def close(self):
+        if self.db == 'Elasticsearch':
+            await self.es.close()
+        else:
+            self.mc.close()
+
+
+class AsyncQuery(object):
+
+    def __init__(self, dbtype, index, mdbcollection, dbc=None, **kwargs):
+        """
+        :param dbc: AsyncDBconnection object to share with other
+                    query objects, new connection is made if not set
+        """
+        self.index = index
+        self.mdbcollection = mdbcollection
+        self.dbc = dbc if dbc is not None else \
+            AsyncDBconnection(dbtype, index, **kwargs)
+
+    async def query(self, qc, projection=None, limit=0):
+        if self.dbc.db == 'Elasticsearch':
+            return await self.dbc.es.search(index=self.index, body=qc,
+                                            size=limit)
+        c = self.dbc.mdbi[self.mdbcollection].\
+            find(qc, projection=projection, limit=limit)
+        return await c.to_list(length=None)
+
+    async def count(self, qc, **kwargs):
+        if self.dbc.db == 'Elasticsearch':
+            r = await self.dbc.es.count(index=self.index, body=qc)
+            return r['count']
+        return await self.dbc.mdbi[self.mdbcollection].\
+            count_documents(qc, **kwargs)
+
+    async def distinct(self, key, qc=None, collection=None):
+        mcl = self.dbc.mdbi[collection or self.mdbcollection]
+        return await mcl.distinct(key, filter=qc)
+
+    async def aggregate_query(self, agpl, collection=None, **kwargs):
+        """ Run aggregation pipeline, on the default collection
+        or on given collection of the same database """
+        mcl = self.dbc.mdbi[collection or self.mdbcollection]
+        return await mcl.aggregate(agpl, **kwargs).to_list(length=None)
+
+    async def esquery(self, index, qc, size=10):
+        logger.debug("Querying '%s': %s" % (index, json.dumps(qc)))
+        r = await self.dbc.es.search(index=index, body=qc, size=size)
+        aggs = r["aggregations"] if "aggregations" in r else None
+        return r['hits']['hits'], r['hits']['total'], aggs
@@ -0,0 +1,470 @@
+""" Compact directed graphs with compressed sparse row (CSR) adjacency
+ arrays, for whole-database metabolite and interaction networks.
+ Nodes are integer coded, node names are kept in a list; edge labels,
+ such as reaction ids or relation types, are integer coded as well.
+ Graphs are immutable, filtering methods return new graphs """
+import copy
+import heapq
+from collections import deque
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, dijkstra
+
+import networkx as nx
+
+
+def _hashable(v):
+    # Edge label values are saved in a table, lists are saved as tuples
+    return tuple(v) if isinstance(v, list) else v
+
+
+def _labelvalue(v):
+    return list(v) if isinstance(v, tuple) else v
+
+
+def _networkx_edges(g):
+    # Undirected edges are returned in both directions
+    edges = g.edges(data=True)
+    if g.is_directed():
+        return edges
+    return [e for u, v, d in edges
+            for e in ([(u, v, d)] if u == v else [(u, v, d), (v, u, d)])]
+
+
+class CSRGraph(object):
+
+    def __init__(self, nodes, indptr, indices, edgelabels=None, labels=None,
+                 weights=None, **attr):
+        """
+        :param nodes: node names, node i is nodes[i]
+        :param indptr: successors of node i are indices[indptr[i]:indptr[i+1]]
+        :param indices: edge targets
+        :param edgelabels: label codes of the edges, indexes of labels list
+        :param labels: edge label values
+        :param weights: edge weights
+        :param attr: graph attributes, such as 'name' and 'query'
+        """
+        self.nodes = list(nodes)
+        self.nodeindex = {node: i for i, node in enumerate(self.nodes)}
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.edgelabels = None if edgelabels is None else \
+            np.asarray(edgelabels, dtype=np.int32)
+        self.labels = labels
+        self.weights = None if weights is None else \
+            np.asarray(weights, dtype=np.float64)
+        self.graph = attr
+        self._edgeorder = None  # input order -> edge index, see from_edges
+        self._sources = None
+        self._adjlists = None
+        self._radjlists = None  # adjacency lists of the reverse graph
+
+    @classmethod
+    def from_edges(cls, nodes, sources, targets, edgelabels=None,
+                   labels=None, weights=None, **attr):
+        """ Build graph from edge arrays of node indexes,
+        edges are sorted by their source nodes """
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int32)
+        order = np.argsort(sources, kind='stable')
+        counts = np.bincount(sources, minlength=len(nodes))
+        indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        if edgelabels is not None:
+            edgelabels = np.asarray(edgelabels)[order]
+        if weights is not None:
+            weights = np.asarray(weights)[order]
+        g = cls(nodes, indptr, targets[order], edgelabels, labels,
+                weights, **attr)
+        g._edgeorder = order
+        return g
+
+    @classmethod
+    def from_networkx(cls, g, labelattr=None, weight=None):
+        """ Convert NetworkX graphs, such as the graphs returned by
+        get_metabolite_network() and get_connections_graph() methods;
+        undirected edges are converted to edges in both directions
+        :param labelattr: edge attribute to save as edge labels
+        :param weight: edge attribute to save as edge weights
+        """
+        nodes = list(g.nodes())
+        nodeindex = {node: i for i, node in enumerate(nodes)}
+        sources, targets, codes, weights = [], [], [], []
+        labels, labelcodes = [], dict()
+        for u, v, d in _networkx_edges(g):
+            sources.append(nodeindex[u])
+            targets.append(nodeindex[v])
+            if labelattr is not None:
+                value = _hashable(d.get(labelattr))
+                if value not in labelcodes:
+                    labelcodes[value] = len(labels)
+                    labels.append(value)
+                codes.append(labelcodes[value])
+            if weight is not None:
+                weights.append(d.get(weight, 1.0))
+        return cls.from_edges(nodes, sources, targets,
+                              codes if labelattr is not None else None,
+                              labels if labelattr is not None else None,
+                              weights if weight is not None else None,
+                              **g.graph)
+
+    def weights_from_networkx(self, g, weight):
+        """ Edge weights array for the graph converted from NetworkX
+        graph g, read from edge attribute weight, default weight is 1 """
+        w = [d.get(weight, 1.0) for _, _, d in _networkx_edges(g)]
+        return np.asarray(w, dtype=np.float64)[self._edgeorder]
+
+    def with_weights(self, weights):
+        """ Graph sharing the node and edge arrays with this graph,
+        with given edge weights """
+        g = copy.copy(self)
+        g.weights = None if weights is None else \
+            np.asarray(weights, dtype=np.float64)
+        return g
+
+    def degree_weights(self):
+        """ Degree centrality of target nodes as edge weights,
+        see graphutils.set_degree_as_weight() """
+        n = self.number_of_nodes()
+        return self.degree()[self.indices] / max(n - 1, 1)
+
+    def to_networkx(self, labelattr='label', multigraph=False):
+        """ Convert to NetworkX DiGraph or MultiDiGraph """
+        g = nx.MultiDiGraph(**self.graph) if multigraph \
+            else nx.DiGraph(**self.graph)
+        g.add_nodes_from(self.nodes)
+        sources = self.sources()
+        edges = []
+        for e in range(self.number_of_edges()):
+            d = dict()
+            if self.edgelabels is not None:
+                d[labelattr] = _labelvalue(self.labels[self.edgelabels[e]])
+            if self.weights is not None:
+                d['weight'] = float(self.weights[e])
+            edges.append((self.nodes[sources[e]],
+                          self.nodes[self.indices[e]], d))
+        g.add_edges_from(edges)
+        return g
+
+    def number_of_nodes(self):
+        return len(self.nodes)
+
+    def number_of_edges(self):
+        return len(self.indices)
+
+    def sources(self):
+        """ Source node indexes of the edges """
+        if self._sources is None:
+            self._sources = np.repeat(
+                np.arange(self.number_of_nodes(), dtype=np.int32),
+                np.diff(self.indptr))
+        return self._sources
+
+    def out_degree(self):
+        return np.diff(self.indptr)
+
+    def in_degree(self):
+        return np.bincount(self.indices, minlength=self.number_of_nodes())
+
+    def degree(self):
+        return self.out_degree() + self.in_degree()
+
+    def successors(self, node):
+        i = self.nodeindex[node]
+        return [self.nodes[j]
+                for j in self.indices[self.indptr[i]:self.indptr[i + 1]]]
+
+    def edge_label(self, e):
+        """ Label value of edge e """
+        return _labelvalue(self.labels[self.edgelabels[e]])
+
+    def tocsr(self, weighted=True):
+        """ SciPy sparse matrix of the graph """
+        data = self.weights if weighted and self.weights is not None \
+            else np.ones(self.number_of_edges())
+        n = self.number_of_nodes()
+        return csr_matrix((data, self.indices, self.indptr), shape=(n, n))
+
+    def reverse(self):
+        """ Graph with edge directions reversed """
+        return CSRGraph.from_edges(self.nodes, self.indices, self.sources(),
+                                   self.edgelabels, self.labels, self.weights,
+                                   **self.graph)
+
+    def neighbors_of(self, frontier):
+        """ Successors of the nodes in frontier array, with repetitions """
+        starts = self.indptr[frontier]
+        counts = self.indptr[np.asarray(frontier) + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + \
+            np.arange(counts.sum())
+        return self.indices[offsets]
+
+    def bfs(self, source, depth_limit=None):
+        """ Nodes reachable from source in breadth-first order,
+        returns list of nodes and list of their depths """
+        n = self.number_of_nodes()
+        depth = np.full(n, -1, dtype=np.int32)
+        s = self.nodeindex[source]
+        depth[s] = 0
+        order = [np.array([s])]
+        frontier, d = order[0], 0
+        while len(frontier) and (depth_limit is None or d < depth_limit):
+            d += 1
+            nbrs = self.neighbors_of(frontier)
+            frontier = np.unique(nbrs[depth[nbrs] == -1])
+            depth[frontier] = d
+            order.append(frontier)
+        order = np.concatenate(order)
+        return [self.nodes[i] for i in order], depth[order].tolist()
+
+    def subgraph(self, mask):
+        """ Subgraph of the nodes selected by boolean mask array """
+        mask = np.asarray(mask, dtype=bool)
+        newindex = np.cumsum(mask) - 1
+        sources = self.sources()
+        emask = mask[sources] & mask[self.indices]
+        nodes = [node for node, keep in zip(self.nodes, mask) if keep]
+        return CSRGraph.from_edges(
+            nodes, newindex[sources[emask]], newindex[self.indices[emask]],
+            None if self.edgelabels is None else self.edgelabels[emask],
+            self.labels,
+            None if self.weights is None else self.weights[emask],
+            **self.graph)
+
+    def filter_degree(self, min_degree=None, max_degree=None):
+        """ Subgraph of the nodes with total degrees in given range """
+        degree = self.degree()
+        mask = np.ones(self.number_of_nodes(), dtype=bool)
+        if min_degree is not None:
+            mask &= degree >= min_degree
+        if max_degree is not None:
+            mask &= degree <= max_degree
+        return self.subgraph(mask)
+
+    def components(self):
+        """ Weakly connected components;
+        returns number of components and component labels of the nodes """
+        return connected_components(self.tocsr(), directed=True,
+                                    connection='weak')
+
+    def filter_components(self, min_nodes):
+        """ Subgraph of the weakly connected components with at least
+        min_nodes nodes """
+        _, labels = self.components()
+        return self.subgraph(np.bincount(labels)[labels] >= min_nodes)
+
+    def shortest_path(self, source, target, weighted=True):
+        """ Shortest path from source to target with Dijkstra's algorithm,
+        returns path length and list of path nodes, or (inf, None) """
+        s, t = self.nodeindex[source], self.nodeindex[target]
+        dist, pred = dijkstra(self.tocsr(weighted), indices=s,
+                              return_predecessors=True,
+                              unweighted=not weighted)
+        if np.isinf(dist[t]):
+            return np.inf, None
+        path = [t]
+        while path[-1] != s:
+            path.append(pred[path[-1]])
+        return float(dist[t]), [self.nodes[i] for i in reversed(path)]
+
+    def distances(self, source, weighted=True, limit=np.inf):
+        """ Shortest path lengths from source to nodes reachable
+        within limit """
+        s = self.nodeindex[source]
+        dist = dijkstra(self.tocsr(weighted), indices=s,
+                        unweighted=not weighted, limit=limit)
+        reachable = np.flatnonzero(~np.isinf(dist))
+        return {self.nodes[i]: float(dist[i]) for i in reachable}
+
+    def eigenvector_centrality(self, max_iter=100, tol=1e-4):
+        """ Eigenvector centralities of the nodes, with respect to in-edges,
+        computed by sparse matrix power iteration with (A + I), as in
+        NetworkX eigenvector_centrality(), which also converges for
+        graphs that are not strongly connected; iterations stop when
+        sum of the changes is less than tol or after max_iter iterations
+        """
+        n = self.number_of_nodes()
+        at = self.tocsr(weighted=False).T.tocsr()
+        x = np.full(n, 1.0 / max(n, 1))
+        for _ in range(max_iter):
+            xlast = x
+            x = xlast + at.dot(xlast)
+            x /= np.linalg.norm(x) or 1.0
+            if np.abs(x - xlast).sum() < tol:
+                break
+        return x
+
+    def bfs_beam_edges(self, source, values, width, topsuccessors=None):
+        """ Edges of breadth-first search from source node index, where
+        only the width successors with highest values are followed,
+        as in NetworkX bfs_beam_edges()
+        :param values: node values array
+        :param topsuccessors: dictionary to save selected successors
+               of visited nodes, for reuse in following searches
+        """
+        if topsuccessors is None:
+            topsuccessors = dict()
+        indptr, indices = self._adjacency()
+        visited = {source}
+        queue = deque([source])
+        while queue:
+            u = queue.popleft()
+            if u not in topsuccessors:
+                successors = list(dict.fromkeys(
+                    indices[indptr[u]:indptr[u + 1]]))
+                successors.sort(key=lambda v: values[v], reverse=True)
+                topsuccessors[u] = successors[:width]
+            for v in topsuccessors[u]:
+                if v not in visited:
+                    visited.add(v)
+                    yield u, v
+                    queue.append(v)
+
+    def _adjacency(self):
+        # Python lists are faster than NumPy arrays for node by node searches
+        if self._adjlists is None:
+            self._adjlists = self.indptr.tolist(), self.indices.tolist()
+        return self._adjlists
+
+    def _reverse_adjacency(self):
+        if self._radjlists is None:
+            self._radjlists = self.reverse()._adjacency()
+        return self._radjlists
+
+    def bidirectional_shortest_path(self, source, target, maxhops=None,
+                                    exclude=None):
+        """ Shortest path from source to target, ignoring edge weights,
+        with breadth-first searches from both ends; the smaller frontier
+        is expanded one level at a time, until the searches meet
+        :param maxhops: maximum number of edges on the path
+        :param exclude: nodes not to include in the path
+        """
+        for node in (source, target):
+            if node not in self.nodeindex:
+                raise nx.NodeNotFound("Node %s not in graph" % node)
+        s, t = self.nodeindex[source], self.nodeindex[target]
+        excluded = {self.nodeindex[node] for node in exclude or []
+                    if node in self.nodeindex} - {s, t}
+        # Predecessors on the forward search, successors on the backward
+        pred, succ = {s: None}, {t: None}
+        ffrontier, bfrontier = [s], [t]
+        hops = 0
+        meet = s if s == t else None
+        while meet is None and ffrontier and bfrontier and \
+                (maxhops is None or hops < maxhops):
+            forward = len(ffrontier) <= len(bfrontier)
+            indptr, indices = self._adjacency() if forward \
+                else self._reverse_adjacency()
+            visited, other = (pred, succ) if forward else (succ, pred)
+            frontier = []
+            for u in (ffrontier if forward else bfrontier):
+                for v in indices[indptr[u]:indptr[u + 1]]:
+                    if v in visited or v in excluded:
+                        continue
+                    visited[v] = u
+                    frontier.append(v)
+                    if meet is None and v in other:
+                        meet = v
+            if forward:
+                ffrontier = frontier
+            else:
+                bfrontier = frontier
+            hops += 1
+        if meet is None:
+            raise nx.NetworkXNoPath("No path from %s to %s"
+                                    % (source, target))
+        path = [meet]
+        while pred[path[-1]] is not None:
+            path.append(pred[path[-1]])
+        path.reverse()
+        while succ[path[-1]] is not None:
+            path.append(succ[path[-1]])
+        return [self.nodes[i] for i in path]
+
+    def _spurpath(self, s, t, weights, bannednodes, bannededges, maxhops):
+        """ Dijkstra search on (node, hops) states; a state is skipped if
+        the node was reached before with the same or less hops, since
+        earlier states have less or equal costs """
+        indptr, indices = self._adjacency()
+        besthops = dict()
+        heap = [(0.0, 0, s, None)]
+        while heap:
+            cost, hops, u, prev = heapq.heappop(heap)
+            if u in besthops and besthops[u][0] <= hops:
+                continue
+            besthops[u] = hops, prev
+            if u == t:
+                path = [t]
+                state = prev
+                while state is not None:
+                    path.append(state[0])
+                    state = state[1]
+                return cost, path[::-1]
+            if maxhops is not None and hops >= maxhops:
+                continue
+            state = (u, prev)
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                if v in bannednodes or (u, v) in bannededges:
+                    continue
+                if v in besthops and besthops[v][0] <= hops + 1:
+                    continue
+                w = 1.0 if weights is None else weights[e]
+                heapq.heappush(heap, (cost + w, hops + 1, v, state))
+        return None
+
+    def _edgecost(self, weights, u, v):
+        # Least weight of the edges from u to v
+        indptr, indices = self._adjacency()
+        return min(1.0 if weights is None else weights[e]
+                   for e in range(indptr[u], indptr[u + 1])
+                   if indices[e] == v)
+
+    def shortest_simple_paths(self, source, target, weighted=True,
+                              maxhops=None, exclude=None):
+        """ Generator of simple paths from source to target, in order of
+        their lengths, with Yen's k-shortest paths algorithm.
+        Constraints are applied during search
+        :param maxhops: maximum number of edges on the paths
+        :param exclude: nodes not to include in the paths,
+                        such as side compounds of metabolite networks
+        """
+        for node in (source, target):
+            if node not in self.nodeindex:
+                raise nx.NodeNotFound("Node %s not in graph" % node)
+        s, t = self.nodeindex[source], self.nodeindex[target]
+        weights = self.weights.tolist() \
+            if weighted and self.weights is not None else None
+        excluded = {self.nodeindex[node] for node in exclude or []
+                    if node in self.nodeindex} - {s, t}
+        first = self._spurpath(s, t, weights, excluded, set(), maxhops)
+        if first is None:
+            raise nx.NetworkXNoPath("No path from %s to %s"
+                                    % (source, target))
+        paths = [first[1]]
+        candidates = []
+        seen = {tuple(first[1])}
+        while True:
+            path = paths[-1]
+            yield [self.nodes[i] for i in path]
+            rootcost = 0.0
+            for i in range(len(path) - 1):
+                root = path[:i + 1]
+                bannededges = {(p[i], p[i + 1]) for p in paths
+                               if len(p) > i + 1 and p[:i + 1] == root}
+                bannednodes = excluded.union(root[:-1])
+                spur = self._spurpath(
+                    path[i], t, weights, bannednodes, bannededges,
+                    None if maxhops is None else maxhops - i)
+                if spur is not None:
+                    newpath = root[:-1] + spur[1]
+                    if tuple(newpath) not in seen:
+                        seen.add(tuple(newpath))
+                        heapq.heappush(candidates,
+                                       (rootcost + spur[0], len(newpath),
+                                        newpath))
+                rootcost += self._edgecost(weights, path[i], path[i + 1])
+            if not candidates:
+                return
+            paths.append(heapq.heappop(candidates)[2])
@@ -14,6 +14,32 @@ ch = logging.StreamHandler()
 ch.setLevel(logging.INFO)
 logger.addHandler(ch)
 
+NEO4J_BATCHSIZE = 10000  # Number of rows written in a Neo4j transaction
+# MongoDB collection or Elasticsearch index for the generation stamps
+# of the indexed datasets, used for invalidating query result caches
+GENERATIONS = "index_generations"
+
+
+def dbserversconf():
+    """ Read database server connection details from dbservers.json file """
+    try:
+        # TODO: option to specify config file
+        cfgfile = "./dbservers.json"
+        if not os.path.exists(cfgfile):
+            if os.path.exists("./conf/dbservers.json"):
+                cfgfile = "./conf/dbservers.json"
+            elif os.path.exists("../conf/dbservers.json"):
+                cfgfile = "../conf/dbservers.json"
+            else:
+                cfgfile = "../../conf/dbservers.json"
+        logger.info("Servers configuration file: %s" % cfgfile)
+        with open(cfgfile, "r") as cfgf:
+            conf = json.load(cfgf)
+    except IOError:
+        conf = {"es_host": "localhost", "es_port": 9200,
+                "mongodb_host": "localhost", "mongodb_port": 27017}
+    return conf
+
 
 class DBconnection(object):
     i = 0  # counter for the number of objects indexed
@@ -26,22 +52,7 @@ class DBconnection(object):
         self.db = db
         if port is not None and not isinstance(port, int):
             port = int(port)
-        try:
-            # TODO: option to specify config file
-            cfgfile = "./dbservers.json"
-            if not os.path.exists(cfgfile):
-                if os.path.exists("./conf/dbservers.json"):
-                    cfgfile = "./conf/dbservers.json"
-                elif os.path.exists("../conf/dbservers.json"):
-                    cfgfile = "../conf/dbservers.json"
-                else:
-                    cfgfile = "../../conf/dbservers.json"
-            logger.info("Servers configuration file: %s" % cfgfile)
-            with open(cfgfile, "r") as cfgf:
-                conf = json.load(cfgf)
-        except IOError:
-            conf = {"es_host": "localhost", "es_port": 9200,
-                    "mongodb_host": "localhost", "mongodb_port": 27017}
+        conf = dbserversconf()
         if db == 'Elasticsearch':
             if host is None:
                 host = conf['es_host']
@@ -71,6 +82,10 @@ class DBconnection(object):
                                                auth=basic_auth(user, password))
             logger.info("New Neo4j connection to host '%s'" % host)
             self.neo4jc = self.driver.session()
+        elif db == 'Neo4jCSV':  # No server connection, node and relationship
+            # files for the Neo4j bulk importer are saved in folder 'index'
+            from nosqlbiosets.neo4jimport import Neo4jImportFiles
+            self.neo4jfiles = Neo4jImportFiles(index)
         elif db == "MongoDB":
             if host is None:
                 host = conf['mongodb_host']
@@ -120,6 +135,60 @@ class DBconnection(object):
                         logger.error(r['error']['reason'])
                         raise ElasticsearchException(r['error']['reason'])
 
+    def neo4j_batchwrite(self, query, rows, batchsize=NEO4J_BATCHSIZE):
+        """ Run given 'UNWIND $rows AS row ...' query for the rows,
+         in explicit transactions of 'batchsize' rows each """
+        n = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batchsize:
+                n += self._neo4j_writebatch(query, batch)
+                batch = []
+        if len(batch) > 0:
+            n += self._neo4j_writebatch(query, batch)
+        return n
+
+    def _neo4j_writebatch(self, query, batch):
+        with self.neo4jc.begin_transaction() as tx:
+            tx.run(query, rows=batch)
+        self.reportprogress(1)
+        return len(batch)
+
+    def neo4j_deletenodes(self, label, batchsize=NEO4J_BATCHSIZE):
+        """ Delete nodes with given label, and their relationships,
+         in transactions of 'batchsize' nodes each """
+        q = "MATCH (a:%s) WITH a LIMIT $n DETACH DELETE a" \
+            " RETURN count(*) AS n" % label
+        n = batchsize
+        while n == batchsize:
+            with self.neo4jc.begin_transaction() as tx:
+                n = tx.run(q, n=batchsize).single()['n']
+
+    def get_generation(self, name):
+        """ Generation stamp of given MongoDB collection or ES index """
+        if self.db == 'Elasticsearch':
+            r = self.es.get(index=GENERATIONS, doc_type='_doc', id=name,
+                            ignore=404)
+            g = r['_source']['generation'] if r.get('found') else 0
+        else:
+            r = self.mdbi[GENERATIONS].find_one({"_id": name})
+            g = r['generation'] if r is not None else 0
+        return g
+
+    def bump_generation(self, name):
+        """ Update generation stamp of given MongoDB collection or ES index,
+         indexers should call this method after each reload """
+        if self.db == 'Elasticsearch':
+            g = self.get_generation(name) + 1
+            self.es.index(index=GENERATIONS, doc_type='_doc', id=name,
+                          body={"generation": g})
+        else:
+            self.mdbi[GENERATIONS].update_one(
+                {"_id": name}, {"$inc": {"generation": 1}}, upsert=True)
+            g = self.get_generation(name)
+        return g
+
     def close(self):
         if self.db == 'Elasticsearch':
             self.es.indices.refresh(index=self.index)
@@ -122,6 +122,7 @@ def main(db, infile, mdbdb, mdbcollection, esindex,
                            recreateindex=recreateindex)
         read_and_index_faers_records(infile, dbc, es_index_reports)
         dbc.es.indices.refresh(index=esindex)
+        dbc.bump_generation(esindex)
     elif db == "MongoDB":
         dbc = DBconnection(db, mdbdb, mdbcollection=mdbcollection,
                            host=host, port=port, user=user, password=password,
@@ -129,6 +130,7 @@ def main(db, infile, mdbdb, mdbcollection, esindex,
         read_and_index_faers_records(infile, dbc.mdbi[mdbcollection],
                                      mongodb_index_reports)
         mongodb_indices(dbc.mdbi[mdbcollection])
+        dbc.bump_generation(mdbcollection)
 
 
 if __name__ == '__main__':
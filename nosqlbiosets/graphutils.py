@@ -1,7 +1,25 @@
-""" Methods to return NetworkX graphs in Cytoscape.js or D3js formats """
+""" Methods to save NetworkX graphs in Cytoscape.js, D3js or other formats,
+ and graph search/filter methods """
+import gzip
+import itertools
 import json
+import weakref
 
 import networkx as nx
+import numpy as np
+from scipy.signal import fftconvolve
+
+from nosqlbiosets.csrgraph import CSRGraph
+
+# Compact copies of NetworkX graphs, with their degree based weights,
+# saved for the graph versions they were created
+_csrgraphs = weakref.WeakKeyDictionary()
+# Eigenvector centralities of NetworkX graphs, with selected successors
+# of the nodes visited by beam searches
+_centralities = weakref.WeakKeyDictionary()
+# Node positions are computed for Cytoscape.js graph files
+# with this many nodes or more, if not selected otherwise
+PRESET_LAYOUT_MINNODES = 1000
 
 
 def networkx2d3_json(networkxgraph):
@@ -15,24 +33,245 @@ def networkx2d3_json(networkxgraph):
     return d3
 
 
-# Save NetworkX graph in one of four formats.
-# Format is selected based on the file extension of the given output file.
+def _elements(items):
+    # Streams JSON array of items, one item per line
+    yield "["
+    for i, item in enumerate(items):
+        yield ("\n" if i == 0 else ",\n") + json.dumps(item)
+    yield "\n]"
+
+
+def write_d3_json(graph, f):
+    """ Write graph in D3js format, see networkx2d3_json(),
+    nodes and links are written one by one """
+    f.write('{"nodes": ')
+    f.writelines(_elements({"id": node, "label": node} for node in graph))
+    f.write(', "links": ')
+    f.writelines(_elements({"source": u, "target": v}
+                           for u, v in graph.edges()))
+    f.write("}\n")
+
+
+def write_cytoscape_json(graph, f, positions=None):
+    """ Write graph in Cytoscape.js format, output is the same as
+    NetworkX cytoscape_data() output, nodes and edges are written
+    one by one
+    :param positions: dictionary of nodes to (x, y) positions,
+                      saved as 'position' of the node elements
+    """
+    def nodes():
+        for node, d in graph.nodes(data=True):
+            d = dict(d)
+            d.update({"id": str(node), "value": node, "name": str(node)})
+            if positions is None:
+                yield {"data": d}
+            else:
+                x, y = positions[node]
+                yield {"data": d, "position": {"x": x, "y": y}}
+
+    def edges():
+        if graph.is_multigraph():
+            for u, v, k, d in graph.edges(keys=True, data=True):
+                d = dict(d)
+                d.update({"source": u, "target": v, "key": k})
+                yield {"data": d}
+        else:
+            for u, v, d in graph.edges(data=True):
+                d = dict(d)
+                d.update({"source": u, "target": v})
+                yield {"data": d}
+
+    f.write('{"data": %s, "directed": %s, "multigraph": %s, '
+            '"elements": {"nodes": ' %
+            (json.dumps(list(graph.graph.items())),
+             json.dumps(graph.is_directed()),
+             json.dumps(graph.is_multigraph())))
+    f.writelines(_elements(nodes()))
+    f.write(', "edges": ')
+    f.writelines(_elements(edges()))
+    f.write("}}\n")
+
+
+def _repulsion(pos, k, gridsize):
+    # Fruchterman-Reingold repulsive forces, k^2/d, approximated by
+    # convolution of node counts on a grid with the force kernel;
+    # nodes in the same grid cell are pushed away from the cell center
+    lo = pos.min(axis=0)
+    cellsize = (pos.max(axis=0) - lo).max() / gridsize + 1e-9
+    cells = np.minimum(((pos - lo) / cellsize).astype(np.int64),
+                       gridsize - 1)
+    flat = cells[:, 0] * gridsize + cells[:, 1]
+    counts = np.bincount(flat, minlength=gridsize * gridsize)
+    d = np.arange(1 - gridsize, gridsize) * cellsize
+    dx, dy = np.meshgrid(d, d, indexing='ij')
+    r2 = dx * dx + dy * dy
+    r2[gridsize - 1, gridsize - 1] = np.inf
+    density = counts.reshape(gridsize, gridsize).astype(np.float64)
+    centers = np.column_stack([np.bincount(flat, pos[:, axis], len(counts))
+                               for axis in (0, 1)]) / \
+        np.maximum(counts, 1)[:, None]
+    offsets = pos - centers[flat]
+    incell = k * k * (counts[flat] - 1) / \
+        ((offsets * offsets).sum(axis=1) + cellsize * cellsize / 4)
+    disp = offsets * incell[:, None]
+    for axis, dd in enumerate((dx, dy)):
+        field = fftconvolve(density, k * k * dd / r2, mode='same')
+        disp[:, axis] += field[cells[:, 0], cells[:, 1]]
+    return disp
+
+
+def layout_positions(graph, iterations=50, gridsize=None, seed=0,
+                     scale=1000.0):
+    """ Force-directed (Fruchterman-Reingold) layout computed with NumPy;
+    repulsive forces are approximated on a grid, attractive forces are
+    computed along the edges; returns dictionary of nodes to (x, y)
+    positions in [0, scale] range
+    """
+    cg = csrgraph(graph)
+    n = cg.number_of_nodes()
+    if n == 0:
+        return dict()
+    pos = np.random.RandomState(seed).uniform(0, 1, (n, 2))
+    sources, targets = cg.sources(), cg.indices
+    k = 1.0 / np.sqrt(n)
+    if gridsize is None:
+        gridsize = int(np.clip(2 * np.sqrt(n), 16, 256))
+    t = 0.1  # maximum displacement, decreases linearly
+    for i in range(iterations):
+        disp = _repulsion(pos, k, gridsize)
+        delta = pos[sources] - pos[targets]
+        dist = np.sqrt((delta * delta).sum(axis=1)) + 1e-9
+        force = delta * (dist / k)[:, None]
+        for axis in (0, 1):
+            disp[:, axis] += np.bincount(targets, force[:, axis], n) - \
+                np.bincount(sources, force[:, axis], n)
+        length = np.sqrt((disp * disp).sum(axis=1)) + 1e-9
+        step = t * (1 - i / float(iterations))
+        pos += disp * (np.minimum(length, step) / length)[:, None]
+    pos -= pos.min(axis=0)
+    pos *= scale / (pos.max() or 1.0)
+    return {node: (float(x), float(y)) for node, (x, y) in
+            zip(cg.nodes, pos)}
+
+
+def _strtable(strings):
+    # UTF-8 bytes of the strings, with their end offsets
+    data = [s.encode('utf-8') for s in strings]
+    offsets = np.cumsum([len(b) for b in data], dtype=np.int64)
+    return np.frombuffer(b"".join(data), dtype=np.uint8), offsets
+
+
+def _fromstrtable(data, offsets):
+    data = data.tobytes()
+    starts = [0] + offsets[:-1].tolist()
+    return [data[i:j].decode('utf-8') for i, j in zip(starts,
+                                                      offsets.tolist())]
+
+
+def save_npz(graph, outfile):
+    """ Save graph as NumPy npz file of node and edge arrays,
+    node names and node/edge attributes are saved as JSON strings
+    in a string table, repeated attributes are saved once """
+    strings, codes = [], dict()
+
+    def code(obj):
+        s = json.dumps(obj, sort_keys=True)
+        if s not in codes:
+            codes[s] = len(strings)
+            strings.append(s)
+        return codes[s]
+    nodes = list(graph)
+    nodeindex = {node: i for i, node in enumerate(nodes)}
+    n, m = len(nodes), graph.number_of_edges()
+    nodenames = np.fromiter((code(node) for node in nodes), np.int32, n)
+    nodeattrs = np.fromiter((code(d) for _, d in graph.nodes(data=True)),
+                            np.int32, n)
+    sources = np.empty(m, dtype=np.int32)
+    targets = np.empty(m, dtype=np.int32)
+    edgeattrs = np.empty(m, dtype=np.int32)
+    for e, (u, v, d) in enumerate(graph.edges(data=True)):
+        sources[e], targets[e], edgeattrs[e] = \
+            nodeindex[u], nodeindex[v], code(d)
+    meta = code({"graph": graph.graph, "directed": graph.is_directed(),
+                 "multigraph": graph.is_multigraph()})
+    data, offsets = _strtable(strings)
+    with open(outfile, "wb") as f:
+        np.savez_compressed(f, nodes=nodenames, nodeattrs=nodeattrs,
+                            sources=sources, targets=targets,
+                            edgeattrs=edgeattrs, meta=np.int32(meta),
+                            strings=data, offsets=offsets)
+
+
+def load_npz(infile, csr=False):
+    """ Read graph saved with save_npz(), returns NetworkX graph,
+    or CSRGraph with edge attributes as edge labels if csr is True """
+    with np.load(infile) as npz:
+        strings = _fromstrtable(npz['strings'], npz['offsets'])
+        meta = json.loads(strings[int(npz['meta'])])
+        nodes = [json.loads(strings[i]) for i in npz['nodes'].tolist()]
+        if csr:
+            labels = [json.loads(s) for s in strings]
+            return CSRGraph.from_edges(nodes, npz['sources'], npz['targets'],
+                                       npz['edgeattrs'], labels,
+                                       **meta['graph'])
+        if meta['multigraph']:
+            graph = nx.MultiDiGraph() if meta['directed'] \
+                else nx.MultiGraph()
+        else:
+            graph = nx.DiGraph() if meta['directed'] else nx.Graph()
+        graph.graph.update(meta['graph'])
+        attrs = dict()  # string table index -> attributes
+
+        def attr(i):
+            if i not in attrs:
+                attrs[i] = json.loads(strings[i])
+            return attrs[i]
+        graph.add_nodes_from((node, attr(i)) for node, i in
+                             zip(nodes, npz['nodeattrs'].tolist()))
+        graph.add_edges_from(
+            (nodes[u], nodes[v], dict(attr(i))) for u, v, i in
+            zip(npz['sources'].tolist(), npz['targets'].tolist(),
+                npz['edgeattrs'].tolist()))
+    return graph
+
+
+# Save NetworkX graph in one of five formats.
+# Format is selected based on the file extension of the given output file,
+# after removing the .gz extension if any, files are then gzip compressed.
 # If the file name ends with .xml suffix [GraphML](
 #    https://en.wikipedia.org/wiki/GraphML) format is selected,
 # If the file name ends with .d3.json extension graph is saved in
 # a form easier to read with [D3js](d3js.org),
 # If the file name ends with .json extension graph is saved in
-# [Cytoscape.js](js.cytoscape.org) graph format,
+# [Cytoscape.js](js.cytoscape.org) graph format, with node positions
+# if layout is True, or if layout is None and graph has at least
+# PRESET_LAYOUT_MINNODES nodes, see layout_positions(),
+# If the file name ends with .npz extension graph is saved in compact
+# NumPy format, see save_npz(),
 # Otherwise it is saved in GML format
-def save_graph(graph, outfile):
-    if outfile.endswith(".xml"):
+def save_graph(graph, outfile, layout=None):
+    fmt = outfile[:-3] if outfile.endswith(".gz") else outfile
+    if fmt.endswith(".xml"):
         nx.write_graphml(graph, outfile)
-    elif outfile.endswith(".d3js.json"):
-        cygraph = networkx2d3_json(graph)
-        json.dump(cygraph, open(outfile, "w"), indent=4)
-    elif outfile.endswith(".json"):
-        cygraph = nx.readwrite.cytoscape_data(graph)
-        json.dump(cygraph, open(outfile, "w"), indent=4)
+    elif fmt.endswith(".json"):
+        if outfile.endswith(".gz"):
+            f = gzip.open(outfile, "wt", encoding="utf-8")
+        else:
+            f = open(outfile, "w", encoding="utf-8")
+        with f:
+            if fmt.endswith(".d3js.json"):
+                write_d3_json(graph, f)
+            else:
+                if layout is None:
+                    layout = graph.number_of_nodes() >= \
+                        PRESET_LAYOUT_MINNODES
+                positions = layout_positions(graph) if layout else None
+                write_cytoscape_json(graph, f, positions)
+    elif fmt.endswith(".npz"):
+        if outfile.endswith(".gz"):
+            raise ValueError("npz files are saved compressed, use file"
+                             " names ending with '.npz': %s" % outfile)
+        save_npz(graph, outfile)
     else:  # Assume GML format
         nx.write_gml(graph, outfile)
     print('Network file saved: ' + outfile)
@@ -48,73 +287,137 @@ def set_degree_as_weight(g):
         g[u][v]['weight'] = d[v]
 
 
-def shortest_paths(dg, source, target, k=None, cutoff=10,
-                   weight=None, degreeasweight=False):
-    # NetworkX shortest_simple_paths function returns paths generator
-    # for the input graph from source to target starting from shortest ones
+def graph_version(g):
+    """ Version of NetworkX graph g; a hash of the nodes and adjacency
+    lists, changes when nodes or edges are added or removed,
+    edge attribute updates are not detected """
+    return g.number_of_nodes(), g.number_of_edges(), \
+        hash(tuple((u, tuple(nbrs)) for u, nbrs in g.adjacency()))
+
+
+def invalidate(g):
+    """ Remove cached compact copy and centralities of NetworkX graph g """
+    _csrgraphs.pop(g, None)
+    _centralities.pop(g, None)
+
+
+def csrgraph(g, degreeasweight=False):
+    """ Compact copy of NetworkX graph g, cached until g is updated,
+    see graph_version(); with degreeasweight, edge weights are
+    degree centralities of the target nodes """
+    version = graph_version(g)
+    cached = _csrgraphs.get(g)
+    if cached is None or cached[0] != version:
+        cached = version, CSRGraph.from_networkx(g), None
+        _csrgraphs[g] = cached
+    cg = cached[1]
     if degreeasweight:
-        dg = dg.copy()
-        set_degree_as_weight(dg)
-        weight = 'weight'
-    gr = nx.shortest_simple_paths(dg, source=source, target=target,
-                                  weight=weight)
+        if cached[2] is None:
+            cached = version, cg, cg.with_weights(cg.degree_weights())
+            _csrgraphs[g] = cached
+        cg = cached[2]
+    return cg
+
+
+def shortest_paths(dg, source, target, k=None, cutoff=10,
+                   weight=None, degreeasweight=False, exclude=None):
+    """ Shortest simple paths from source to target, shortest ones first,
+    with Yen's k-shortest paths algorithm
+    :param k: number of paths to return, a generator is returned if None
+    :param cutoff: maximum number of nodes on the paths
+    :param weight: edge attribute to use as edge weights
+    :param degreeasweight: use degree centralities of the target nodes
+           as edge weights, see set_degree_as_weight()
+    :param exclude: nodes not to include in the paths, such as side compounds
+    """
+    cg = csrgraph(dg, degreeasweight)
+    if weight is not None and not degreeasweight:
+        cg = cg.with_weights(cg.weights_from_networkx(dg, weight))
+    paths = cg.shortest_simple_paths(
+        source, target, weighted=degreeasweight or weight is not None,
+        maxhops=None if cutoff is None else cutoff - 1, exclude=exclude)
     if k is None:
-        return gr
-    else:
-        i, r = 0, []
-        for path in gr:
-            if len(path) > cutoff:
-                break
-            r.append(path)
-            i += 1
-            if i >= k:
+        return paths
+    return list(itertools.islice(paths, k))
+
+
+def centrality(g, max_iter=100, tol=1e-4):
+    """ Eigenvector centralities of the nodes of NetworkX graph g,
+    as array in the node order of csrgraph(g); computed once for each
+    graph version, see graph_version() """
+    version = graph_version(g), max_iter, tol
+    cached = _centralities.get(g)
+    if cached is None or cached[0] != version:
+        cached = version, csrgraph(g).eigenvector_centrality(max_iter, tol),\
+            dict()
+        _centralities[g] = cached
+    return cached[1]
+
+
+def neighbors_graphs(ingraph, sources, beamwidth=4, maxnodes=10,
+                     max_iter=100, tol=1e-4):
+    """ Neighbors of source nodes in ingraph, found by beam searches where
+    successors with highest eigenvector centralities are followed;
+    returns dictionary of source nodes to neighbors graphs """
+    assert ingraph.is_directed(), "not implemented for undirected graphs"
+    cg = csrgraph(ingraph)
+    values = centrality(ingraph, max_iter, tol).tolist()
+    topsuccessors = _centralities[ingraph][2].setdefault(beamwidth, dict())
+    multigraph = isinstance(ingraph, nx.MultiDiGraph)
+    r = dict()
+    for source in sources:
+        if source not in cg.nodeindex:
+            raise nx.NodeNotFound("Node %s not in graph" % source)
+        outgraph = nx.MultiDiGraph()
+        for u, v in cg.bfs_beam_edges(cg.nodeindex[source], values,
+                                      beamwidth, topsuccessors):
+            u, v = cg.nodes[u], cg.nodes[v]
+            if multigraph:
+                outgraph.add_edge(u, v, key=0,
+                                  **(ingraph.get_edge_data(u, v)[0]))
+            else:
+                outgraph.add_edge(u, v, **(ingraph.get_edge_data(u, v)))
+            if outgraph.number_of_nodes() >= maxnodes:
                 break
-        return r
+        r[source] = outgraph
+    return r
 
 
 def neighbors_graph(ingraph, source, beamwidth=4, maxnodes=10,
                     max_iter=100, tol=1e-4):
-    """ Neighbors of source node in ingraph """
-    assert ingraph.is_directed(), "not implemented for undirected graphs"
-    centrality = nx.eigenvector_centrality_numpy(ingraph,
-                                                 max_iter=max_iter, tol=tol)
-    outgraph = nx.MultiDiGraph()
-    for u, v in nx.bfs_beam_edges(ingraph, source, centrality.get, beamwidth):
-        if isinstance(ingraph, nx.MultiDiGraph):
-            outgraph.add_edge(u, v, key=0, **(ingraph.get_edge_data(u, v)[0]))
-        else:
-            outgraph.add_edge(u, v, **(ingraph.get_edge_data(u, v)))
-        if outgraph.number_of_nodes() >= maxnodes:
-            break
-    return outgraph
+    """ Neighbors of source node in ingraph, see neighbors_graphs() """
+    return neighbors_graphs(ingraph, [source], beamwidth, maxnodes,
+                            max_iter, tol)[source]
+
+
+def _degrees(network):
+    nodes = list(network)
+    degrees = np.fromiter((d for _, d in network.degree(nodes)),
+                          dtype=np.int64, count=len(nodes))
+    return nodes, degrees
+
+
+def _remove_nodes(network, nodes, mask):
+    network.remove_nodes_from([nodes[i] for i in np.flatnonzero(mask)])
+    invalidate(network)
 
 
 # Copied from Cameo project, http://cameo.bio/
 # Original code was using NetworkX-1 API
 def remove_highly_connected_nodes(network, max_degree=10):
-    to_remove = [node for node, degree in network.degree()
-                 if degree > max_degree]
-    network.remove_nodes_from(to_remove)
+    nodes, degrees = _degrees(network)
+    _remove_nodes(network, nodes, degrees > max_degree)
 
 
 def remove_least_connected_nodes(network, min_degree=1):
-    to_remove = [node for node, degree in network.degree()
-                 if degree < min_degree]
-    network.remove_nodes_from(to_remove)
+    nodes, degrees = _degrees(network)
+    _remove_nodes(network, nodes, degrees < min_degree)
 
 
 def remove_small_subgraphs(ingraph, min_nodes=5):
-    """ Remove subgraphs with less than given number of nodes """
-    ingraph_ = ingraph.to_undirected()
-    to_remove = set()
-    for node, degree in ingraph.degree():
-        if degree < min_nodes:
-            r = set()
-            for u, v in nx.dfs_edges(ingraph_, node, min_nodes):
-                r.add(u)
-                r.add(v)
-                if len(r) >= min_nodes:
-                    break
-            if len(r) < min_nodes:
-                to_remove = to_remove.union(r)
-    ingraph.remove_nodes_from(to_remove)
+    """ Remove subgraphs with less than given number of nodes,
+    subgraphs are the weakly connected components of directed graphs """
+    cg = csrgraph(ingraph)
+    _, labels = cg.components()
+    sizes = np.bincount(labels)
+    _remove_nodes(ingraph, cg.nodes, sizes[labels] < min_nodes)
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
-""" Index IntEnz xml files, with Elasticsearch, MongoDB, or Neo4j """
+""" Index IntEnz xml files, with Elasticsearch, MongoDB, or Neo4j,
+ or save reactions as files for the Neo4j bulk importer """
 from __future__ import print_function
 
 import argparse
@@ -9,7 +10,7 @@ import traceback
 import xmltodict
 from six import string_types
 
-from nosqlbiosets.dbutils import DBconnection
+from nosqlbiosets.dbutils import DBconnection, NEO4J_BATCHSIZE
 from nosqlbiosets.objutils import *
 
 DOCTYPE = 'intenz'     # Default document-type or collection name
@@ -17,19 +18,22 @@ DOCTYPE = 'intenz'     # Default document-type or collection name
 
 class Indexer(DBconnection):
 
-    def __init__(self, db, index, host=None, port=None, doctype=DOCTYPE):
+    def __init__(self, db, index, host=None, port=None, doctype=DOCTYPE,
+                 batchsize=NEO4J_BATCHSIZE):
         self.doctype = doctype
+        self.batchsize = batchsize
         self.index = index
         self.db = db
         super(Indexer, self).__init__(db, index, host, port,
                                       mdbcollection=doctype, recreateindex=True)
         if db == "MongoDB":
             self.mcl = self.mdbi[doctype]
-        elif db == "Neo4j":
+        elif db in ["Neo4j", "Neo4jCSV"]:
             self.reactions = dict()
             self.reactants = set()
             self.products = set()
-            self.edges = set()
+            self.reactant_edges = set()  # (substrate, reaction id) pairs
+            self.product_edges = set()   # (reaction id, product) pairs
 
     # Parse IntEnz xml file, call index function after each entry is parsed
     def parse_intenz_xmlfiles(self, infile):
@@ -51,6 +55,8 @@ class Indexer(DBconnection):
         print("\nCompleted")
         if self.db == "Neo4j":
             self.indexwithneo4j()
+        elif self.db == "Neo4jCSV":
+            self.save_neo4j_csvfiles()
 
     def index_intenz_entry(self, _, entry):
         slim = False  # TODO: option to select indexing selected fields only
@@ -80,7 +86,7 @@ class Indexer(DBconnection):
                 elif self.db == "MongoDB":
                     entry["_id"] = docid
                     self.mcl.insert_one(entry)
-                else:  # Neo4j
+                else:  # Neo4j or Neo4jCSV
                     self.updatereactionsandelements_sets(entry)
             except Exception as e:
                 print("ERROR: %s" % e)
@@ -91,53 +97,51 @@ class Indexer(DBconnection):
 
     def indexwithneo4j(self):
         print("Indexing collected data with Neo4j")
-        with self.neo4jc.begin_transaction() as tx:
-            tx.run("match ()-[a:Produces]-() delete a")
-            tx.run("match ()-[a:Reactant_in]-() delete a")
-            tx.run("match (a:Substrate) delete a")
-            tx.run("match (a:Product) delete a")
-            tx.run("match (a:Reaction) delete a")
-            tx.sync()
-            for r in self.reactants:
-                c = "CREATE (a:Substrate {id:{id}})"
-                tx.run(c, {"id": r})
-            for r in self.products:
-                c = "CREATE (a:Product {id:{id}})"
-                tx.run(c, {"id": r})
-        with self.neo4jc.begin_transaction() as tx:
-            for r in self.reactions:
-                r = self.reactions[r]
-                if 'id' in r:
-                    rid = r['id']  # Rhea reaction id
-                    tx.run("CREATE (a:Reaction {id:{rid}, name:{name}})",
-                           rid=rid, name=r['name'])
-                    for re in r['reactants']:
-                        if isinstance(re, dict):
-                            substrate = re['title']
-                        else:
-                            substrate = re
-                        if (substrate, rid) in self.edges:
-                            c = "MATCH (r:Reaction), (s:Substrate)" \
-                                " WHERE r.id = {rid}" \
-                                " AND s.id = {substrate} " \
-                                "CREATE (s)-[:Reactant_in {r:{rid}}]->(r)"
-                            tx.run(c, rid=rid,
-                                   substrate=substrate)
-                            self.edges.remove((substrate, rid))
-                    for pr in r['products']:
-                        if isinstance(pr, dict):
-                            product = pr['title']
-                        else:
-                            product = pr
-                        if (rid, product) in self.edges:
-                            c = "MATCH (r:Reaction), (t:Product) " \
-                                " WHERE  r.id = {rid} " \
-                                " AND t.id = {productid} " \
-                                "CREATE (r)-[:Produces {r:{rid}}]->(t)"
-                            tx.run(c, rid=rid,
-                                   productid=product)
-                            self.edges.remove((rid, product))
-                    tx.sync()
+        labels = ["Substrate", "Product", "Reaction"]
+        for label in labels:
+            self.neo4j_deletenodes(label, self.batchsize)
+        # Edge statements match nodes using the constraint indexes
+        for label in labels:
+            c = "CREATE CONSTRAINT ON(n:%s) ASSERT n.id IS UNIQUE" % label
+            self.neo4jc.run(c).consume()
+        c = "UNWIND $rows AS row CREATE (a:Substrate {id: row})"
+        self.neo4j_batchwrite(c, self.reactants, self.batchsize)
+        c = "UNWIND $rows AS row CREATE (a:Product {id: row})"
+        self.neo4j_batchwrite(c, self.products, self.batchsize)
+        c = "UNWIND $rows AS row CREATE (a:Reaction {id: row.id," \
+            " name: row.name})"
+        rows = ({"id": rid, "name": r.get('name')}
+                for rid, r in self.reactions.items())
+        self.neo4j_batchwrite(c, rows, self.batchsize)
+        c = "UNWIND $rows AS row" \
+            " MATCH (s:Substrate {id: row[0]}), (r:Reaction {id: row[1]})" \
+            " CREATE (s)-[:Reactant_in {r: row[1]}]->(r)"
+        self.neo4j_batchwrite(c, map(list, self.reactant_edges),
+                              self.batchsize)
+        c = "UNWIND $rows AS row" \
+            " MATCH (r:Reaction {id: row[0]}), (t:Product {id: row[1]})" \
+            " CREATE (r)-[:Produces {r: row[0]}]->(t)"
+        self.neo4j_batchwrite(c, map(list, self.product_edges),
+                              self.batchsize)
+
+    # Save collected data as files for the Neo4j bulk importer
+    def save_neo4j_csvfiles(self):
+        files = self.neo4jfiles
+        files.write_nodes("Substrate", ((i,) for i in self.reactants))
+        files.write_nodes("Product", ((i,) for i in self.products))
+        files.write_nodes("Reaction",
+                          ((rid, r.get('name'))
+                           for rid, r in self.reactions.items()),
+                          ["name"])
+        files.write_relationships("Reactant_in", "Substrate", "Reaction",
+                                  ((u, rid, rid)
+                                   for u, rid in self.reactant_edges),
+                                  ["r"])
+        files.write_relationships("Produces", "Reaction", "Product",
+                                  ((rid, v, rid)
+                                   for rid, v in self.product_edges),
+                                  ["r"])
+        files.save_importscript()
 
     def updatereactionsandelements_sets(self, e):
         if 'reactions' not in e:
@@ -147,22 +151,20 @@ class Indexer(DBconnection):
                 rid = r['id']
                 if rid not in self.reactions:
                     self.reactions[rid] = r
-                rproducts = set()
                 for pr in r['products']:
                     if isinstance(pr, dict):
                         product = pr['title']
                     else:
                         product = pr
-                    rproducts.add(product)
                     self.products.add(product)
-                    self.edges.add((rid, product))
+                    self.product_edges.add((rid, product))
                 for re in r['reactants']:
                     if isinstance(re, dict):
                         substrate = re['title']
                     else:
                         substrate = re
                     self.reactants.add(substrate)
-                    self.edges.add((substrate, rid))
+                    self.reactant_edges.add((substrate, rid))
 
 
 def mongodb_textindex(mdb):
@@ -176,13 +178,16 @@ def mongodb_textindex(mdb):
     mdb.create_index(index, name="text fields")
 
 
-def main(infile, index, doctype, db, host=None, port=None):
-    indxr = Indexer(db, index, host, port, doctype)
+def main(infile, index, doctype, db, host=None, port=None,
+         batchsize=NEO4J_BATCHSIZE):
+    indxr = Indexer(db, index, host, port, doctype, batchsize)
     indxr.parse_intenz_xmlfiles(infile)
     if db == 'Elasticsearch':
         indxr.es.indices.refresh(index=index)
+        indxr.bump_generation(index)
     elif db == 'MongoDB':
         mongodb_textindex(indxr.mcl)
+        indxr.bump_generation(doctype)
 
 
 if __name__ == '__main__':
@@ -195,7 +200,8 @@ if __name__ == '__main__':
     parser.add_argument('--index',
                         default="biosets",
                         help='Name of the Elasticsearch index'
-                             ' or MongoDB database')
+                             ' or MongoDB database, or output folder'
+                             ' with the Neo4jCSV option')
     parser.add_argument('--doctype', default=DOCTYPE,
                         help='Document type name for Elasticsearch, '
                              'collection name for MongoDB')
@@ -204,6 +210,12 @@ if __name__ == '__main__':
     parser.add_argument('--port', type=int,
                         help="Elasticsearch, MongoDB or Neo4j server port")
     parser.add_argument('--db', default='MongoDB',
-                        help="Database: 'Elasticsearch', 'MongoDB' or 'Neo4j'")
+                        help="Database: 'Elasticsearch', 'MongoDB' or 'Neo4j',"
+                             " or 'Neo4jCSV' for saving files for"
+                             " 'neo4j-admin database import' command")
+    parser.add_argument('--batchsize', type=int, default=NEO4J_BATCHSIZE,
+                        help="Number of nodes or relationships"
+                             " written in a Neo4j transaction")
     args = parser.parse_args()
-    main(args.infile, args.index, args.doctype, args.db, args.host, args.port)
+    main(args.infile, args.index, args.doctype, args.db, args.host, args.port,
+         args.batchsize)
@@ -2,19 +2,53 @@
 """ Query IntEnz data indexed with MongoDB or Neo4j """
 # Server connection details are read from file conf/dbservers.json
 
+import itertools
 import json
 
 import argh
 import networkx as nx
 
+from nosqlbiosets.csrgraph import CSRGraph
 from nosqlbiosets.graphutils import save_graph
 from nosqlbiosets.qryutils import parseinputquery, Query
 
 COLLECTION = "intenz"
 
 
+def connections_csrgraph(connections, **attr):
+    """ Reactant -> product graph of the get_connections() results,
+    edges are labelled with the lists of enzyme ids """
+    nodeindex = dict()
+    sources, targets, labels = [], [], []
+    for c in connections:
+        for node, ids in ((c['_id']['reactant'], sources),
+                          (c['_id']['product'], targets)):
+            ids.append(nodeindex.setdefault(node, len(nodeindex)))
+        labels.append(tuple(sorted(c['enzymes'])))
+    return CSRGraph.from_edges(list(nodeindex), sources, targets,
+                               range(len(labels)), labels, **attr)
+
+
+def enzyme_chain(cgraph, path):
+    """ Reactions of a metabolite path, as list of
+    (reactant, product, enzyme ids) tuples """
+    r = []
+    for u, v in zip(path, path[1:]):
+        i = cgraph.nodeindex[u]
+        enzymes = set()
+        for e in range(cgraph.indptr[i], cgraph.indptr[i + 1]):
+            if cgraph.nodes[cgraph.indices[e]] == v:
+                enzymes.update(cgraph.edge_label(e))
+        r.append((u, v, sorted(enzymes)))
+    return r
+
+
 class QueryIntEnz(Query):
 
+    # Connection graphs for client-side path searches,
+    # (database, collection, query) -> (generation, CSRGraph)
+    connectiongraphs = dict()
+
     def __init__(self, dbtype="MongoDB", index="biosets",
                  mdbcollection=COLLECTION, **kwargs):
         super(QueryIntEnz, self).__init__(dbtype, index,
@@ -257,6 +291,51 @@ class QueryIntEnz(Query):
         r = [i for i in hits]
         return r
 
+    def connections_graph(self, filterc=None):
+        """ Reactant -> product graph of all connections of the IntEnz
+        entries selected by filterc, read once for each collection
+        generation, see DBconnection.bump_generation() """
+        filterc = {} if filterc is None else filterc
+        key = self.index, self.mdbcollection, json.dumps(filterc,
+                                                         sort_keys=True)
+        g = self.dbc.get_generation(self.mdbcollection)
+        if key in self.connectiongraphs and \
+                self.connectiongraphs[key][0] == g:
+            return self.connectiongraphs[key][1]
+        cgraph = connections_csrgraph(self.get_connections(filterc,
+                                                           limit=None),
+                                      query=key[2])
+        self.connectiongraphs[key] = g, cgraph
+        return cgraph
+
+    # For paths with any number of enzymes, searched on the client side
+    # with the cached connections graph, instead of $graphLookup queries
+    def connected_metabolites(self, source, target, k=1, maxenzymes=6,
+                              exclude=None, filterc=None):
+        """ Enzyme chains connecting source metabolite to target metabolite,
+        shortest chains first; returns list of chains where each chain is
+        a list of (reactant, product, enzyme ids) tuples
+        :param k: number of chains, single shortest chain is found with
+                  bidirectional breadth-first search, k-shortest chains
+                  with Yen's algorithm
+        :param maxenzymes: maximum number of enzymes on the chains
+        :param exclude: side metabolites not to include in the chains,
+                        such as 'H2O' or 'ATP'
+        :param filterc: query clause to select the IntEnz entries
+        """
+        cgraph = self.connections_graph(filterc)
+        try:
+            if k == 1:
+                paths = [cgraph.bidirectional_shortest_path(
+                    source, target, maxhops=maxenzymes, exclude=exclude)]
+            else:
+                paths = list(itertools.islice(cgraph.shortest_simple_paths(
+                    source, target, weighted=False, maxhops=maxenzymes,
+                    exclude=exclude), k))
+        except (nx.NodeNotFound, nx.NetworkXNoPath):
+            return []
+        return [enzyme_chain(cgraph, path) for path in paths]
+
     def neo4j_shortestpathsearch_connected_metabolites(self, source, target,
                                                        k=5):
         q = 'MATCH (source_:Substrate{id:{source}}),' \
@@ -286,6 +365,7 @@ class QueryIntEnz(Query):
             return r
 
     # Connections are from reactants to products, reactions are edges
+    # All connections are returned when limit is None
     def get_connections(self, filterc, limit=40000):
         assert self.dbc.db == 'MongoDB'
         agpl = [
@@ -304,10 +384,12 @@ class QueryIntEnz(Query):
                 },
                 "enzymes": {"$addToSet": "$_id"},
                 "count": {"$sum": 1}
-            }},
-            {"$limit": limit}
+            }}
         ]
-        r = self.dbc.mdbi[self.mdbcollection].aggregate(agpl)
+        if limit is not None:
+            agpl.append({"$limit": limit})
+        r = self.dbc.mdbi[self.mdbcollection].aggregate(agpl,
+                                                        allowDiskUse=True)
         return r
 
     def get_connections_graph(self, qc, limit=4000):
@@ -361,7 +443,26 @@ def cyview(query, name='', limit=4000):
     crcl.style.apply(Style('default'), network=cyn)
 
 
+def connectedmetabolites(source, target, k=1, maxenzymes=6, exclude=''):
+    """ Print enzyme chains connecting source metabolite to target
+
+     :param source: Name of the source metabolite, e.g. '2-oxoglutarate'
+     :param target: Name of the target metabolite
+     :param k: Number of chains, shortest chains are printed first
+     :param maxenzymes: Maximum number of enzymes on the chains
+     :param exclude: Side metabolites not to include in the chains,
+                     separated by commas, e.g. 'H2O,ATP'
+     """
+    qry = QueryIntEnz()
+    exclude = [m for m in exclude.split(',') if m]
+    for chain in qry.connected_metabolites(source, target, int(k),
+                                           int(maxenzymes), exclude):
+        print(' -> '.join("%s [%s]" % (reactant, ','.join(enzymes))
+                          for reactant, _, enzymes in chain)
+              + ' -> ' + chain[-1][1])
+
+
 if __name__ == '__main__':
     argh.dispatch_commands([
-        savegraph, cyview
+        savegraph, cyview, connectedmetabolites
     ])
@@ -188,6 +188,10 @@ class TestQueryIntEnz(unittest.TestCase):
             check("enzyme2")
             r = qryintenz.graphlookup_connected_metabolites(source, target, 0)
             check("enzymes")
+            chains = qryintenz.connected_metabolites(source, target, k=20,
+                                                     maxenzymes=2)
+            assert any(ecn1 in c[0][2] and ecn2 in c[1][2]
+                       for c in chains if len(c) == 2)
             break  # let usual tests return faster
 
     def test_neo4j_graphsearch_connected_metabolites(self):
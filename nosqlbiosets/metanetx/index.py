@@ -6,17 +6,22 @@ from __future__ import print_function
 import argparse
 import csv
 import os
+import re
 import time
 from pymongo import IndexModel
 
 from elasticsearch.helpers import streaming_bulk
 
 from nosqlbiosets.dbutils import DBconnection
+from nosqlbiosets.objutils import NAMEKEYS, NAMEKEYS_ES_MAPPINGS, namekeys
+from nosqlbiosets.xrefs import XrefWriter
 
 ES_CHUNK_SIZE = 256  # for Elasticsearch index requests
 TYPE_COMPOUND = 'metanetx_compound'
 TYPE_REACTION = 'metanetx_reaction'
 TYPE_COMPARTMENT = 'metanetx_compartment'
+METABOLITE_RE = re.compile(
+    r'(\d*\.\d+|\d+) (MNXM\d+|BIOMASS)@(MNXD[\dX]|BOUNDARY)')
 
 
 # Parse records in MetaNetX chem_prop.tsv file which has the following header
@@ -38,7 +43,8 @@ def getcompoundrecord(row, xrefsmap):
         'smiles':  row[6],
         'source': {'lib': sourcelib, 'id': sourceid},
         'inchikey': row[8],
-        'xrefs': xrefsmap[id_] if id_ in xrefsmap else None
+        'xrefs': xrefsmap[id_] if id_ in xrefsmap else None,
+        NAMEKEYS: namekeys(row[1])
     }
     return r
 
@@ -133,6 +139,26 @@ def getreactionxrefrecord(row):
     return metanetxid, {"lib": reflib, "id": refid}
 
 
+# Parse reaction equations to lists of reactants and products,
+# (None, None) is returned for equations not in the expected format
+def parse_equation(equation):
+    parts = equation.split(' = ')
+    if len(parts) != 2:
+        return None, None
+    r = []
+    for side in parts:
+        metabolites = []
+        for m in side.split(' + '):
+            match = METABOLITE_RE.search(m)
+            if match is None:
+                return None, None
+            metabolites.append({'id': match.group(2),
+                                'coef': float(match.group(1)),
+                                'compartment': match.group(3)})
+        r.append(metabolites)
+    return r[0], r[1]
+
+
 # Parse records in react_prop.tsv file which has the following header
 # #MNX_ID  Equation  Description  Balance  EC  Source
 def getreactionrecord(row, xrefsmap):
@@ -143,8 +169,10 @@ def getreactionrecord(row, xrefsmap):
     if j > 0:
         sourcelib = row[5][0:j]
         sourceid = row[5][j + 1:]
+    reactants, products = parse_equation(row[1])
     r = {
         '_id':  id_, 'equation': row[1],
+        'reactants': reactants, 'products': products,
         'desc': row[2], 'balance':  row[3],
         'ecno': row[4].split(";"),
         'source': {'lib': sourcelib, 'id': sourceid},
@@ -163,17 +191,31 @@ def read_metanetx_mappings(infile, metanetxparser, xrefsmap):
             yield r
 
 
+# (namespace, id) pairs of MetaNetX records for the xref collection,
+# 'metanetx' for MetaNetX ids, and xref libraries such as 'kegg', 'chebi'
+def metanetx_xrefs(r):
+    yield 'metanetx', r['_id']
+    for xref in r['xrefs'] or []:
+        ids = xref['id']
+        for id_ in ids if isinstance(ids, list) else [ids]:
+            yield xref['lib'], id_
+
+
 class Indexer(DBconnection):
 
-    def __init__(self, db, index, host, port, doctype):
+    def __init__(self, db, index, host, port, doctype, xrefs=False):
         self.doctype = doctype
+        self.xrefw = None
         if db == "Elasticsearch":
             index = doctype
         super(Indexer, self).__init__(db, index, host, port,
-                                      recreateindex=True)
+                                      recreateindex=True,
+                                      es_indexmappings=NAMEKEYS_ES_MAPPINGS)
         if db == "MongoDB":
             self.mdbi.drop_collection(doctype)
             self.mcl = self.mdbi[doctype]
+            if xrefs:
+                self.xrefw = XrefWriter(self.mdbi, doctype)
 
     def indexall(self, reader):
         print("Reading/indexing %s" % reader.gi_frame.f_locals['infile'])
@@ -185,6 +227,8 @@ class Indexer(DBconnection):
             if reader != getcompartmentrecord:
                 collection = self.doctype
                 self.mongodb_indices(collection)
+            if self.xrefw is not None:
+                self.xrefw.close()
 
         t2 = time.time()
         print("-- Processed %d entries, in %d sec"
@@ -208,6 +252,8 @@ class Indexer(DBconnection):
         for r in reader:
             try:
                 self.mcl.insert_one(r)
+                if self.xrefw is not None:
+                    self.xrefw.add(r['_id'], metanetx_xrefs(r))
                 i += 1
                 self.reportprogress()
             except Exception as e:
@@ -224,7 +270,9 @@ class Indexer(DBconnection):
         self.mdbi[collection].create_indexes([index])
         indx_fields = ["xrefs.id"]
         if collection == TYPE_REACTION:
-            indx_fields += ["ecno"]
+            indx_fields += ["ecno", "reactants.id", "products.id"]
+        else:
+            indx_fields += [NAMEKEYS]
         for field in indx_fields:
             self.mdbi[collection].create_index(field)
 
@@ -261,6 +309,10 @@ if __name__ == '__main__':
                         help="Elasticsearch/MongoDB server port number")
     parser.add_argument('--db', default='Elasticsearch',
                         help="Database: Elasticsearch or MongoDB")
+    parser.add_argument('--xrefs', default=False, action='store_true',
+                        help="Save cross-references of compounds and"
+                             " reactions in the shared 'xref' collection,"
+                             " MongoDB only")
     args = parser.parse_args()
 
     files = [("compoundsfile", "chem_prop.tsv"),
@@ -278,7 +330,8 @@ if __name__ == '__main__':
     xrefsmap_ = getxrefs(args.compoundsxreffile, getcompoundxrefrecord)
     for refs in xrefsmap_:
         xrefsmap_[refs] = _mergecompoundxrefs(xrefsmap_[refs])
-    indxr = Indexer(args.db, args.index, args.host, args.port, TYPE_COMPOUND)
+    indxr = Indexer(args.db, args.index, args.host, args.port, TYPE_COMPOUND,
+                    args.xrefs)
     indxr.indexall(read_metanetx_mappings(args.compoundsfile,
                                           getcompoundrecord, xrefsmap_))
 
@@ -288,7 +341,8 @@ if __name__ == '__main__':
                                           getcompartmentrecord, xrefsmap_))
 
     xrefsmap_ = getxrefs(args.reactionsxreffile, getreactionxrefrecord)
-    indxr = Indexer(args.db, args.index, args.host, args.port, TYPE_REACTION)
+    indxr = Indexer(args.db, args.index, args.host, args.port, TYPE_REACTION,
+                    args.xrefs)
     indxr.indexall(read_metanetx_mappings(args.reactionsfile,
                                           getreactionrecord, xrefsmap_))
     indxr.close()
@@ -1,15 +1,20 @@
 #!/usr/bin/env python
 """ Queries with MetaNetX data indexed with MongoDB or Elasticsearch """
 
+import itertools
 import json
-import re
 
 import networkx as nx
 
 from nosqlbiosets.dbutils import DBconnection
 from nosqlbiosets.graphutils import remove_highly_connected_nodes
-from nosqlbiosets.metanetx.index import TYPE_COMPOUND, TYPE_REACTION
-from nosqlbiosets.qryutils import parseinputquery
+from nosqlbiosets.metanetx.index import METABOLITE_RE, TYPE_COMPOUND, \
+    TYPE_REACTION, parse_equation
+from nosqlbiosets.qryutils import IdResolver, esstream, parseinputquery, \
+    prefixquery
+
+# Reaction fields read for metabolite networks
+NETWORK_PROJECTION = ['reactants.id', 'products.id', 'source.lib', 'ecno']
 
 
 def cobrababel_parse_metanetx_equation(equation):
@@ -19,9 +24,6 @@ def cobrababel_parse_metanetx_equation(equation):
               https://github.com/mmundy42/cobrababel/blob/master/LICENSE.txt
     Copyright (c) 2017,2017, Mayo Foundation for Medical Education and Research
     """
-    metabolite_re = re.compile(
-        r'(\d*\.\d+|\d+) (MNXM\d+|BIOMASS)@(MNXD[\dX]|BOUNDARY)')
-
     parts = equation.split(' = ')
     if len(parts) != 2:
         return None
@@ -31,7 +33,7 @@ def cobrababel_parse_metanetx_equation(equation):
     metabolites = dict()
     reactants = parts[0].split(' + ')
     for r in reactants:
-        match = re.search(metabolite_re, r)
+        match = METABOLITE_RE.search(r)
         if match is None:
             return None
         met_id = '{0}_{1}'.format(match.group(2), match.group(3))
@@ -42,7 +44,7 @@ def cobrababel_parse_metanetx_equation(equation):
         }
     products = parts[1].split(' + ')
     for p in products:
-        match = re.search(metabolite_re, p)
+        match = METABOLITE_RE.search(p)
         if match is None:
             return None
         met_id = '{0}_{1}'.format(match.group(2), match.group(3))
@@ -54,12 +56,23 @@ def cobrababel_parse_metanetx_equation(equation):
     return metabolites
 
 
+def _compoundids(c, namespace):
+    # Ids of compound c in given namespace
+    if namespace == 'metanetx':
+        return [c['_id']]
+    if namespace == 'name':
+        return [c['desc']] if 'desc' in c else []
+    return [id_ for xref in c.get('xrefs') or []
+            if xref['lib'] == namespace for id_ in xref['id']]
+
+
 class QueryMetaNetX:
 
     def __init__(self, db="MongoDB", index='biosets', version="", **kwargs):
         self.dbc = DBconnection(db, index, **kwargs)
         self.rcollection = TYPE_REACTION+version
         self.ccollection = TYPE_COMPOUND+version
+        self.idresolver = IdResolver(self.idlookup)
 
     # Given MetaNetX compound id return its name
     def getcompoundname(self, mid, limit=0):
@@ -81,7 +94,13 @@ class QueryMetaNetX:
         Given query term find possible metabolite names that match query term
         :param qterm: query term
         """
-        qc = {"desc": {"$regex": "^%s" % qterm, "$options": "i"}}
+        if self.dbc.db == 'Elasticsearch':
+            qc = {"query": prefixquery(qterm, self.dbc.db), "_source": "desc"}
+            r = self.dbc.es.search(index=TYPE_COMPOUND, body=qc,
+                                   size=kwargs.get('limit', 10))
+            return [dict(hit['_source'], _id=hit['_id'])
+                    for hit in r['hits']['hits']]
+        qc = prefixquery(qterm)
         r = self.query_metabolites(qc, projection=['desc'], **kwargs)
         return list(r)
 
@@ -95,36 +114,43 @@ class QueryMetaNetX:
         r.sort(key=lambda x: x['score'])
         return r
 
-    # Given KEGG compound ids find ids for other libraries
+    # Given KEGG compound ids find ids for other libraries,
+    # None is returned for compounds without mappings
     def keggcompoundids2otherids(self, cids, lib='MetanetX'):
+        r = self.resolve_ids(cids, 'kegg', lib)
+        return [r[cid][0] if r[cid] else None for cid in cids]
+
+    # Given MetaNetX compound ids return their names
+    def getcompoundnames(self, mids):
+        r = self.resolve_ids(mids, 'metanetx', 'name')
+        return {mid: names[0] for mid, names in r.items() if names}
+
+    def resolve_ids(self, ids, source_namespace, target_namespace):
+        """ Map given compound ids to ids in the target namespace,
+        namespaces are 'metanetx' for MetaNetX compound ids, 'name' for
+        compound names (target only) or xref libraries such as 'kegg',
+        'chebi', 'seed'; see IdResolver """
+        return self.idresolver.resolve_ids(ids, source_namespace,
+                                           target_namespace)
+
+    def idlookup(self, ids, source, target):
+        field = "_id" if source == 'metanetx' else "xrefs.id"
         if self.dbc.db == 'Elasticsearch':
-            index, doctype = TYPE_COMPOUND, "_doc"
-            qc = {"match": {"xrefs.id": ' '.join(cids)}}
-            hits, n = self.esquery(self.dbc.es, index, qc, doctype, len(cids))
+            qc = {"terms": {field: ids}} if source == 'metanetx' \
+                else {"match": {field: ' '.join(ids)}}
+            docs = esstream(self.dbc.es, TYPE_COMPOUND, qc)
         else:  # MongoDB
-            qc = {'xrefs.id': {'$in': cids}}
-            hits = list(self.dbc.mdbi[self.ccollection].find(qc))
-            n = len(hits)
-        assert len(cids) == n
-        mids = [None] * n
-        for c in hits:
-            i, libids = None, []
-            for xref in (c['xrefs'] if 'xrefs' in c else c['_source']['xrefs']):
-                if i is None and xref['lib'] == 'kegg':
-                    for id_ in xref['id']:
-                        if id_ in cids:
-                            i = cids.index(id_)
-                            break
-                if xref['lib'] == lib:
-                    if libids is []:
-                        libids = xref['id']
-                    else:
-                        libids += xref['id']
-            if i is not None:
-                assert len(libids) >= 1
-                mids[i] = libids[0]  # TODO: check me
-        return mids
+            docs = self.dbc.mdbi[self.ccollection].find(
+                {field: {'$in': ids}}, projection=['desc', 'xrefs'])
+        ids = set(ids)
+        for c in docs:
+            for id_ in _compoundids(c, source):
+                if id_ in ids:
+                    for tid in _compoundids(c, target):
+                        yield id_, tid
 
+    # Returns only the first page of hits, callers that need all hits
+    # should use stream_reactions() or esstream()
     @staticmethod
     def esquery(es, index, qc, doc_type=None, size=10):
         print("Querying '%s'  %s" % (doc_type, str(qc)))
@@ -165,7 +191,8 @@ class QueryMetaNetX:
         r = [c for c in hits]
         return r
 
-    # Query reactions with given query clause
+    # Query reactions with given query clause, Elasticsearch queries
+    # return one page of hits, see stream_reactions() for all hits
     def query_reactions(self, qc, **kwargs):
         if "MongoDB" == self.dbc.db:
             hits = self.dbc.mdbi[self.rcollection].find(qc, **kwargs)
@@ -175,25 +202,48 @@ class QueryMetaNetX:
             r, _ = self.esquery(self.dbc.es, index, qc, doctype, **kwargs)
         return r
 
-    # Query reactions and return reactions together with their metabolites
-    def reactionswithmetabolites(self, qc, **kwargs):
-        cr = self.dbc.mdbi[self.rcollection].find(qc, **kwargs)
+    # Iterate over all reactions matching the query clause,
+    # Elasticsearch results are read page by page
+    def stream_reactions(self, qc, projection=None, pagesize=1000):
+        if "MongoDB" == self.dbc.db:
+            return self.dbc.mdbi[self.rcollection].find(
+                qc, projection=projection, batch_size=pagesize)
+        return esstream(self.dbc.es, self.rcollection, qc,
+                        pagesize=pagesize, source=projection)
+
+    # Query reactions and return reactions together with their metabolites,
+    # reactants and products of the reactions are returned as sets of ids
+    def reactionswithmetabolites(self, qc, projection=None, **kwargs):
+        if projection is None:
+            projection = NETWORK_PROJECTION
+        cr = self.dbc.mdbi[self.rcollection].find(qc, projection=projection,
+                                                  **kwargs)
         reacts = []
         mids = set()
+        unparsed = []  # reactions indexed without reactants and products
         for r in cr:
-            eq = cobrababel_parse_metanetx_equation(r['equation'])
-            if eq is None:
+            if 'reactants' not in r:
+                unparsed.append(r)
                 continue
-            r['reactants'] = set()
-            r['products'] = set()
-            for m in eq.items():
-                mid = m[1]['mnx_id']
-                mids.add(mid)
-                if m[1]['coefficient'] < 0:
-                    r['reactants'].add(mid)
-                else:
-                    r['products'].add(mid)
+            if r['reactants'] is None:
+                continue
+            r['reactants'] = {m['id'] for m in r['reactants']}
+            r['products'] = {m['id'] for m in r['products']}
+            mids.update(r['reactants'], r['products'])
             reacts.append(r)
+        if unparsed:
+            equations = {r['_id']: r['equation'] for r in
+                         self.dbc.mdbi[self.rcollection].find(
+                             {"_id": {"$in": [r['_id'] for r in unparsed]}},
+                             projection=['equation'])}
+            for r in unparsed:
+                reactants, products = parse_equation(equations[r['_id']])
+                if reactants is None:
+                    continue
+                r['reactants'] = {m['id'] for m in reactants}
+                r['products'] = {m['id'] for m in products}
+                mids.update(r['reactants'], r['products'])
+                reacts.append(r)
         qc = {"_id": {"$in": list(mids)}}
         cr = self.query_metabolites(qc, projection=['desc'])
         # TODO: option to return metabolite names based on selected library
@@ -214,29 +264,28 @@ class QueryMetaNetX:
         :return: metabolites graph as NetworkX object
         """
         reacts, metabolites = self.reactionswithmetabolites(qc)
-        if sidec is not None:
-            sidec = " ".join(sidec)
-        mn = nx.DiGraph(name='MetaNetX',
-                        query=json.dumps(qc).replace('"', '\''))
+        sidec = set() if sidec is None else set(sidec)
+        # Edges are collected first, and added to the graph in one call;
+        # edge attributes are set from the first reaction of the edges
+        edges = dict()  # (u, v) -> (first reaction, reaction ids)
         for r in reacts:
-            for u_ in r['reactants']:
-                if sidec is not None and u_ in sidec:
+            for u_, v_ in itertools.product(r['reactants'] - sidec,
+                                            r['products'] - sidec):
+                if not selfloops and u_ == v_:
                     continue
-                u = metabolites[u_]
-                for v in r['products']:
-                    if not selfloops and v == u_:
-                        continue
-                    if sidec is not None and v in sidec:
-                        continue
-                    v = metabolites[v]
-                    if mn.has_edge(u, v):
-                        er = mn.get_edge_data(u, v)['reactions']
-                        if r['_id'] not in er:
-                            er.append(r['_id'])
-                    else:
-                        er = list([r['_id']])
-                        mn.add_edge(u, v, reactions=er,
-                                    sourcelib=r['source']['lib'], ec=r['ecno'])
+                e = metabolites[u_], metabolites[v_]
+                if e in edges:
+                    er = edges[e][1]
+                    if er[-1] != r['_id']:
+                        er.append(r['_id'])
+                else:
+                    edges[e] = r, [r['_id']]
+        mn = nx.DiGraph(name='MetaNetX',
+                        query=json.dumps(qc).replace('"', '\''))
+        mn.add_edges_from((u, v, {"reactions": er,
+                                  "sourcelib": r['source']['lib'],
+                                  "ec": r['ecno']})
+                          for (u, v), (r, er) in edges.items())
         remove_highly_connected_nodes(mn, max_degree=max_degree)
         return mn
 
@@ -5,16 +5,19 @@ from __future__ import print_function
 
 import argparse
 import csv
+import re
 import time
 
 from elasticsearch.helpers import streaming_bulk
 
 from nosqlbiosets.dbutils import DBconnection
+from nosqlbiosets.objutils import NAMEKEYS, NAMEKEYS_ES_MAPPINGS, namekeys
 from pymongo import IndexModel
 
 ES_CHUNK_SIZE = 2048  # for Elasticsearch index requests
 TYPE_COMPOUND = 'modelseed_compound'
 TYPE_REACTION = 'modelseed_reaction'
+COMPOUND_RE = re.compile(r'\((\d*\.*\d*(e-\d+)?)\) (cpd\d+)\[(\d+)\]')
 
 
 def delete_attrs_with_value_null(r):
@@ -40,9 +43,69 @@ def updatecompoundrecord(row, _):
     del row['id'], row['source']
     row['_type'] = '_doc'
     delete_attrs_with_value_null(row)
+    row[NAMEKEYS] = namekeys(row.get('name'), row.get('abbreviation'),
+                             aliasnames(row.get('aliases')))
     return row
 
 
+# Names in the 'Name' field of the aliases, such as
+# "BiGG: h2o|Name: H2O; Water"
+def aliasnames(aliases):
+    for alias in (aliases or '').split('|'):
+        if alias.startswith('Name:'):
+            return alias[5:].split(';')
+    return []
+
+
+def modelseeddb_parse_equation(equation, delimiter=' '):
+    """
+    This function is a copy of ModelSEEDDatabase Biochem_Helper.py:parseEquation
+    https://github.com/ModelSEED/ModelSEEDDatabase/Scripts/Biochem_Helper.py
+    """
+    # Build search strings using specified delimiter.
+    bidirectional = delimiter + '<=>' + delimiter
+    reverse = delimiter + '<=' + delimiter
+    forward = delimiter + '=>' + delimiter
+    separator = delimiter + '+' + delimiter
+    # Find the special string that separates reactants and products.
+    reactants = list()
+    products = list()
+    if equation.find(forward) >= 0:
+        direction = '>'
+        parts = equation.split(forward)
+        if parts[0]:
+            reactants = parts[0].split(separator)
+        if parts[1]:
+            products = parts[1].split(separator)
+    elif equation.find(reverse) >= 0:
+        direction = '<'
+        parts = equation.split(reverse)
+        if parts[1]:
+            reactants = parts[1].split(separator)
+        if parts[0]:
+            products = parts[0].split(separator)
+    elif equation.find(bidirectional) >= 0:
+        direction = '='
+        parts = equation.split(bidirectional)
+        if parts[0]:
+            reactants = parts[0].split(separator)
+        if parts[1]:
+            products = parts[1].split(separator)
+    else:
+        return None, None, None
+
+    return reactants, products, direction
+
+
+# Compound ids of reactants and products of reaction equations
+def equation_compoundids(equation):
+    reactants, products, _ = modelseeddb_parse_equation(equation)
+    if reactants is None:
+        return None, None
+    return ([COMPOUND_RE.search(c).group(3) for c in reactants],
+            [COMPOUND_RE.search(c).group(3) for c in products])
+
+
 # Parse records in ModelSEED DB reactions tsv file which has the
 # following columns:
 # id, abbreviation, name, code, stoichiometry, is_transport, equation,
@@ -61,6 +124,9 @@ def updatereactionrecord(row, _):
     del row['id']
     row['_type'] = '_doc'
     delete_attrs_with_value_null(row)
+    if 'equation' in row:
+        row['reactant_ids'], row['product_ids'] = \
+            equation_compoundids(row['equation'])
     return row
 
 
@@ -103,7 +169,7 @@ def mongodb_indices(mdb):
             ("abbreviation", "text")])
         mdb.create_indexes([index])
         indx_fields = ["mass", "deltag", "deltagerr", "charge",
-                       "name", 'abbreviation', "inchikey"]
+                       "name", 'abbreviation', "inchikey", NAMEKEYS]
         for field in indx_fields:
             mdb.create_index(field)
     else:
@@ -112,6 +178,8 @@ def mongodb_indices(mdb):
             ("abbreviation", "text"),
             ("definition", "text")])
         mdb.create_indexes([index])
+        for field in ["reactant_ids", "product_ids"]:
+            mdb.create_index(field)
 
 
 def mongodb_index(mdbc, infile, typetuner):
@@ -128,7 +196,8 @@ def mongodb_index(mdbc, infile, typetuner):
 
 
 def main(infile, index, doctype, db, host=None, port=None):
-    dbc = DBconnection(db, index, host, port, recreateindex=True)
+    dbc = DBconnection(db, index, host, port, recreateindex=True,
+                       es_indexmappings=NAMEKEYS_ES_MAPPINGS)
     if doctype == TYPE_REACTION:
         typetuner = updatereactionrecord
     else:
@@ -136,10 +205,12 @@ def main(infile, index, doctype, db, host=None, port=None):
     if db == 'Elasticsearch':
         es_index(dbc, infile, typetuner)
         dbc.es.indices.refresh(index=index)
+        dbc.bump_generation(index)
     else:  # assume MongoDB
         dbc.mdbi.drop_collection(doctype)
         mongodb_index(dbc.mdbi[doctype], infile, typetuner)
         mongodb_indices(dbc.mdbi[doctype])
+        dbc.bump_generation(doctype)
 
 
 if __name__ == '__main__':
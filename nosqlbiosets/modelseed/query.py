@@ -2,64 +2,105 @@
 """ Queries with ModelSEEDDatabase data indexed with MongoDB,
     few queries with Elasticsearch """
 import json
+import mmap
+import os
 import re
 
 import networkx as nx
 
 from nosqlbiosets.dbutils import DBconnection
-from nosqlbiosets.qryutils import parseinputquery
+from nosqlbiosets.modelseed.index import equation_compoundids, \
+    modelseeddb_parse_equation
+from nosqlbiosets.qryutils import parseinputquery, prefixquery
 
 # MongoDB collection names or Elasticsearch index names:
 COMPOUNDSTYPE = "modelseed_compound"
 REACTIONSTYPE = "modelseed_reaction"
+# Escape sequences for the compound names in the saved name tables
+ESCAPES = {'\\': '\\\\', '\t': '\\t', '\n': '\\n'}
+UNESCAPES = {'\\': '\\', 't': '\t', 'n': '\n'}
+
+
+def _escape(name):
+    return ''.join(ESCAPES.get(c, c) for c in name)
+
+
+def _unescape(name):
+    return re.sub(r'\\(.)', lambda m: UNESCAPES[m.group(1)], name)
+
+
+class CompoundNames(object):
+    """ Compound id -> name tables, cached in memory for each compound
+     collection generation, see DBconnection.bump_generation().
+     With cachedir set, tables are also saved as tsv files, and read
+     with mmap by other processes querying the same collection version """
+    tables = dict()  # (database, collection) -> (generation, table)
+
+    def __init__(self, dbc, collection, cachedir=None):
+        self.dbc = dbc
+        self.collection = collection
+        self.cachedir = cachedir
+
+    def table(self):
+        key = self.dbc.index, self.collection
+        g = self.dbc.get_generation(self.collection)
+        if key in self.tables and self.tables[key][0] == g:
+            return self.tables[key][1]
+        path = None
+        table = None
+        if self.cachedir is not None:
+            path = os.path.join(self.cachedir,
+                                "%s.%s.%d.tsv" % (key + (g,)))
+            if os.path.exists(path):
+                table = self.readtable(path)
+        if table is None:
+            cr = self.dbc.mdbi[self.collection].find({}, projection=['name'])
+            table = {c['_id']: c.get('name') or c['_id'] for c in cr}
+            if path is not None:
+                self.savetable(table, path)
+        self.tables[key] = g, table
+        return table
 
+    @staticmethod
+    def readtable(path):
+        # Lines are read from the mmap one by one, without reading
+        # the whole file to memory first
+        table = dict()
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return table
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for line in iter(m.readline, b''):
+                    cid, name = line.rstrip(b'\n').split(b'\t', 1)
+                    table[cid.decode('utf-8')] = \
+                        _unescape(name.decode('utf-8'))
+            finally:
+                m.close()
+        return table
 
-def modelseeddb_parse_equation(equation, delimiter=' '):
-    """
-    This function is a copy of ModelSEEDDatabase Biochem_Helper.py:parseEquation
-    https://github.com/ModelSEED/ModelSEEDDatabase/Scripts/Biochem_Helper.py
-    """
-    # Build search strings using specified delimiter.
-    bidirectional = delimiter + '<=>' + delimiter
-    reverse = delimiter + '<=' + delimiter
-    forward = delimiter + '=>' + delimiter
-    separator = delimiter + '+' + delimiter
-    # Find the special string that separates reactants and products.
-    reactants = list()
-    products = list()
-    if equation.find(forward) >= 0:
-        direction = '>'
-        parts = equation.split(forward)
-        if parts[0]:
-            reactants = parts[0].split(separator)
-        if parts[1]:
-            products = parts[1].split(separator)
-    elif equation.find(reverse) >= 0:
-        direction = '<'
-        parts = equation.split(reverse)
-        if parts[1]:
-            reactants = parts[1].split(separator)
-        if parts[0]:
-            products = parts[0].split(separator)
-    elif equation.find(bidirectional) >= 0:
-        direction = '='
-        parts = equation.split(bidirectional)
-        if parts[0]:
-            reactants = parts[0].split(separator)
-        if parts[1]:
-            products = parts[1].split(separator)
-    else:
-        return None, None, None
-
-    return reactants, products, direction
+    @staticmethod
+    def savetable(table, path):
+        # Written to a temporary file first, for readers in other processes
+        tmpfile = "%s.%d" % (path, os.getpid())
+        with open(tmpfile, 'w', encoding='utf-8', newline='\n') as f:
+            for cid, name in table.items():
+                f.write("%s\t%s\n" % (cid, _escape(name)))
+        os.replace(tmpfile, path)
 
 
 class QueryModelSEED:
 
-    def __init__(self, db="MongoDB", index='biosets', version="", **kwargs):
+    def __init__(self, db="MongoDB", index='biosets', version="",
+                 namescachedir=None, **kwargs):
+        """
+        :param namescachedir: folder to save compound id -> name tables
+        """
         self.dbc = DBconnection(db, index, **kwargs)
         self.rcollection = REACTIONSTYPE+version
         self.ccollection = COMPOUNDSTYPE+version
+        self.compoundnames = CompoundNames(self.dbc, self.ccollection,
+                                           namescachedir)
 
     # Given ModelSEED compound id return its name
     def getcompoundname(self, dbc, mid, limit=0):
@@ -105,12 +146,7 @@ class QueryModelSEED:
         Given query term find possible metabolite names that match query term
         :param qterm: query term
         """
-        qc = {"$or": [
-            {"name": {
-                "$regex": "^%s" % qterm, "$options": "i"}},
-            {"abbreviation": {
-                "$regex": "^%s" % qterm, "$options": "i"}}
-        ]}
+        qc = prefixquery(qterm)
         r = self.query_metabolites(qc, projection=['name'], **kwargs)
         return list(r)
 
@@ -120,33 +156,28 @@ class QueryModelSEED:
         """
         graph = nx.DiGraph(name='ModelSEEDdb', query=json.dumps(qc))
         reacts = self.dbc.mdbi[self.rcollection].\
-            find(qc, projection=['name', 'equation'], **kwargs)
-        mre = re.compile(r'\((\d*\.*\d*(e-\d+)?)\) (cpd\d+)\[(\d+)\]')
-        r = self.query_metabolites({}, projection=['name'])
-        id2name = {i['_id']: i['name'] for i in r}
+            find(qc, projection=['name', 'reactant_ids', 'product_ids',
+                                 'equation'], **kwargs)
+        id2name = self.compoundnames.table()
+        nodes = dict()  # nodes in the order they are first seen
+        edges = dict()  # (u, v) -> reaction names
         for r in reacts:
-            reactants, products, _ = \
-                modelseeddb_parse_equation(r['equation'])
-            assert reactants is not None
-            for u in reactants:
-                match = re.search(mre, u)
-                u = match.group(3)
+            if 'reactant_ids' not in r:  # indexed without parsed equations
+                r['reactant_ids'], r['product_ids'] = \
+                    equation_compoundids(r['equation'])
+            assert r['reactant_ids'] is not None
+            products = [id2name[v] for v in r['product_ids']]
+            for u in r['reactant_ids']:
                 u = id2name[u]
-                if not graph.has_node(u):
-                    graph.add_node(u)
+                nodes[u] = None
                 for v in products:
-                    match = re.search(mre, v)
-                    v = match.group(3)
-                    v = id2name[v]
-                    if not graph.has_node(v):
-                        graph.add_node(v)
-                    if graph.has_edge(u, v):
-                        er = graph.get_edge_data(u, v)['reactions']
-                        if r['name'] not in er:
-                            er.append(r['name'])
-                    else:
-                        er = list([r['name']])
-                        graph.add_edge(u, v, reactions=er)
+                    nodes[v] = None
+                    er = edges.setdefault((u, v), [])
+                    if r['name'] not in er:
+                        er.append(r['name'])
+        graph.add_nodes_from(nodes)
+        graph.add_edges_from((u, v, {"reactions": er})
+                             for (u, v), er in edges.items())
         return graph
 
 
@@ -0,0 +1,94 @@
+""" Save graph-shaped datasets as node and relationship files
+ for the Neo4j bulk importer, 'neo4j-admin database import' """
+import csv
+import os
+
+ARRAY_DELIMITER = '|'
+
+
+class ImportFile(object):
+    """ CSV file with header, list values are saved as arrays """
+
+    def __init__(self, fname, header):
+        self.fname = fname
+        self.f = open(fname, 'w')
+        self.w = csv.writer(self.f)
+        self.w.writerow(header)
+        self.n = 0
+
+    def add(self, row):
+        self.w.writerow([ARRAY_DELIMITER.join(v) if isinstance(v, list)
+                         else v for v in row])
+        self.n += 1
+
+    def close(self):
+        self.f.close()
+        print("%d rows saved in %s" % (self.n, self.fname))
+
+
+class Neo4jImportFiles(object):
+    """ Node and relationship files are saved in the output folder with
+     their headers, the import command line is saved as a shell script """
+
+    def __init__(self, outdir):
+        if not os.path.exists(outdir):
+            os.makedirs(outdir)
+        self.outdir = outdir
+        self.nodefiles = []  # (label, file name) pairs
+        self.relfiles = []   # (relationship type, file name) pairs
+
+    def nodesfile(self, label, properties=None):
+        """ Open new file for nodes with given label, rows are
+         (id, property values..) tuples; properties are names,
+         optionally with types, such as 'name' or 'mentions:string[]' """
+        header = ["id:ID(%s)" % label] + (properties or [])
+        fname = os.path.join(self.outdir,
+                             "%s-%d.csv" % (label, len(self.nodefiles)))
+        self.nodefiles.append((label, fname))
+        return ImportFile(fname, header)
+
+    def relationshipsfile(self, reltype, startlabel, endlabel,
+                          properties=None):
+        """ Open new file for relationships of given type, rows are
+         (start node id, end node id, property values..) tuples """
+        header = [":START_ID(%s)" % startlabel, ":END_ID(%s)" % endlabel] + \
+                 (properties or [])
+        fname = os.path.join(self.outdir,
+                             "%s-%d.csv" % (reltype, len(self.relfiles)))
+        self.relfiles.append((reltype, fname))
+        return ImportFile(fname, header)
+
+    def write_nodes(self, label, rows, properties=None):
+        f = self.nodesfile(label, properties)
+        for row in rows:
+            f.add(row)
+        f.close()
+        return f.n
+
+    def write_relationships(self, reltype, startlabel, endlabel, rows,
+                            properties=None):
+        f = self.relationshipsfile(reltype, startlabel, endlabel, properties)
+        for row in rows:
+            f.add(row)
+        f.close()
+        return f.n
+
+    def importcommand(self, database='neo4j'):
+        # Duplicate nodes are skipped, input files are not fully deduplicated
+        # when datasets are too large to keep all node ids in memory
+        c = ["neo4j-admin database import full",
+             "--array-delimiter='%s'" % ARRAY_DELIMITER,
+             "--skip-duplicate-nodes=true",
+             "--skip-bad-relationships=true"]
+        c += ["--nodes=%s=%s" % i for i in self.nodefiles]
+        c += ["--relationships=%s=%s" % i for i in self.relfiles]
+        c.append(database)
+        return " \\\n  ".join(c)
+
+    def save_importscript(self, database='neo4j'):
+        fname = os.path.join(self.outdir, "neo4j-admin-import.sh")
+        with open(fname, 'w') as f:
+            f.write("#!/bin/sh\n")
+            f.write(self.importcommand(database) + "\n")
+        print("Neo4j import command saved in %s" % fname)
+        return fname
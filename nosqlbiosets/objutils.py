@@ -57,3 +57,30 @@ def num(e, attr, ntype=int):
             r = ntype(e[attr])
             e[attr] = r
             return r
+
+
+# Field for normalized name keys of the entries, for prefix queries
+NAMEKEYS = "namekeys"
+# Elasticsearch mappings for the name keys field
+NAMEKEYS_ES_MAPPINGS = {
+    "properties": {NAMEKEYS: {"type": "search_as_you_type"}}}
+
+
+# Normalize names for prefix queries; lowercase, and single spaces
+def namekey(name):
+    return ' '.join(name.lower().split())
+
+
+# Sorted list of unique name keys for given names; names can be strings,
+# xmltodict text objects ({'#text': name}), or lists of them
+def namekeys(*names):
+    keys = set()
+    for name in names:
+        if isinstance(name, list):
+            keys.update(namekeys(*name))
+        elif isinstance(name, dict):
+            keys.update(namekeys(name.get('#text')))
+        elif name:
+            keys.add(namekey(name))
+    keys.discard('')
+    return sorted(keys)
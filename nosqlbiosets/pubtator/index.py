@@ -1,6 +1,6 @@
 #!/usr/bin/env python
-# Index NCBI PubTator gene2pub/disease2pub association files with Elasticsearch
-# or gene2pub files with Neo4j
+# Index NCBI PubTator gene2pub/disease2pub association files with Elasticsearch,
+# MongoDB or Neo4j, or save them as files for the Neo4j bulk importer
 
 import argparse
 import gzip
@@ -9,9 +9,21 @@ import os
 
 from elasticsearch.helpers import streaming_bulk
 
-from nosqlbiosets.dbutils import DBconnection
+from nosqlbiosets.dbutils import DBconnection, NEO4J_BATCHSIZE
 
 ChunkSize = 2*1024
+# Neo4j node labels for the entities of gene2pub and disease2pub files
+NEO4J_LABELS = {'gene2pub': 'Gene', 'disease2pub': 'Disease'}
+# Names of the entity id lists in gene2pub and disease2pub records
+REFIDS = {'gene2pub': 'geneids', 'disease2pub': 'diseaseids'}
+# MongoDB collections for the gene/disease id -> sorted PMIDs inverted indexes
+MDB_ENTITY2PMIDS = {'gene2pub': 'pubtator_gene2pmids',
+                    'disease2pub': 'pubtator_disease2pmids'}
+# MongoDB collection for the PMID -> gene and disease ids mappings
+MDB_PMID2IDS = 'pubtator_pmid2ids'
+# PMID lists of the inverted indexes are saved in buckets of PMID ranges,
+# to keep documents of frequently mentioned entities below 16MB
+PMID_BUCKETSIZE = 500000
 
 
 def parse_pub2gene_lines(f, r, doctype):
@@ -54,13 +66,95 @@ def es_index(es, f, doctype):
     return r
 
 
-class Indexer(DBconnection):
+def mongodb_index(mdbi, f, doctype):
+    mdbc = mdbi[doctype]
+    mdbc.delete_many({})
+    r = 0
+    entries = list()
+    for doc in parse_pub2gene_lines(f, r, doctype):
+        del doc['_id']
+        doc['pmid'] = int(doc['pmid'])
+        entries.append(doc)
+        if len(entries) == ChunkSize:
+            mdbc.insert_many(entries, ordered=False)
+            r += len(entries)
+            entries = list()
+    if len(entries) > 0:
+        mdbc.insert_many(entries, ordered=False)
+        r += len(entries)
+    mdbc.create_index("pmid")
+    mdbc.create_index(REFIDS[doctype])
+    mongodb_aggregated_collections(mdbi, doctype)
+    return r
+
+
+def mongodb_aggregated_collections(mdbi, doctype):
+    """ Build entity id -> sorted PMIDs, and PMID -> entity ids collections
+     from the records of given PubTator collection. PMIDs of an entity
+     are saved in documents with ids {id, bucket}, for PMID ranges of
+     PMID_BUCKETSIZE """
+    refids = REFIDS[doctype]
+    agpl = [
+        {"$project": {"pmid": 1, refids: 1}},
+        {"$unwind": "$" + refids},
+        {"$group": {"_id": {"id": "$" + refids, "pmid": "$pmid"}}},
+        {"$sort": {"_id.pmid": 1}},
+        {"$group": {
+            "_id": {
+                "id": "$_id.id",
+                "bucket": {"$trunc": {
+                    "$divide": ["$_id.pmid", PMID_BUCKETSIZE]}}},
+            "pmids": {"$push": "$_id.pmid"}}},
+        {"$out": MDB_ENTITY2PMIDS[doctype]}
+    ]
+    mdbi[doctype].aggregate(agpl, allowDiskUse=True)
+    mdbi[MDB_ENTITY2PMIDS[doctype]].create_index([("_id.id", 1),
+                                                  ("_id.bucket", 1)])
+    mdbi[MDB_PMID2IDS].update_many({}, {"$unset": {refids: ""}})
+    agpl = [
+        {"$project": {"pmid": 1, refids: 1}},
+        {"$unwind": "$" + refids},
+        {"$group": {"_id": "$pmid", refids: {"$addToSet": "$" + refids}}},
+        {"$merge": {"into": MDB_PMID2IDS, "whenMatched": "merge",
+                    "whenNotMatched": "insert"}}
+    ]
+    mdbi[doctype].aggregate(agpl, allowDiskUse=True)
+    # PMIDs no longer mentioning any gene or disease
+    mdbi[MDB_PMID2IDS].delete_many({f: {"$exists": False}
+                                    for f in REFIDS.values()})
+
+
+def neo4j_csvfiles(neo4jfiles, f, doctype):
+    """ Save PubTator file as node and relationship files
+     for the Neo4j bulk importer """
+    label = NEO4J_LABELS[doctype]
+    refids = REFIDS[doctype]
+    pubs = neo4jfiles.nodesfile('Pub')
+    rels = neo4jfiles.relationshipsfile('mentions', 'Pub', label,
+                                        ['mentions:string[]',
+                                         'resource:string[]'])
+    entities = set()
+    prev = None
+    for row in parse_pub2gene_lines(f, 0, doctype):
+        # Input files are grouped by pmid, remaining duplicates
+        # are skipped by the importer
+        if row['pmid'] != prev:
+            prev = row['pmid']
+            pubs.add((prev,))
+        for refid in row[refids]:
+            entities.add(refid)
+            rels.add((row['pmid'], refid, row['mentions'], row['resource']))
+    pubs.close()
+    rels.close()
+    neo4jfiles.write_nodes(label, ((i,) for i in entities))
+    return rels.n
 
-    pubs = {}
-    genes = {}
 
-    def __init__(self, db, index, host, port):
+class Indexer(DBconnection):
+
+    def __init__(self, db, index, host, port, batchsize=NEO4J_BATCHSIZE):
         config = json.load(open(d + "/../../mappings/pubtator.json", "r"))
+        self.batchsize = batchsize
         super(Indexer, self).__init__(db, index, host, port,
                                       es_indexmappings=config['mappings'])
 
@@ -74,56 +168,53 @@ class Indexer(DBconnection):
         if self.db == "Elasticsearch":
             r = es_index(self.es, f, doctype)
             self.es.indices.refresh(index=args.index)
+        elif self.db == "MongoDB":
+            r = mongodb_index(self.mdbi, f, doctype)
+        elif self.db == "Neo4jCSV":
+            r = neo4j_csvfiles(self.neo4jfiles, f, doctype)
         else:
-            self.delete_existing_records()
-            self.set_unique_id_constraints()
             r = self.neo4j_index(f, doctype)
-            self.neo4jc.close()
         return r
 
-    def delete_existing_records(self):
-        q1 = "match (a:Gene) detach delete a"
-        q2 = "match (a:Pub) detach delete a"
-        self.neo4jc.run(q1)
-        self.neo4jc.run(q2)
+    # Delete existing records and create constraints before loading,
+    # MERGE statements use the indexes created for the constraints
+    def prepare_neo4j_db(self):
+        labels = ['Pub'] + list(NEO4J_LABELS.values())
+        self.delete_existing_records(labels)
+        self.set_unique_id_constraints(labels)
+
+    def delete_existing_records(self, labels):
+        for label in labels:
+            self.neo4j_deletenodes(label, self.batchsize)
 
-    def set_unique_id_constraints(self):
-        cq1 = "CREATE CONSTRAINT ON(n:Gene) ASSERT n.id IS UNIQUE"
-        cq2 = "CREATE CONSTRAINT ON(n:Pub) ASSERT n.id IS UNIQUE"
-        self.neo4jc.run(cq1)
-        self.neo4jc.run(cq2)
+    def set_unique_id_constraints(self, labels):
+        for label in labels:
+            cq = "CREATE CONSTRAINT ON(n:%s) ASSERT n.id IS UNIQUE" % label
+            self.neo4jc.run(cq).consume()
 
     def neo4j_index(self, f, doctype):
-        r = 0
-        for row in parse_pub2gene_lines(f, r, doctype):
-            self.write_nodes(row)
-            r += 1
-        print("%d mentions has been processed" % (r-1))
-        print("%d publications have been found" % len(self.pubs))
-        print("%d genes have been found" % len(self.genes))
+        label = NEO4J_LABELS[doctype]
+        refids = REFIDS[doctype]
+        q = "UNWIND $rows AS row" \
+            " MERGE (a:Pub {id: row.pmid})" \
+            " WITH a, row" \
+            " UNWIND row.%s AS refid" \
+            " MERGE (b:%s {id: refid})" \
+            " MERGE (a)-[r:mentions]->(b)" \
+            " SET r.mentions = row.mentions, r.resource = row.resource" \
+            % (refids, label)
+        rows = parse_pub2gene_lines(f, 0, doctype)
+        r = self.neo4j_batchwrite(q, rows, self.batchsize)
+        print("\n%d mentions has been processed" % r)
         return r
 
-    def write_nodes(self, intr):
-        sid = intr['pmid']
-        if sid not in self.pubs:
-            self.pubs[sid] = True
-            self.neo4jc.run("CREATE (a:Pub {id:'" + sid + "'})")
-        for geneid in intr['geneids']:
-            if geneid not in self.genes:
-                self.genes[geneid] = True
-                self.neo4jc.run("CREATE (a:Gene {id:'" + geneid + "'})")
-            q = "match (a:Pub), (b:Gene)" \
-                " where a.id={sid} AND b.id={geneid}"
-            # TODO: multiple mentions and resources
-            lc = " create (a)-[r:mentions {mention:{mention}}]->(b)"
-            self.neo4jc.run(q + lc, {"sid": sid, "geneid": geneid,
-                                     "mention": intr['mentions'][0]})
-
 
 if __name__ == '__main__':
     d = os.path.dirname(os.path.abspath(__file__))
     parser = argparse.ArgumentParser(
-        description='Index NCBI PubTator files using Elasticsearch or Neo4j')
+        description='Index NCBI PubTator files using Elasticsearch, MongoDB'
+                    ' or Neo4j, or save them as files for the Neo4j'
+                    ' bulk importer')
     parser.add_argument('--gene2pubfile',
                         default=d + "/../../data/gene2pubtator.sample",
                         help='PubTator gene2pub file')
@@ -132,17 +223,26 @@ if __name__ == '__main__':
                         help='PubTator disease2pub file')
     parser.add_argument('--index',
                         default="pubtator",
-                        help='name of the Elasticsearch index')
+                        help='name of the Elasticsearch index or MongoDB'
+                             ' database, or output folder with the Neo4jCSV'
+                             ' option')
     parser.add_argument('--host',
-                        help='Elasticsearch or Neo4j server hostname')
+                        help='Elasticsearch, MongoDB or Neo4j server hostname')
     parser.add_argument('--port',
-                        help="Elasticsearch or Neo4j server port")
+                        help="Elasticsearch, MongoDB or Neo4j server port")
     parser.add_argument('--db', default='Elasticsearch',
-                        help="Database: 'Elasticsearch' or 'Neo4j'")
+                        help="Database: 'Elasticsearch', 'MongoDB' or 'Neo4j',"
+                             " or 'Neo4jCSV' for saving files for"
+                             " 'neo4j-admin database import' command")
+    parser.add_argument('--batchsize', type=int, default=NEO4J_BATCHSIZE,
+                        help="Number of lines written in a Neo4j transaction")
     args = parser.parse_args()
-    indxr = Indexer(args.db, args.index, args.host, args.port)
+    indxr = Indexer(args.db, args.index, args.host, args.port, args.batchsize)
+    if args.db == 'Neo4j':
+        indxr.prepare_neo4j_db()
     indxr.read_and_index_pubtator_file(args.gene2pubfile, 'gene2pub')
-    if args.db == 'Elasticsearch':
-        indxr.read_and_index_pubtator_file(args.disease2pubfile, 'disease2pub')
-        # TODO: Neo4j indexer for disease2pub files
-    # TODO: indexer with MongoDB
+    indxr.read_and_index_pubtator_file(args.disease2pubfile, 'disease2pub')
+    if args.db == 'Neo4j':
+        indxr.neo4jc.close()
+    elif args.db == 'Neo4jCSV':
+        indxr.neo4jfiles.save_importscript()
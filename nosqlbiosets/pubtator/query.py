@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+""" Query PubTator gene2pub/disease2pub mappings indexed with MongoDB """
+# Server connection details are read from conf/dbservers.json file
+
+import argh
+
+from nosqlbiosets.pubtator.index import MDB_ENTITY2PMIDS, MDB_PMID2IDS
+from nosqlbiosets.qryutils import Query
+
+
+def intersect_sorted(a, b):
+    """ Intersection of two sorted iterables, values are yielded in order
+     as they are found, inputs are read only as far as needed """
+    a, b = iter(a), iter(b)
+    try:
+        x, y = next(a), next(b)
+        while True:
+            if x < y:
+                x = next(a)
+            elif x > y:
+                y = next(b)
+            else:
+                yield x
+                x, y = next(a), next(b)
+    except StopIteration:
+        return
+
+
+class QueryPubTator(Query):
+
+    def __init__(self, dbtype="MongoDB", index="pubtator",
+                 mdbcollection="gene2pub", **kwargs):
+        super(QueryPubTator, self).__init__(dbtype, index,
+                                            mdbcollection, **kwargs)
+
+    def pmids(self, eid, doctype='gene2pub'):
+        """ Sorted PMIDs of the publications mentioning given gene
+         or disease, doctype should be 'gene2pub' or 'disease2pub';
+         PMID buckets are read in order, as the PMIDs are consumed """
+        cr = self.dbc.mdbi[MDB_ENTITY2PMIDS[doctype]].find(
+            {"_id.id": eid}).sort("_id.bucket", 1)
+        for bucket in cr:
+            for pmid in bucket['pmids']:
+                yield pmid
+
+    def comentions(self, geneids=None, diseaseids=None):
+        """ PMIDs of the publications mentioning all given genes
+         and diseases """
+        eids = [(i, 'gene2pub') for i in geneids or []] + \
+               [(i, 'disease2pub') for i in diseaseids or []]
+        r = None
+        for eid, doctype in eids:
+            pmids = self.pmids(eid, doctype)
+            r = pmids if r is None else intersect_sorted(r, pmids)
+        return list(r) if r is not None else []
+
+    def pmid2ids(self, pmids):
+        """ Gene and disease ids mentioned in given publications """
+        cr = self.dbc.mdbi[MDB_PMID2IDS].find({"_id": {"$in": pmids}})
+        return {i['_id']: i for i in cr}
+
+
+def comentions(geneids='', diseaseids='', index="pubtator"):
+    """ Print PMIDs of the publications mentioning all given genes
+    and diseases
+
+    :param geneids: NCBI gene ids, separated by commas
+    :param diseaseids: disease ids, such as MESH:D003920,
+                       separated by commas
+    :param index: MongoDB database name
+    """
+    qry = QueryPubTator(index=index)
+    r = qry.comentions([i for i in geneids.split(',') if i],
+                       [i for i in diseaseids.split(',') if i])
+    for pmid in r:
+        print(pmid)
+
+
+if __name__ == '__main__':
+    argh.dispatch_commands([
+        comentions
+    ])
@@ -1,6 +1,14 @@
+import functools
+import hashlib
 import json
+import os
+import pickle
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 from nosqlbiosets.dbutils import DBconnection
+from nosqlbiosets.objutils import NAMEKEYS, namekey
 
 
 def parseinputquery(query):
@@ -22,41 +30,542 @@ def parseinputquery(query):
     return qc
 
 
+def _es_supports_pit(es):
+    # Point-in-time searches are available with servers 7.10 or later,
+    # 7.12 added the '_shard_doc' tiebreaker sort
+    if not hasattr(es, "open_point_in_time"):
+        return False
+    version = es.info()['version']['number'].split('.')
+    return tuple(int(i) for i in version[:2]) >= (7, 12)
+
+
+def esstream(es, index, qc, pagesize=1000, source=None, keepalive="2m"):
+    """ Iterate over all documents matching the query clause qc,
+    page by page, using point-in-time and 'search_after' parameter,
+    or scroll requests with older servers.
+    Documents are returned as the '_source' objects with their '_id's added,
+    similar to documents returned by MongoDB cursors
+
+    :param qc: Elasticsearch query clause, such as {"match": {"a": 1}}
+    :param pagesize: number of documents read with each request
+    :param source: '_source' filter, such as ["organism.name"]
+    :param keepalive: time to keep search contexts between requests
+    """
+    body = {"query": qc if qc is not None else {"match_all": {}}}
+    if source is not None:
+        body["_source"] = source
+    if not _es_supports_pit(es):
+        from elasticsearch.helpers import scan
+        for hit in scan(es, query=body, index=index, size=pagesize,
+                        scroll=keepalive):
+            yield _esdoc(hit)
+        return
+    pit = es.open_point_in_time(index=index, keep_alive=keepalive)['id']
+    body["size"] = pagesize
+    body["sort"] = [{"_shard_doc": "asc"}]
+    body["track_total_hits"] = False
+    try:
+        while True:
+            body["pit"] = {"id": pit, "keep_alive": keepalive}
+            r = es.search(body=body)
+            hits = r['hits']['hits']
+            for hit in hits:
+                yield _esdoc(hit)
+            if len(hits) < pagesize:
+                break
+            body["search_after"] = hits[-1]['sort']
+            pit = r.get('pit_id', pit)
+    finally:
+        es.close_point_in_time(body={"id": pit})
+
+
+def _esdoc(hit):
+    doc = hit.get('_source', {})
+    doc['_id'] = hit['_id']
+    return doc
+
+
+def prefixquery(qterm, dbtype="MongoDB", field=NAMEKEYS):
+    """ Query clause for entries with name keys starting with given term,
+    name keys are saved by the indexers in normalized lowercase form.
+    With MongoDB the range query on the name keys uses the index
+    of the field, unlike case-insensitive regular expression queries """
+    prefix = namekey(qterm)
+    if dbtype == 'Elasticsearch':
+        return {"multi_match": {
+            "query": prefix, "type": "bool_prefix",
+            "fields": [field, field + "._2gram", field + "._3gram"]}}
+    if len(prefix) == 0:
+        return {}
+    end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return {field: {"$elemMatch": {"$gte": prefix, "$lt": end}}}
+
+
+class QueryCache(object):
+    """ LRU cache of query results with time-to-live for the entries,
+     optionally backed by a folder shared by multiple processes.
+     Results are saved pickled, each hit returns a new copy of the result
+     """
+
+    def __init__(self, maxsize=256, ttl=600, diskdir=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.diskdir = diskdir
+        if diskdir is not None and not os.path.exists(diskdir):
+            os.makedirs(diskdir)
+        self.entries = OrderedDict()  # key -> (time saved, pickled result)
+
+    @staticmethod
+    def key(*args):
+        """ Canonical string for given query arguments, order of the keys
+         of query objects are kept, since it is significant with MongoDB
+         for sort specifications for example """
+        return json.dumps(args, default=str)
+
+    def _diskfile(self, key):
+        h = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.diskdir, h + ".pickle")
+
+    def get(self, key):
+        """ Return cached result for given key, or None """
+        now = time.time()
+        if key in self.entries:
+            t, v = self.entries[key]
+            if now - t <= self.ttl:
+                self.entries.move_to_end(key)
+                return pickle.loads(v)
+            del self.entries[key]
+        if self.diskdir is not None:
+            fname = self._diskfile(key)
+            if os.path.exists(fname) and \
+                    now - os.path.getmtime(fname) <= self.ttl:
+                with open(fname, 'rb') as f:
+                    k, v = pickle.load(f)
+                if k == key:
+                    self._add(key, v, os.path.getmtime(fname))
+                    return pickle.loads(v)
+        return None
+
+    def set(self, key, value):
+        v = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self._add(key, v, time.time())
+        if self.diskdir is not None:
+            # Write and rename, concurrent readers never see partial files
+            fname = self._diskfile(key)
+            tmpfname = "%s.%d" % (fname, os.getpid())
+            with open(tmpfname, 'wb') as f:
+                pickle.dump((key, v), f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmpfname, fname)
+
+    def _add(self, key, v, t):
+        self.entries[key] = (t, v)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class IdResolver(object):
+    """ Maps identifiers from one namespace to another, such as KEGG compound
+     ids to MetaNetX ids. Input ids are queried in chunks, chunks are queried
+     concurrently, and mappings of recently queried ids are kept in memory.
+
+     The lookup function is called with (ids, source namespace,
+     target namespace) arguments for each chunk of ids, and should return
+     (source id, target id) pairs for the ids it has found mappings
+     """
+
+    def __init__(self, lookup, chunksize=2000, nthreads=4, memosize=200000):
+        self.lookup = lookup
+        self.chunksize = chunksize
+        self.nthreads = nthreads
+        self.memosize = memosize
+        self.memo = OrderedDict()  # (source, target, id) -> target ids
+
+    def _lookup_chunk(self, ids, source, target):
+        r = {id_: [] for id_ in ids}
+        for id_, tid in self.lookup(ids, source, target):
+            if id_ in r and tid not in r[id_]:
+                r[id_].append(tid)
+        return r
+
+    def resolve_ids(self, ids, source, target):
+        """ Return dictionary of input ids to lists of matching target ids,
+        lists are empty for ids without mappings """
+        r = dict()
+        queryids = []
+        for id_ in ids:
+            if id_ in r:
+                continue
+            k = source, target, id_
+            if k in self.memo:
+                self.memo.move_to_end(k)
+                r[id_] = list(self.memo[k])
+            else:
+                r[id_] = None
+                queryids.append(id_)
+        chunks = [queryids[i:i + self.chunksize]
+                  for i in range(0, len(queryids), self.chunksize)]
+        if len(chunks) == 1 or self.nthreads < 2:
+            results = [self._lookup_chunk(chunk, source, target)
+                       for chunk in chunks]
+        else:
+            with ThreadPoolExecutor(self.nthreads) as executor:
+                results = list(executor.map(
+                    lambda chunk: self._lookup_chunk(chunk, source, target),
+                    chunks))
+        for chunkr in results:
+            for id_, tids in chunkr.items():
+                r[id_] = tids
+                self.memo[(source, target, id_)] = tuple(tids)
+        while len(self.memo) > self.memosize:
+            self.memo.popitem(last=False)
+        return r
+
+    def clear(self):
+        self.memo.clear()
+
+
+class QueryProfiler(object):
+    """ Latency statistics of query methods, and log of slow queries.
+     Slow MongoDB queries are logged with their 'explain' outputs
+     (executionStats), slow Elasticsearch searches with their profiles.
+     Profilers can be shared by multiple query objects """
+
+    # Upper bounds of the latency histogram buckets, in milliseconds
+    BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000,
+               float('inf')]
+
+    def __init__(self, slowms=500, logfile=None, maxslowqueries=100):
+        """
+        :param slowms: queries slower than this are logged, in milliseconds
+        :param logfile: slow queries are appended to this file as json lines
+        """
+        self.slowms = slowms
+        self.logfile = logfile
+        self.methods = dict()  # method name -> latency statistics
+        self.slowqueries = deque(maxlen=maxslowqueries)
+
+    def record(self, method, ms, ndocs=None, serverms=None):
+        if method not in self.methods:
+            self.methods[method] = {"n": 0, "totalms": 0, "maxms": 0,
+                                    "docs": 0, "serverms": 0,
+                                    "histogram": [0] * len(self.BUCKETS)}
+        m = self.methods[method]
+        m["n"] += 1
+        m["totalms"] += ms
+        m["maxms"] = max(m["maxms"], ms)
+        m["docs"] += ndocs or 0
+        m["serverms"] += serverms or 0
+        for i, bound in enumerate(self.BUCKETS):
+            if ms <= bound:
+                m["histogram"][i] += 1
+                break
+
+    def isslow(self, ms):
+        return self.slowms is not None and ms >= self.slowms
+
+    def logslowquery(self, entry):
+        self.slowqueries.append(entry)
+        if self.logfile is not None:
+            with open(self.logfile, 'a') as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+
+    def percentile(self, method, p):
+        """ Approximate latency percentile of the method, upper bound
+        of the histogram bucket the percentile falls in """
+        m = self.methods[method]
+        n = 0
+        for bound, k in zip(self.BUCKETS, m["histogram"]):
+            n += k
+            if n >= m["n"] * p / 100.0:
+                return bound
+
+    def report(self):
+        lines = ["%-40s %7s %9s %8s %8s %9s" % (
+            "method", "calls", "mean(ms)", "p50", "p95", "max(ms)")]
+        for method, m in sorted(self.methods.items(),
+                                key=lambda x: -x[1]["totalms"]):
+            lines.append("%-40s %7d %9.1f %8g %8g %9.1f" % (
+                method, m["n"], m["totalms"] / m["n"],
+                self.percentile(method, 50), self.percentile(method, 95),
+                m["maxms"]))
+        return "\n".join(lines)
+
+    def instrument(self, qry):
+        """ Record latencies of the public methods of given query object,
+        for query classes not derived from the Query class, such as
+        QueryMetaNetX; results that are lists are counted as documents """
+        for name in dir(qry):
+            f = getattr(qry, name)
+            if name.startswith('_') or not callable(f) or \
+                    not hasattr(f, '__self__'):
+                continue
+            setattr(qry, name, self._timed(
+                "%s.%s" % (type(qry).__name__, name), f))
+        return qry
+
+    def _timed(self, method, f):
+        @functools.wraps(f)
+        def timed(*args, **kwargs):
+            t = time.time()
+            r = f(*args, **kwargs)
+            ms = (time.time() - t) * 1000
+            ndocs = len(r) if isinstance(r, (list, set, dict)) else None
+            self.record(method, ms, ndocs)
+            if self.isslow(ms):
+                self.logslowquery({"time": time.time(), "method": method,
+                                   "ms": ms, "args": args, "kwargs": kwargs})
+            return r
+        return timed
+
+
+def _planstages(plan, stages=None):
+    # Stage names in MongoDB explain output, such as COLLSCAN and IXSCAN
+    stages = set() if stages is None else stages
+    if isinstance(plan, dict):
+        for k, v in plan.items():
+            if k == 'stage':
+                stages.add(v)
+            else:
+                _planstages(v, stages)
+    elif isinstance(plan, list):
+        for v in plan:
+            _planstages(v, stages)
+    return stages
+
+
+class ProfiledCursor(object):
+    """ Iterates over MongoDB cursor, time spent reading the cursor is
+     added to the query time, and passed to done(ms, ndocs) when the
+     cursor is exhausted or closed """
+
+    def __init__(self, cursor, ms, done):
+        self.cursor = cursor
+        self.docs = iter(cursor)
+        self.ms = ms
+        self.ndocs = 0
+        self.done = done
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        t = time.time()
+        try:
+            doc = next(self.docs)
+        except StopIteration:
+            self.ms += (time.time() - t) * 1000
+            self.close()
+            raise
+        self.ms += (time.time() - t) * 1000
+        self.ndocs += 1
+        return doc
+
+    next = __next__
+
+    def close(self):
+        if self.done is not None:
+            done, self.done = self.done, None
+            done(self.ms, self.ndocs)
+        if hasattr(self.cursor, 'close'):
+            self.cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
 class Query:
 
-    def __init__(self, dbtype, index, mdbcollection, **kwargs):
+    # Seconds between checks of the index generation stamps,
+    # with result caches
+    GENERATION_CHECK_INTERVAL = 5
+
+    def __init__(self, dbtype, index, mdbcollection, cache=None,
+                 profiler=None, **kwargs):
+        """
+        :param cache: QueryCache object for caching results of 'query',
+                      'count', 'distinct' and 'aggregate_query' calls,
+                      can be shared by multiple Query objects
+        :param profiler: QueryProfiler object for recording latencies of
+                         the same calls, and for logging slow queries;
+                         calls are recorded with the method names given
+                         to them, or as '<class name>.<call>', MongoDB
+                         cursors are recorded when they are exhausted
+        """
         self.index = index
         self.mdbcollection = mdbcollection
         self.dbc = DBconnection(dbtype, self.index, **kwargs)
+        self.cache = cache
+        self.profiler = profiler
+        self._generation = None, 0  # (generation stamp, time checked)
+        self.idresolver = None
 
-    def query(self, qc, projection=None, limit=0):
-        if self.dbc.db == 'Elasticsearch':
-            c = self.dbc.es.search(index=self.index, body=qc, size=limit)
+    def generation(self):
+        """ Generation stamp of the collection/index, indexers update stamps
+         after each reload, cached results of older generations are not
+         returned """
+        g, t = self._generation
+        now = time.time()
+        if now - t > self.GENERATION_CHECK_INTERVAL:
+            name = self.index if self.dbc.db == 'Elasticsearch' \
+                else self.mdbcollection
+            g = self.dbc.get_generation(name)
+            self._generation = g, now
+        return g
+
+    def _cached(self, op, args, func):
+        if self.cache is None:
+            return func()
+        key = self.cache.key(self.dbc.db, self.index, self.mdbcollection,
+                             self.generation(), op, args)
+        r = self.cache.get(key)
+        if r is None:
+            r = func()
+            if op in ['query', 'aggregate_query'] and \
+                    self.dbc.db != 'Elasticsearch':
+                r = list(r)  # Cursors are read to lists
+            self.cache.set(key, r)
+        return r
+
+    def _profiled(self, op, args, func, method=None, cached=True):
+        run = (lambda: self._cached(op, args, func)) if cached else func
+        if self.profiler is None:
+            return run()
+        # Calls are recorded with the names given by the callers,
+        # such as 'getgenes', or as 'QueryUniProt.aggregate_query'
+        method = "%s.%s" % (type(self).__name__, op) if method is None \
+            else method
+        t = time.time()
+        r = run()
+        ms = (time.time() - t) * 1000
+        if op in ['query', 'aggregate_query'] and \
+                self.dbc.db != 'Elasticsearch' and not isinstance(r, list):
+            # Cursors are recorded when they are exhausted or closed
+            return ProfiledCursor(r, ms, lambda ms_, ndocs: self._record(
+                method, op, args, ms_, ndocs))
+        serverms = None
+        if isinstance(r, list):
+            ndocs = len(r)
+        elif isinstance(r, dict) and 'hits' in r:  # Elasticsearch response
+            ndocs = len(r['hits']['hits'])
+            serverms = r.get('took')
         else:
-            c = self.dbc.mdbi[self.mdbcollection].find(qc,
-                                                       projection=projection,
-                                                       limit=limit)
-        return c
+            ndocs = None
+        self._record(method, op, args, ms, ndocs, serverms)
+        return r
+
+    def _record(self, method, op, args, ms, ndocs, serverms=None):
+        self.profiler.record(method, ms, ndocs, serverms)
+        if self.profiler.isslow(ms):
+            entry = {"time": time.time(), "method": method,
+                     "db": self.dbc.db, "index": self.index,
+                     "collection": self.mdbcollection,
+                     "ms": ms, "ndocs": ndocs, "args": args}
+            try:
+                entry.update(self.explain(op, args))
+            except Exception as e:
+                entry["explainerror"] = str(e)
+            self.profiler.logslowquery(entry)
 
-    def count(self, qc, **kwargs):
+    def explain(self, op, args):
+        """ MongoDB 'explain' output with execution statistics,
+        or Elasticsearch search profile, for given query call """
         if self.dbc.db == 'Elasticsearch':
-            n = self.dbc.es.count(index=self.dbc.index, body=qc)['count']
+            if op == 'query':
+                (qc, _, size), index = args, self.index
+            elif op == 'esquery':
+                index, qc, size = args
+            else:
+                return {}
+            r = self.dbc.es.search(index=index, size=size,
+                                   body=dict(qc, profile=True))
+            return {"serverms": r.get('took'), "profile": r['profile']}
+        c = self.mdbcollection
+        if op == 'query':
+            qc, projection, limit = args
+            cmd = {"find": c, "filter": qc, "limit": limit}
+            if isinstance(projection, list):
+                projection = {field: 1 for field in projection}
+            if projection is not None:
+                cmd["projection"] = projection
+        elif op == 'count':
+            cmd = {"count": c, "query": args[0]}
+        elif op == 'distinct':
+            cmd = {"distinct": c, "key": args[0], "query": args[1] or {}}
         else:
-            n = self.dbc.mdbi[self.mdbcollection].count(qc, **kwargs)
-        return n
+            cmd = {"aggregate": c, "pipeline": args[0], "cursor": {}}
+        r = self.dbc.mdbi.command("explain", cmd, verbosity="executionStats")
+        stats = r.get('executionStats', {})
+        return {"serverms": stats.get('executionTimeMillis'),
+                "stages": sorted(_planstages(r)), "explain": r}
 
-    def distinct(self, key, qc=None):
-        r = self.dbc.mdbi[self.mdbcollection].distinct(key, filter=qc)
-        return r
+    def query(self, qc, projection=None, limit=0, method=None):
+        def func():
+            if self.dbc.db == 'Elasticsearch':
+                c = self.dbc.es.search(index=self.index, body=qc, size=limit)
+            else:
+                c = self.dbc.mdbi[self.mdbcollection].\
+                    find(qc, projection=projection, limit=limit)
+            return c
+        return self._profiled('query', [qc, projection, limit], func,
+                              method)
 
-    def aggregate_query(self, agpl, **kwargs):
-        r = self.dbc.mdbi[self.mdbcollection].aggregate(agpl, **kwargs)
-        return r
+    def count(self, qc, method=None, **kwargs):
+        def func():
+            if self.dbc.db == 'Elasticsearch':
+                n = self.dbc.es.count(index=self.dbc.index, body=qc)['count']
+            else:
+                n = self.dbc.mdbi[self.mdbcollection].count(qc, **kwargs)
+            return n
+        return self._profiled('count', [qc, kwargs], func, method)
+
+    def distinct(self, key, qc=None, method=None):
+        def func():
+            return self.dbc.mdbi[self.mdbcollection].distinct(key, filter=qc)
+        return self._profiled('distinct', [key, qc], func, method)
+
+    def aggregate_query(self, agpl, method=None, **kwargs):
+        def func():
+            return self.dbc.mdbi[self.mdbcollection].aggregate(agpl, **kwargs)
+        return self._profiled('aggregate_query', [agpl, kwargs], func,
+                              method)
 
-    def esquery(self, index, qc, size=10):
+    def stream(self, qc, projection=None, pagesize=1000):
+        """ Iterate over all documents matching the query clause qc,
+        without reading all documents to memory,
+        qc is an Elasticsearch query clause with Elasticsearch connections
+        """
+        if self.dbc.db == 'Elasticsearch':
+            return esstream(self.dbc.es, self.index, qc, pagesize=pagesize,
+                            source=projection)
+        return self.dbc.mdbi[self.mdbcollection].\
+            find(qc, projection=projection, batch_size=pagesize)
+
+    def resolve_ids(self, ids, source_namespace, target_namespace):
+        """ Map given ids to ids in the target namespace, see IdResolver,
+        namespaces supported depend on the dataset; query classes
+        supporting id mappings implement idlookup(ids, source, target)
+        methods returning (source id, target id) pairs for chunks of ids """
+        if not hasattr(self, 'idlookup'):
+            raise ValueError("%s does not support id mappings, from '%s'"
+                             " to '%s'" % (type(self).__name__,
+                                          source_namespace, target_namespace))
+        if self.idresolver is None:
+            self.idresolver = IdResolver(self.idlookup)
+        return self.idresolver.resolve_ids(ids, source_namespace,
+                                           target_namespace)
+
+    def esquery(self, index, qc, size=10, method=None):
         print("Querying '%s': %s" % (index, json.dumps(qc, indent=4)))
         assert self.dbc.db == 'Elasticsearch'
-        r = self.dbc.es.search(index=index, body=qc, size=size)
+
+        def func():
+            return self.dbc.es.search(index=index, body=qc, size=size)
+        r = self._profiled('esquery', [index, qc, size], func, method,
+                           cached=False)
         nhits = r['hits']['total']
         aggs = r["aggregations"] if "aggregations" in r else None
         return r['hits']['hits'], nhits, aggs
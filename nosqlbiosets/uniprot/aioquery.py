@@ -0,0 +1,30 @@
+""" Asyncio counterparts of UniProt queries, with the aggregation
+ pipelines of the sync QueryUniProt queries """
+
+from nosqlbiosets.aioqryutils import AsyncQuery
+from nosqlbiosets.uniprot.query import INTENZ_COLLECTION, genecounts, \
+    genes_aggq, keggreaction_genes_aggq
+
+
+class AsyncQueryUniProt(AsyncQuery):
+    """ Async counterparts of QueryUniProt queries, MongoDB only """
+
+    def __init__(self, dbtype="MongoDB", index="biosets",
+                 mdbcollection="uniprot", **kwargs):
+        super(AsyncQueryUniProt, self).__init__(dbtype, index, mdbcollection,
+                                                **kwargs)
+
+    async def getaccs(self, ecn, reftype="EC"):
+        qc = {"dbReference.id": ecn, "dbReference.type": reftype}
+        return await self.distinct('accession', qc)
+
+    async def getgenes(self, ecn, qc=None, limit=100):
+        if qc is None:
+            qc = {"dbReference.id": ecn}
+        cr = await self.aggregate_query(genes_aggq(qc, limit))
+        return genecounts(cr)
+
+    async def genes_linkedto_keggreaction(self, keggrid):
+        agpl = keggreaction_genes_aggq(keggrid, self.mdbcollection)
+        docs = await self.aggregate_query(agpl, collection=INTENZ_COLLECTION)
+        return {doc['uniprot']['gene']['name']['#text'] for doc in docs}
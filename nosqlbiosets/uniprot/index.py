@@ -7,24 +7,71 @@
 import argparse
 import traceback
 from gzip import GzipFile
+from itertools import count
 from multiprocessing.pool import ThreadPool
 
 import xmltodict
-from pymongo import IndexModel
+from pymongo import IndexModel, UpdateMany
 from six import string_types
 
 from nosqlbiosets.dbutils import DBconnection, dbargs
+from nosqlbiosets.uniprot.query import FACETS_SUFFIX, TAXONOMY_SUFFIX
+from nosqlbiosets.xrefs import XrefWriter
 
 pool = ThreadPool(14)   # Threads for index calls, parsing is in the main thread
 MAX_QUEUED_JOBS = 1400  # Maximum number of index jobs in queue
 MDBCOLLECTION = 'uniprot'
+FACET_MAXSIZE = 2000  # Maximum number of counts saved for each facet key
+
+# Keys of the facet summaries; EC numbers and organism taxonomy ids
+FACET_KEYS = {
+    "ec": {"$map": {
+        "input": {"$filter": {
+            "input": {"$cond": [{"$isArray": "$dbReference"},
+                                "$dbReference", ["$dbReference"]]},
+            "cond": {"$eq": ["$$this.type", "EC"]}}},
+        "in": "$$this.id"}},
+    "organism": "$organism.dbReference.id"
+}
+_NAMECOUNTS = {"type": "$_id.type", "name": "$_id.name", "total": "$total"}
+_TEXTCOUNTS = {"_id": "$_id.text", "total": "$total"}
+_ANNOTCOUNTS = {"abundance": "$total", "id": "$_id.id",
+                "name": "$_id.name.value"}
+# Facet summaries; (fields read, stages, group keys, count objects),
+# count objects are the same as the results of the live queries
+FACETS = {
+    "genes": ("gene", [{"$unwind": "$gene"}, {"$unwind": "$gene.name"}],
+              {"type": "$gene.name.type", "name": "$gene.name.#text"},
+              _NAMECOUNTS),
+    "organisms": ("organism", [{"$unwind": "$organism.name"}],
+                  {"type": "$organism.name.type",
+                   "name": "$organism.name.#text"},
+                  _NAMECOUNTS),
+    "pathways": ("comment", [{"$unwind": "$comment"},
+                             {"$match": {"comment.type": "pathway"}}],
+                 {"text": "$comment.text.#text"}, _TEXTCOUNTS),
+    "catalyticactivity": ("comment", [
+        {"$unwind": "$comment"},
+        {"$match": {"comment.type": "catalytic activity"}}],
+        {"text": "$comment.reaction.text"}, _TEXTCOUNTS),
+    "GO": ("dbReference", [{"$unwind": "$dbReference"},
+                           {"$match": {"dbReference.type": "GO"}}],
+           {"id": "$dbReference.id",
+            "name": {"$arrayElemAt": ['$dbReference.property', 0]}},
+           _ANNOTCOUNTS),
+    "Pfam": ("dbReference", [{"$unwind": "$dbReference"},
+                             {"$match": {"dbReference.type": "Pfam"}}],
+             {"id": "$dbReference.id",
+              "name": {"$arrayElemAt": ['$dbReference.property', 0]}},
+             _ANNOTCOUNTS)
+}
 
 
 class Indexer(DBconnection):
 
     def __init__(self, db, esindex, mdbdb, mdbcollection=MDBCOLLECTION,
                  host=None, port=None,
-                 recreateindex=True):
+                 recreateindex=True, xrefs=False):
         self.index = esindex if db == "Elasticsearch" else mdbdb
         self.db = db
         indxcfg = {  # for Elasticsearch
@@ -35,9 +82,14 @@ class Indexer(DBconnection):
                                       mdbcollection=mdbcollection,
                                       es_indexsettings=indxcfg,
                                       recreateindex=recreateindex)
+        self.xrefw = None
         if db == "MongoDB":
             self.mcl = self.mdbi[mdbcollection]
             self.mcl.drop()
+            # Summaries of earlier entries are not valid anymore
+            self.mdbi.drop_collection(mdbcollection + FACETS_SUFFIX)
+            if xrefs:
+                self.xrefw = XrefWriter(self.mdbi, mdbcollection)
 
     # Read and Index entries in UniProt xml file
     def parse_uniprot_xmlfiles(self, infile):
@@ -68,6 +120,8 @@ class Indexer(DBconnection):
                 else:  # assume MongoDB
                     spec = {"_id": docid}
                     self.mcl.update(spec, entry, upsert=True)
+                    if self.xrefw is not None:
+                        self.xrefw.add(docid, uniprot_xrefs(entry))
             except Exception as e:
                 print("ERROR: %s" % e)
                 print(traceback.format_exc())
@@ -221,6 +275,23 @@ class Indexer(DBconnection):
         self.updatesequence(entry['sequence'])
 
 
+def uniprot_xrefs(entry):
+    """ (namespace, id) pairs of UniProt entry for the xref collection,
+    'uniprotkb' for accessions, 'uniprot_name' for entry names,
+    'genename' for primary gene names, and dbReference types """
+    accs = entry['accession']
+    for acc in accs if isinstance(accs, list) else [accs]:
+        yield 'uniprotkb', acc
+    yield 'uniprot_name', entry['name']
+    for gene in entry.get('gene', []):
+        for name in gene['name']:
+            if name['type'] == 'primary':
+                yield 'genename', name['#text']
+    xrefs = entry.get('dbReference', [])
+    for xref in xrefs if isinstance(xrefs, list) else [xrefs]:
+        yield xref['type'], xref['id']
+
+
 def mongodb_indices(mdb):
     index = IndexModel([
         ("comment.text.#text", "text"),
@@ -242,18 +313,111 @@ def mongodb_indices(mdb):
         mdb.create_index(field)
 
 
+def taxonomy_tree(organisms):
+    """ Nested-set numbered taxonomy tree for (taxon id, lineage) pairs;
+    returns taxonomy nodes, lineage taxa and organisms, with their
+    (left, right) intervals. Intervals of descendants of a node are
+    within the interval of the node """
+    root = {"children": {}, "organisms": []}
+    for taxid, lineage in organisms:
+        node = root
+        for name in lineage:
+            node = node["children"].setdefault(
+                name, {"children": {}, "organisms": []})
+        node["organisms"].append(taxid)
+    nodes = []
+    counter = count()
+
+    def number(node, name, lineage):
+        r = {"name": name, "lineage": lineage, "left": next(counter),
+             "depth": len(lineage)}
+        nodes.append(r)
+        for taxid in node["organisms"]:
+            left = next(counter)
+            nodes.append({"taxid": taxid, "lineage": lineage, "left": left,
+                          "right": next(counter), "depth": len(lineage) + 1})
+        for name_, child in node["children"].items():
+            number(child, name_, lineage + [name_])
+        r["right"] = next(counter)
+    number(root, None, [])
+    return nodes
+
+
+def mongodb_taxonomy(mcl, batchsize=1000):
+    """ Build taxonomy table of the organisms of UniProt entries,
+    and save taxonomy intervals of the organisms of the entries """
+    aggq = [{"$group": {"_id": "$organism.dbReference.id",
+                        "lineage": {"$first": "$organism.lineage.taxon"}}}]
+    organisms = []
+    for i in mcl.aggregate(aggq, allowDiskUse=True):
+        lineage = i.get('lineage') or []
+        organisms.append((i['_id'], lineage if isinstance(lineage, list)
+                          else [lineage]))
+    nodes = taxonomy_tree(organisms)
+    txcl = mcl.database[mcl.name + TAXONOMY_SUFFIX]
+    txcl.drop()
+    txcl.insert_many(nodes)
+    txcl.create_index([("left", 1), ("right", 1)])
+    txcl.create_index("name")
+    updates = [UpdateMany({"organism.dbReference.id": node['taxid']},
+                          {"$set": {"organism.taxleft": node['left'],
+                                    "organism.taxright": node['right']}})
+               for node in nodes if 'taxid' in node]
+    for i in range(0, len(updates), batchsize):
+        mcl.bulk_write(updates[i:i + batchsize], ordered=False)
+    mcl.create_index("organism.taxleft")
+    print("Taxonomy table saved for %d organisms" % len(updates))
+
+
+def mongodb_facets(mcl):
+    """ Save facet summaries of the entries of each EC number and organism,
+    such as gene name counts, in the facets collection """
+    fcl = mcl.database[mcl.name + FACETS_SUFFIX]
+    fcl.drop()
+    for key, keyexpr in FACET_KEYS.items():
+        for facet, (field, stages, groupkeys, counts) in FACETS.items():
+            if key == 'organism' and facet == 'organisms':
+                continue
+            print("Saving '%s' summaries for %s keys" % (facet, key))
+            aggq = [
+                {"$project": {"k": keyexpr, field: 1}},
+                {"$unwind": "$k"},
+                {"$match": {"k": {"$ne": None}}}
+            ] + stages + [
+                {"$group": {"_id": dict(groupkeys, k="$k"),
+                            "total": {"$sum": 1}}},
+                {"$sort": {"total": -1}},
+                {"$group": {"_id": "$_id.k", "counts": {"$push": counts},
+                            "n": {"$sum": 1}}},
+                {"$project": {
+                    "_id": {"$concat": [key, ":", facet, ":",
+                                        {"$toString": "$_id"}]},
+                    "counts": {"$slice": ["$counts", FACET_MAXSIZE]},
+                    "n": 1}},
+                {"$merge": {"into": fcl.name}}
+            ]
+            mcl.aggregate(aggq, allowDiskUse=True)
+
+
 def main(infile, esindex, mdbdb, mdbcollection, db, host=None, port=None,
-         recreateindex=True):
+         recreateindex=True, xrefs=False, facets=False):
     indxr = Indexer(db, esindex, mdbdb, mdbcollection, host, port,
-                    recreateindex=recreateindex)
+                    recreateindex=recreateindex, xrefs=xrefs)
     indxr.parse_uniprot_xmlfiles(infile)
     pool.close()
     pool.join()
     pool.terminate()
     if db == 'Elasticsearch':
         indxr.es.indices.refresh(index=esindex)
+        indxr.bump_generation(esindex)
     else:
         mongodb_indices(indxr.mcl)
+        mongodb_taxonomy(indxr.mcl)
+        if facets:
+            mongodb_facets(indxr.mcl)
+        if indxr.xrefw is not None:
+            indxr.xrefw.close()
+        indxr.bump_generation(mdbcollection)
 
 
 if __name__ == '__main__':
@@ -264,6 +428,14 @@ if __name__ == '__main__':
                       help='Input file name for UniProt Swiss-Prot compressed'
                            ' xml dataset')
     dbargs(args)
+    args.add_argument('--xrefs', default=False, action='store_true',
+                      help="Save cross-references of the entries in the"
+                           " shared 'xref' collection, MongoDB only")
+    args.add_argument('--facets', default=False, action='store_true',
+                      help="Save gene, organism, pathway, catalytic activity"
+                           " and GO/Pfam annotation counts of each EC number"
+                           " and organism after indexing, MongoDB only")
     args = args.parse_args()
     main(args.infile, args.esindex, args.mdbdb, args.mdbcollection,
-         args.dbtype, args.host, args.port)
+         args.dbtype, args.host, args.port, xrefs=args.xrefs,
+         facets=args.facets)
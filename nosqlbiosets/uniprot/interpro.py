@@ -112,8 +112,10 @@ def main(infile, dbtype, esindex, mdbcollection='interpro', mdbdb='biosets',
     indxr.parse_interpro_xmlfiles(infile)
     if dbtype == 'Elasticsearch':
         indxr.es.indices.refresh(index=esindex)
+        indxr.bump_generation(esindex)
     else:
         mongodb_indices(indxr.mcl)
+        indxr.bump_generation(mdbcollection)
 
 
 if __name__ == '__main__':
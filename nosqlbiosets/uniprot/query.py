@@ -6,14 +6,117 @@ from collections import OrderedDict
 
 from nosqlbiosets.qryutils import Query
 
+TAXONOMY_SUFFIX = '_taxonomy'  # Taxonomy collection name suffix
+FACETS_SUFFIX = '_facets'  # Facet summaries collection name suffix
+INTENZ_COLLECTION = "intenz"
+
+
+def _facetkey(qc):
+    # Facet summaries are saved for EC numbers and organism taxonomy ids
+    if isinstance(qc, dict) and len(qc) == 1:
+        for field, key in [("dbReference.id", "ec"),
+                           ("organism.dbReference.id", "organism")]:
+            if isinstance(qc.get(field), str):
+                return key, qc[field]
+    return None
+
+
+def _aslist(v):
+    return v if isinstance(v, list) else [] if v is None else [v]
+
+
+def _docids(doc, namespace):
+    # Ids of the UniProt entry doc in given namespace
+    if namespace == 'uniprot':
+        return _aslist(doc.get('name'))
+    if namespace == 'accession':
+        return _aslist(doc.get('accession'))
+    if namespace == 'gene':
+        return [name['#text'] for gene in _aslist(doc.get('gene'))
+                for name in _aslist(gene['name'])
+                if name['type'] == 'primary']
+    return [xref['id'] for xref in _aslist(doc.get('dbReference'))
+            if xref['type'] == namespace]
+
+
+# Aggregation pipelines shared by the sync and async query classes
+
+def genes_aggq(qc, limit):
+    # Names and abundance of the genes of entries selected by qc
+    return [
+        {"$match": qc},
+        {"$project": {'gene.name': 1}},
+        {"$unwind": "$gene"},
+        {"$unwind": "$gene.name"},
+        {"$group": {
+            "_id": {
+                "type": "$gene.name.type",
+                "name": "$gene.name.#text"
+            },
+            "total": {
+                "$sum": 1
+            }
+        }},
+        {"$sort": {"total": -1}},
+        {"$limit": limit}
+    ]
+
+
+def genecounts(cr):
+    # Gene name counts grouped by name types, from genes_aggq results
+    r = dict()
+    for i in cr:
+        nametype = i['_id']['type']
+        if nametype not in r:
+            r[nametype] = OrderedDict()
+        r[nametype][i['_id']['name']] = i['total']
+    return r
+
+
+def keggreaction_genes_aggq(keggrid, uniprotcollection):
+    # Runs on IntEnz collection, UniProt entries are joined with $lookup
+    return [
+        {"$match": {"reactions.map.link.title": keggrid}},
+        {"$unwind": "$links"},
+        {"$match": {"links.db": "UniProt"}},
+        {"$lookup": {
+            "from": uniprotcollection,
+            "localField": "links.accession_number",
+            "foreignField": "accession",
+            "as": "uniprot"
+        }},
+        {"$unwind": "$uniprot"},
+        {"$unwind": "$uniprot.gene"},
+        {"$unwind": "$uniprot.gene.name"},
+        {"$project": {"uniprot.gene.name.#text": 1}},
+    ]
+
 
 class QueryUniProt(Query):
 
+    def getfacet(self, facet, qc, limit=None):
+        """ Facet summary saved after indexing, such as 'genes' or 'GO',
+        for the entries selected by the query clause qc; returns None if
+        qc does not select an EC number or an organism with saved summary
+        """
+        key = _facetkey(qc)
+        if key is None or self.dbc.db != 'MongoDB':
+            return None
+        doc = self.dbc.mdbi[self.mdbcollection + FACETS_SUFFIX].find_one(
+            {"_id": "%s:%s:%s" % (key[0], facet, key[1])})
+        if doc is None:
+            return None
+        counts = doc['counts']
+        n = doc['n'] if limit is None else min(limit, doc['n'])
+        if len(counts) < n:
+            return None  # saved counts were truncated
+        return counts[:limit]
+
     # Get UniProt acc ids for given enzyme
     def getaccs(self, ecn, reftype="EC"):
         qc = {"dbReference.id": ecn, "dbReference.type": reftype}
         key = 'accession'
-        r = self.dbc.mdbi[self.mdbcollection].distinct(key, filter=qc)
+        r = self.distinct(key, qc)
         return r
 
     # Get names and abundance of the genes for given enzyme
@@ -21,6 +124,7 @@ class QueryUniProt(Query):
     def getgenes(self, ecn, qc=None, limit=100):
         if qc is None:
             qc = {"dbReference.id": ecn}
+        facet = self.getfacet("genes", qc, limit)
         if self.dbc.db == 'Elasticsearch':
             qc = {
                 "query": {"match": qc},
@@ -42,31 +146,13 @@ class QueryUniProt(Query):
                 r[nametype] = OrderedDict()
                 for j in i['name']['buckets']:
                     r[nametype][j['key']] = j['doc_count']
-        else:
-            aggq = [
-                {"$match": qc},
-                {"$project": {'gene.name': 1}},
-                {"$unwind": "$gene"},
-                {"$unwind": "$gene.name"},
-                {"$group": {
-                    "_id": {
-                        "type": "$gene.name.type",
-                        "name": "$gene.name.#text"
-                    },
-                    "total": {
-                        "$sum": 1
-                    }
-                }},
-                {"$sort": {"total": -1}},
-                {"$limit": limit}
-            ]
-            cr = self.aggregate_query(aggq)
+        elif facet is not None:
             r = dict()
-            for i in cr:
-                nametype = i['_id']['type']
-                if nametype not in r:
-                    r[nametype] = OrderedDict()
-                r[nametype][i['_id']['name']] = i['total']
+            for i in facet:
+                r.setdefault(i['type'], OrderedDict())[i['name']] = i['total']
+        else:
+            cr = self.aggregate_query(genes_aggq(qc, limit))
+            r = genecounts(cr)
         return r
 
     def getgeneids(self, qc, limit=1000):
@@ -95,6 +181,9 @@ class QueryUniProt(Query):
     # Find abundance of annotations for the set specified by the query clause
     def getannotations(self, qc, annottype="GO"):
         assert self.dbc.db == 'MongoDB'
+        facet = self.getfacet(annottype, qc.get("$match"))
+        if facet is not None:
+            return facet
         aggq = [
             qc,
             {"$unwind": "$dbReference"},
@@ -120,24 +209,9 @@ class QueryUniProt(Query):
     # Find related genes for given KEGG reaction id
     # UniProt ids are found by querying the IntEnz dataset with given KEGG id
     def genes_linkedto_keggreaction(self, keggrid):
-        doctype = "intenz"
         if self.dbc.db == 'MongoDB':
-            agpl = [
-                {"$match": {"reactions.map.link.title": keggrid}},
-                {"$unwind": "$links"},
-                {"$match": {"links.db": "UniProt"}},
-                {"$lookup": {
-                    "from": self.mdbcollection,
-                    "localField": "links.accession_number",
-                    "foreignField": "accession",
-                    "as": "uniprot"
-                }},
-                {"$unwind": "$uniprot"},
-                {"$unwind": "$uniprot.gene"},
-                {"$unwind": "$uniprot.gene.name"},
-                {"$project": {"uniprot.gene.name.#text": 1}},
-            ]
-            docs = self.dbc.mdbi[doctype].aggregate(agpl)
+            agpl = keggreaction_genes_aggq(keggrid, self.mdbcollection)
+            docs = self.dbc.mdbi[INTENZ_COLLECTION].aggregate(agpl)
             r = {doc['uniprot']['gene']['name']['#text']
                  for doc in docs}
             return r
@@ -148,29 +222,28 @@ class QueryUniProt(Query):
         if qc is None:
             assert ecn is not None
             qc = {"dbReference.id": ecn}
+        facet = self.getfacet("organisms", qc, limit)
         if self.dbc.db == 'Elasticsearch':
-            qc = {"query": {"match": qc},
-                  "_source": "organism.name"
-                  }
-            hits, n, _ = self.esquery(self.index, qc, size=limit)
+            # organism.name is not a nested field, (type, name) pairs are
+            # counted on the client, over all matching entries
+            counts = dict()
+            for doc in self.stream({"match": qc},
+                                   projection="organism.name"):
+                names = doc['organism']['name']
+                for name in names if isinstance(names, list) else [names]:
+                    k = name['type'], name['#text']
+                    counts[k] = counts.get(k, 0) + 1
+            # Most frequent names are returned, similar to MongoDB queries
             rr = dict()
-
-            def digestnames(name):
-                nametype_ = name['type']
-                organism = name['#text']
+            for (nametype_, organism), n in sorted(
+                    counts.items(), key=lambda x: -x[1])[:limit]:
                 if nametype_ not in rr:
                     rr[nametype_] = OrderedDict()
-                if organism in rr[nametype_]:
-                    rr[nametype_][organism] += 1
-                else:
-                    rr[nametype_][organism] = 1
-
-            for names in [hit['_source']['organism']['name'] for hit in hits]:
-                if isinstance(names, list):
-                    for name_ in names:
-                        digestnames(name_)
-                else:
-                    digestnames(names)
+                rr[nametype_][organism] = n
+        elif facet is not None:
+            rr = dict()
+            for i in facet:
+                rr.setdefault(i['type'], OrderedDict())[i['name']] = i['total']
         else:
             aggq = [
                 {"$match": qc},
@@ -210,6 +283,30 @@ class QueryUniProt(Query):
         """
         Get lowest common ancestor for entries selected by the query clause qc
         """
+        aggq = [
+            {"$match": qc},
+            {"$group": {"_id": None,
+                        "left": {"$min": "$organism.taxleft"},
+                        "right": {"$max": "$organism.taxright"},
+                        "n": {"$sum": 1},
+                        "numbered": {"$sum": {"$cond": [
+                            {"$gt": ["$organism.taxleft", None]}, 1, 0]}}}}
+        ]
+        r = list(self.aggregate_query(aggq))
+        if len(r) == 0:
+            return None
+        r = r[0]
+        if r['numbered'] < r['n']:  # taxonomy table was not built
+            return self.get_lca_fromlineages(qc)
+        # Lowest common ancestor is the deepest node whose interval
+        # includes intervals of all entries
+        txcl = self.dbc.mdbi[self.mdbcollection + TAXONOMY_SUFFIX]
+        lca = txcl.find_one({"left": {"$lte": r['left']},
+                             "right": {"$gte": r['right']}},
+                            sort=[("left", -1)])
+        return lca['lineage']
+
+    def get_lca_fromlineages(self, qc):
         aggq = [
             {"$match": qc},
             {"$project": {'organism.lineage.taxon': 1}},
@@ -232,12 +329,26 @@ class QueryUniProt(Query):
                     break
         return lca
 
+    def taxon_query(self, taxon):
+        """ Query clause for entries of organisms under given taxon,
+        such as 'Bacillota', with the taxonomy intervals of the entries """
+        txcl = self.dbc.mdbi[self.mdbcollection + TAXONOMY_SUFFIX]
+        qcs = [{"organism.taxleft": {"$gt": node['left'],
+                                     "$lt": node['right']}}
+               for node in txcl.find({"name": taxon})]
+        if len(qcs) == 0:
+            return {"organism.lineage.taxon": taxon}
+        return qcs[0] if len(qcs) == 1 else {"$or": qcs}
+
     # Get names of the metabolic pathway(s) associated with an enzyme,
     # or for entries selected by the query clause qc
     # http://www.uniprot.org/help/pathway
     def getpathways(self, ecn, qc=None, limit=100):
         if qc is None:
             qc = {"dbReference.id": ecn}
+        facet = self.getfacet("pathways", qc, limit)
+        if facet is not None:
+            return facet
         aggq = [
             {"$match": qc},
             {"$unwind": "$comment"},
@@ -256,6 +367,9 @@ class QueryUniProt(Query):
     def getcatalyticactivity(self, ecn, qc=None, limit=100):
         if qc is None:
             qc = {"dbReference.id": ecn}
+        facet = self.getfacet("catalyticactivity", qc, limit)
+        if facet is not None:
+            return facet
         aggq = [
             {"$match": qc},
             {"$unwind": "$comment"},
@@ -265,22 +379,37 @@ class QueryUniProt(Query):
             {"$sort": {"total": -1}},
             {"$limit": limit}
         ]
-        r = self.dbc.mdbi[self.mdbcollection].aggregate(aggq)
+        r = self.aggregate_query(aggq)
         return r
 
     # Get UniProt names(=ids) for given KEGG gene ids
-    def getnamesforkegg_geneids(self, kgids, db="MongoDB"):
-        if db == 'Elasticsearch':
-            # esc = DBconnection(db, self.index)
-            qc = {"terms": {
-                "dbReference.id.keyword": kgids}}
-            hits, _, _ = self.esquery(self.index, {"query": qc})
-            r = [xref['_id'] for xref in hits]
+    def getnamesforkegg_geneids(self, kgids):
+        r = self.resolve_ids(kgids, 'KEGG', 'uniprot')
+        return list({name for names in r.values() for name in names})
+
+    # Namespaces for id mappings are 'uniprot' for UniProt names(=ids),
+    # 'accession', 'gene' for primary gene names,
+    # or dbReference types such as 'KEGG', 'GeneID', 'EC'
+    def idlookup(self, ids, source, target):
+        es = self.dbc.db == 'Elasticsearch'
+        if source in ['uniprot', 'accession']:
+            field = 'name' if source == 'uniprot' else source
+            qc = {"terms": {field + ".keyword": ids}} if es \
+                else {field: {'$in': ids}}
+        elif source == 'gene':
+            qc = {"terms": {"gene.name.#text.keyword": ids}} if es \
+                else {'gene.name.#text': {'$in': ids}}
         else:
-            qc = {"dbReference.id": {'$in': kgids}}
-            key = 'name'
-            r = self.dbc.mdbi[self.mdbcollection].distinct(key, filter=qc)
-        return r
+            qc = {"terms": {"dbReference.id.keyword": ids}} if es \
+                else {"dbReference": {'$elemMatch': {
+                    "id": {"$in": ids}, "type": source}}}
+        ids = set(ids)
+        for doc in self.stream(qc, projection=[
+                'name', 'accession', 'gene', 'dbReference']):
+            for id_ in _docids(doc, source):
+                if id_ in ids:
+                    for tid in _docids(doc, target):
+                        yield id_, tid
 
     def top_annotation_pairs(self, qc, limit=10):
         """ Return most abundant GO and Pfam annotations co-occurences
@@ -232,8 +232,10 @@ def main(infile, dbtype, mdbdb, mdbcollection, esindex, host=None, port=None,
     print("\nCompleted reading and indexing the ClinVar entries")
     if dbtype == 'Elasticsearch':
         indxr.es.indices.refresh(index=esindex)
+        indxr.bump_generation(esindex)
     else:
         mongodb_indices(indxr.mcl)
+        indxr.bump_generation(mdbcollection)
 
 
 if __name__ == '__main__':
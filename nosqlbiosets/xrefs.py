@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+""" Shared cross-reference collection of flat (namespace, id) -> (dataset,
+ document id) rows, saved by the indexers with their '--xrefs' option,
+ and queries translating ids through the collection; MongoDB only """
+# Server connection details are read from conf/dbservers.json file
+import threading
+
+import argh
+from pymongo import IndexModel
+
+from nosqlbiosets.qryutils import Query
+
+XREF_COLLECTION = "xref"
+BATCHSIZE = 10000
+
+
+class XrefWriter(object):
+    """ Saves xref rows of documents of one dataset, earlier rows
+     of the dataset are deleted. Namespaces are saved lowercase,
+     ids are saved as strings """
+
+    def __init__(self, mdbi, dataset, batchsize=BATCHSIZE):
+        self.mcl = mdbi[XREF_COLLECTION]
+        self.dataset = dataset
+        self.batchsize = batchsize
+        self.rows = []
+        self.n = 0
+        self.lock = threading.Lock()  # UniProt entries are indexed in threads
+        self.mcl.delete_many({"dataset": dataset})
+
+    def add(self, docid, xrefs):
+        """ Add rows for (namespace, id) pairs of document docid """
+        rows = [{"ns": ns.lower(), "id": str(id_), "dataset": self.dataset,
+                 "docid": docid}
+                for ns, id_ in {(ns.lower(), str(id_)) for ns, id_ in xrefs
+                                if id_ is not None and id_ != ''}]
+        with self.lock:
+            self.rows.extend(rows)
+            if len(self.rows) >= self.batchsize:
+                self._flush()
+
+    def _flush(self):
+        if self.rows:
+            self.mcl.insert_many(self.rows, ordered=False)
+            self.n += len(self.rows)
+            self.rows = []
+
+    def close(self):
+        with self.lock:
+            self._flush()
+        mongodb_indices(self.mcl)
+        print("%d xref rows saved for %s" % (self.n, self.dataset))
+
+
+def mongodb_indices(mcl):
+    # Both lookup steps are covered by the indexes
+    mcl.create_indexes([
+        IndexModel([("ns", 1), ("id", 1), ("dataset", 1), ("docid", 1)]),
+        IndexModel([("dataset", 1), ("docid", 1), ("ns", 1), ("id", 1)])
+    ])
+
+
+class QueryXref(Query):
+
+    def __init__(self, dbtype="MongoDB", index="biosets",
+                 mdbcollection=XREF_COLLECTION, **kwargs):
+        super(QueryXref, self).__init__(dbtype, index, mdbcollection, **kwargs)
+
+    def documents(self, ids, namespace, dataset=None):
+        """ Single-hop lookup; documents referring given ids,
+        returns dictionary of ids to lists of (dataset, document id) pairs
+        """
+        qc = {"ns": namespace.lower(), "id": {"$in": [str(i) for i in ids]}}
+        if dataset is not None:
+            qc["dataset"] = dataset
+        r = {i: [] for i in ids}
+        strids = {str(i): i for i in ids}
+        for row in self.dbc.mdbi[self.mdbcollection].find(
+                qc, projection={"_id": 0, "id": 1, "dataset": 1, "docid": 1}):
+            r[strids[row['id']]].append((row['dataset'], row['docid']))
+        return r
+
+    def idlookup(self, ids, source, target, dataset=None):
+        """ Two-hop lookup; ids in the target namespace of the documents
+        referring given ids in the source namespace """
+        docs = self.documents(ids, source, dataset)
+        bydoc = dict()  # (dataset, docid) -> source ids
+        for id_, dl in docs.items():
+            for d in dl:
+                bydoc.setdefault(d, []).append(id_)
+        bydataset = dict()
+        for ds, docid in bydoc:
+            bydataset.setdefault(ds, []).append(docid)
+        if not bydataset:
+            return
+        qc = {"$or": [{"dataset": ds, "docid": {"$in": docids},
+                       "ns": target.lower()}
+                      for ds, docids in bydataset.items()]}
+        for row in self.dbc.mdbi[self.mdbcollection].find(
+                qc, projection={"_id": 0, "id": 1, "dataset": 1, "docid": 1}):
+            for id_ in bydoc[(row['dataset'], row['docid'])]:
+                yield id_, row['id']
+
+    def translate(self, ids, source, target):
+        """ Two-hop translation of ids in chunks, see IdResolver;
+        returns dictionary of ids to lists of ids in the target namespace """
+        return self.resolve_ids(ids, source, target)
+
+
+def translate(ids, source, target, index="biosets"):
+    """ Print ids in the target namespace for given ids
+
+    :param ids: ids separated by commas
+    :param source: namespace of the input ids, such as 'uniprotkb'
+    :param target: target namespace, such as 'geneid'
+    :param index: MongoDB database name
+    """
+    qry = QueryXref(index=index)
+    for id_, tids in qry.translate(ids.split(','), source, target).items():
+        print("%s\t%s" % (id_, ','.join(tids)))
+
+
+if __name__ == '__main__':
+    argh.dispatch_commands([
+        translate
+    ])
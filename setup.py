@@ -17,7 +17,9 @@ setup(
            'argh',
            'elasticsearch',
            'networkx' if py35 else 'networkx==2.2',
+           'numpy',
            'pymongo',
+           'scipy',
            'six',
            'xmltodict'
        ],
@@ -28,6 +30,12 @@ setup(
               'neo4j': (
                      'neo4j-driver'
               ),
+              'motor': (
+                     'motor'
+              ),
+              'elasticsearch-async': (
+                     'elasticsearch[async]'
+              ),
               'pivottablejs': (
                      'pivottablejs',
               ),
@@ -0,0 +1,71 @@
+""" Minimal MongoDB collection and DBconnection stubs for the tests
+ that don't require database connections """
+
+
+def _value(doc, key):
+    # Value of dotted key in doc, None if the key is not set
+    for k in key.split('.'):
+        if not isinstance(doc, dict) or k not in doc:
+            return None
+        doc = doc[k]
+    return doc
+
+
+class Collection(object):
+    """ MongoDB collection with given documents; find() supports equality
+     queries on dotted keys, aggregation pipelines are recorded without
+     running them, documents read from cursors are counted """
+
+    def __init__(self, docs=None, name=None, database=None):
+        self.docs = list(docs or [])
+        self.name = name
+        self.database = database
+        self.pipelines = []
+        self.reads = 0
+        if database is not None:
+            database[name] = self
+
+    def find(self, qc=None, projection=None, **kwargs):
+        return Cursor(self, [d for d in self.docs
+                             if all(_value(d, k) == v
+                                    for k, v in (qc or {}).items())])
+
+    def find_one(self, qc=None):
+        return next(iter(self.find(qc)), None)
+
+    def aggregate(self, agpl, **kwargs):
+        self.pipelines.append(agpl)
+        return Cursor(self, [])
+
+    def drop(self):
+        self.docs = []
+
+
+class Cursor(object):
+
+    def __init__(self, collection, docs):
+        self.collection = collection
+        self.docs = docs
+
+    def sort(self, key, direction):
+        self.docs.sort(key=lambda d: _value(d, key), reverse=direction < 0)
+        return self
+
+    def __iter__(self):
+        for d in self.docs:
+            self.collection.reads += 1
+            yield dict(d)
+
+
+class DBC(object):
+    """ DBconnection with given collections, collection generations
+     are set by the tests """
+
+    def __init__(self, collections, db='MongoDB', index='test'):
+        self.mdbi = collections
+        self.db = db
+        self.index = index
+        self.generations = dict()
+
+    def get_generation(self, name):
+        return self.generations.get(name, 0)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+""" Tests with the async query classes and the aggregation pipelines
+ they share with the sync query classes, without database connections """
+import asyncio
+import unittest
+
+from hmdb.aioqueries import AsyncQueryDrugBank, AsyncQueryHMDB
+from hmdb.index import DOCTYPE_PROTEIN
+from hmdb.queries import drugbank_entity_aggq, \
+    metabolites_protein_functions_aggq
+from nosqlbiosets.uniprot.aioquery import AsyncQueryUniProt
+from nosqlbiosets.uniprot.query import genecounts, genes_aggq
+
+
+class AsyncCollection(object):
+    """ Minimal Motor collection returning given results,
+     aggregation pipelines are recorded """
+
+    def __init__(self, results=None, distinct=None):
+        self.results = results or []
+        self.distinctr = distinct or dict()
+        self.pipelines = []
+
+    def aggregate(self, agpl, **kwargs):
+        self.pipelines.append(agpl)
+        return self
+
+    async def to_list(self, length):
+        return self.results.pop(0) if self.results else []
+
+    async def distinct(self, key, filter=None):
+        return self.distinctr[filter["dbReference.id"]]
+
+
+class AsyncDBC(object):
+    db = 'MongoDB'
+
+    def __init__(self, **collections):
+        self.mdbi = collections
+
+
+class TestPipelineBuilders(unittest.TestCase):
+    """ Pipelines are compared with the pipelines of the sync query classes
+     before they were moved to the shared builder functions """
+
+    def test_genes_aggq(self):
+        qc = {"dbReference.id": "2.7.11.1"}
+        self.assertEqual([
+            {"$match": qc},
+            {"$project": {'gene.name': 1}},
+            {"$unwind": "$gene"},
+            {"$unwind": "$gene.name"},
+            {"$group": {
+                "_id": {
+                    "type": "$gene.name.type",
+                    "name": "$gene.name.#text"
+                },
+                "total": {
+                    "$sum": 1
+                }
+            }},
+            {"$sort": {"total": -1}},
+            {"$limit": 100}
+        ], genes_aggq(qc, 100))
+
+    def test_drugbank_entity_aggq(self):
+        qc = {"enzymes.polypeptide.external-identifiers.identifier":
+              "P05177"}
+        self.assertEqual([
+            {"$match": qc},
+            {'$unwind': "$enzymes"},
+            {'$unwind': "$enzymes.polypeptide"},
+            {"$match": qc},
+            {"$limit": 1},
+            {"$project": {"enzymes.id": 1}}
+        ], drugbank_entity_aggq("P05177", "enzymes"))
+
+    def test_metabolites_protein_functions_aggq(self):
+        mq = {"$text": {"$search": "saffron"}}
+        self.assertEqual([
+            {'$match': mq},
+            {'$unwind':
+                {
+                    'path': '$protein_associations.protein'
+                }},
+            {'$project': {
+                "accession": 1,
+                "protein_associations.protein": 1}},
+            {'$lookup': {
+                'from': DOCTYPE_PROTEIN,
+                'let': {'a': "$protein_associations.protein."
+                             "protein_accession"},
+                'as': 'proteins',
+                'pipeline': [
+                    {'$match': {
+                            "$expr": {"$eq": ["$accession", "$$a"]}
+                    }},
+                    {'$project': {
+                        "general_function": 1}}
+                ]
+            }},
+            {'$unwind': "$proteins"},
+            {'$group': {
+                "_id": "$proteins.general_function",
+                "count": {'$sum': 1}}},
+            {"$sort": {"count": -1}}
+        ], metabolites_protein_functions_aggq(mq))
+
+
+class TestAsyncQueries(unittest.TestCase):
+
+    def test_uniprot_genes(self):
+        rows = [{"_id": {"type": "primary", "name": "TP53"}, "total": 3},
+                {"_id": {"type": "synonym", "name": "P53"}, "total": 1}]
+        uniprot = AsyncCollection([list(rows)])
+        qry = AsyncQueryUniProt(dbc=AsyncDBC(uniprot=uniprot))
+        r = asyncio.run(qry.getgenes("2.7.11.1", limit=10))
+        self.assertEqual(genecounts(rows), r)
+        self.assertEqual([genes_aggq({"dbReference.id": "2.7.11.1"}, 10)],
+                         uniprot.pipelines)
+
+    def test_drugbank_concurrent_queries(self):
+        uniprot = AsyncCollection(distinct={"hsa:1": ["P1"],
+                                            "hsa:2": ["P2"]})
+        drugbank = AsyncCollection([[{"targets": {"id": "BE1"}}],
+                                    [{"targets": {"id": "BE2"}}]])
+        qry = AsyncQueryDrugBank(dbc=AsyncDBC(uniprot=uniprot,
+                                              drugbank=drugbank))
+        r = asyncio.run(qry.kegg_target_ids_to_drugbank_entity_ids(
+            ["hsa:1", "hsa:2"]))
+        self.assertEqual([("P1", "BE1"), ("P2", "BE2")], r)
+        self.assertEqual([drugbank_entity_aggq("P1", "targets"),
+                          drugbank_entity_aggq("P2", "targets")],
+                         drugbank.pipelines)
+
+    def test_hmdb_protein_functions(self):
+        rows = [{"_id": "Involved in sulfotransferase activity", "count": 2}]
+        metabolites = AsyncCollection([rows])
+        qry = AsyncQueryHMDB(dbc=AsyncDBC(hmdbmetabolite=metabolites))
+        mq = {"$text": {"$search": "saffron"}}
+        self.assertEqual(rows, asyncio.run(
+            qry.metabolites_protein_functions(mq)))
+        self.assertEqual([metabolites_protein_functions_aggq(mq)],
+                         metabolites.pipelines)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+""" Tests with graph utilities that don't require database connections """
+import gzip
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import networkx as nx
+
+from nosqlbiosets.csrgraph import CSRGraph
+from nosqlbiosets.intenz.query import connections_csrgraph, enzyme_chain
+from nosqlbiosets.graphutils import centrality, csrgraph, invalidate, \
+    layout_positions, load_npz, neighbors_graph, neighbors_graphs, \
+    networkx2d3_json, remove_highly_connected_nodes, \
+    remove_least_connected_nodes, remove_small_subgraphs, save_graph, \
+    set_degree_as_weight, shortest_paths
+
+
+def example_graph():
+    g = nx.DiGraph(name='example')
+    g.add_edge('a', 'b', reactions=['r1'], weight=1)
+    g.add_edge('b', 'c', reactions=['r2', 'r3'], weight=1)
+    g.add_edge('a', 'c', reactions=['r4'], weight=5)
+    g.add_edge('x', 'y', reactions=['r1'], weight=1)
+    g.add_node('z')
+    return g
+
+
+class TestCSRGraph(unittest.TestCase):
+
+    def test_networkx_conversions(self):
+        g = example_graph()
+        cg = CSRGraph.from_networkx(g, labelattr='reactions', weight='weight')
+        self.assertEqual(6, cg.number_of_nodes())
+        self.assertEqual(4, cg.number_of_edges())
+        self.assertEqual(3, len(cg.labels))  # ['r1'] is shared
+        self.assertEqual(['b', 'c'], cg.successors('a'))
+        g_ = cg.to_networkx(labelattr='reactions')
+        self.assertEqual(set(g.edges()), set(g_.edges()))
+        self.assertEqual(['r2', 'r3'], g_['b']['c']['reactions'])
+        self.assertEqual('example', g_.graph['name'])
+        cg = CSRGraph.from_networkx(g.to_undirected())
+        self.assertEqual(8, cg.number_of_edges())
+
+    def test_traversals(self):
+        cg = CSRGraph.from_networkx(example_graph(), weight='weight')
+        self.assertEqual((['a', 'b', 'c'], [0, 1, 1]), cg.bfs('a'))
+        self.assertEqual((['c'], [0]), cg.bfs('c'))
+        self.assertEqual((2.0, ['a', 'b', 'c']), cg.shortest_path('a', 'c'))
+        self.assertEqual((1.0, ['a', 'c']),
+                         cg.shortest_path('a', 'c', weighted=False))
+        self.assertIsNone(cg.shortest_path('c', 'a')[1])
+        self.assertEqual({'a': 0, 'b': 1, 'c': 2}, cg.distances('a'))
+        n, labels = cg.components()
+        self.assertEqual(3, n)
+        self.assertEqual(labels[cg.nodeindex['x']],
+                         labels[cg.nodeindex['y']])
+
+    def test_filter_degree(self):
+        cg = CSRGraph.from_networkx(example_graph(), labelattr='reactions')
+        sg = cg.filter_degree(min_degree=2)
+        self.assertEqual(['a', 'b', 'c'], sg.nodes)
+        self.assertEqual(3, sg.number_of_edges())
+        self.assertEqual(['r2', 'r3'], sg.edge_label(2))
+        self.assertEqual(['z'], cg.filter_degree(max_degree=0).nodes)
+        self.assertEqual(['a', 'b', 'c'], cg.filter_components(3).nodes)
+
+
+class TestShortestPaths(unittest.TestCase):
+
+    def test_k_shortest_paths(self):
+        g = nx.gnp_random_graph(30, 0.2, directed=True, seed=2)
+        r = shortest_paths(g, 0, 9, k=20, cutoff=None)
+        r_ = list(itertools.islice(nx.shortest_simple_paths(g, 0, 9), 20))
+        self.assertEqual([len(p) for p in r_], [len(p) for p in r])
+        self.assertEqual(len(r), len({tuple(p) for p in r}))
+        r = shortest_paths(g, 0, 9, k=100, cutoff=4)
+        self.assertTrue(all(len(p) <= 4 for p in r))
+        self.assertEqual(len(list(nx.all_simple_paths(g, 0, 9, cutoff=3))),
+                         len(r))
+        side = r[0][1]
+        r = shortest_paths(g, 0, 9, k=100, cutoff=4, exclude=[side])
+        self.assertEqual([[0, 3, 16, 9]], r)
+
+    def test_bidirectional_shortest_path(self):
+        g = nx.gnp_random_graph(60, 0.05, directed=True, seed=4)
+        cg = csrgraph(g)
+        for t in range(60):
+            try:
+                n = nx.shortest_path_length(g, 0, t)
+            except nx.NetworkXNoPath:
+                self.assertRaises(nx.NetworkXNoPath,
+                                  cg.bidirectional_shortest_path, 0, t)
+                continue
+            p = cg.bidirectional_shortest_path(0, t)
+            self.assertEqual(n + 1, len(p))
+            self.assertTrue(all(g.has_edge(u, v) for u, v in zip(p, p[1:])))
+            if n > 1:
+                self.assertRaises(nx.NetworkXNoPath,
+                                  cg.bidirectional_shortest_path, 0, t,
+                                  maxhops=n - 1)
+        cg = csrgraph(example_graph())
+        self.assertEqual(['a', 'c'], cg.bidirectional_shortest_path('a', 'c'))
+        self.assertRaises(nx.NetworkXNoPath, cg.bidirectional_shortest_path,
+                          'a', 'b', maxhops=0)
+
+    def test_enzyme_chains(self):
+        connections = [
+            {'_id': {'reactant': 'a', 'product': 'b'}, 'enzymes': ['1.1']},
+            {'_id': {'reactant': 'b', 'product': 'c'},
+             'enzymes': ['2.2', '2.1']},
+            {'_id': {'reactant': 'a', 'product': 'h2o'}, 'enzymes': ['3.1']},
+            {'_id': {'reactant': 'h2o', 'product': 'c'}, 'enzymes': ['3.2']}]
+        cg = connections_csrgraph(connections)
+        self.assertEqual(4, cg.number_of_nodes())
+        p = cg.bidirectional_shortest_path('a', 'c', exclude=['h2o'])
+        self.assertEqual([('a', 'b', ['1.1']), ('b', 'c', ['2.1', '2.2'])],
+                         enzyme_chain(cg, p))
+
+    def test_degree_weights(self):
+        g = example_graph()
+        self.assertIs(csrgraph(g), csrgraph(g))
+        cg = csrgraph(g, degreeasweight=True)
+        self.assertIs(cg, csrgraph(g, degreeasweight=True))
+        self.assertEqual([['a', 'c'], ['a', 'b', 'c']],
+                         shortest_paths(g, 'a', 'c', k=2,
+                                        degreeasweight=True))
+        g_ = g.copy()
+        set_degree_as_weight(g_)
+        self.assertEqual([g_[u][v]['weight'] for u, v in g_.edges()],
+                         cg.weights.tolist())
+        g.add_edge('c', 'd')
+        self.assertIsNot(cg, csrgraph(g, degreeasweight=True))
+        self.assertEqual([['a', 'b', 'c'], ['a', 'c']],
+                         shortest_paths(g, 'a', 'c', k=3, weight='weight'))
+
+    def test_edited_graphs(self):
+        g = nx.DiGraph([(1, 2), (2, 3)])
+        self.assertEqual([[1, 2, 3]], shortest_paths(g, 1, 3, k=2))
+        g.remove_edge(1, 2)
+        g.add_edge(1, 3)
+        self.assertEqual([[1, 3]], shortest_paths(g, 1, 3, k=2))
+        cg = csrgraph(g)
+        invalidate(g)
+        self.assertIsNot(cg, csrgraph(g))
+
+
+
+class TestNeighborsGraph(unittest.TestCase):
+
+    def test_cached_centrality_and_beam_search(self):
+        g = nx.gnp_random_graph(200, 0.03, directed=True, seed=3)
+        c = centrality(g, max_iter=1000, tol=1e-10)
+        self.assertIs(c, centrality(g, max_iter=1000, tol=1e-10))
+        c_ = nx.eigenvector_centrality(g, max_iter=1000, tol=1e-10)
+        for node in g:
+            self.assertAlmostEqual(c_[node], c[node], places=6)
+        r = neighbors_graphs(g, [0, 5], beamwidth=3, maxnodes=30,
+                             max_iter=1000, tol=1e-10)
+        for source in [0, 5]:
+            r_ = nx.MultiDiGraph()
+            for u, v in nx.bfs_beam_edges(g, source, c_.get, 3):
+                r_.add_edge(u, v)
+                if r_.number_of_nodes() >= 30:
+                    break
+            self.assertEqual(list(r_.edges()), list(r[source].edges()))
+        g.add_edge(0, 199)
+        self.assertIsNot(c, centrality(g, max_iter=1000, tol=1e-10))
+        r = neighbors_graph(g, 0, beamwidth=3, maxnodes=30)
+        self.assertEqual(30, r.number_of_nodes())
+
+
+
+class TestGraphPruning(unittest.TestCase):
+
+    def test_remove_small_subgraphs(self):
+        g = nx.gnm_random_graph(300, 200, directed=True, seed=2)
+        g_ = g.copy()
+        remove_small_subgraphs(g, min_nodes=4)
+        self.assertEqual({node for c in nx.weakly_connected_components(g_)
+                          if len(c) >= 4 for node in c}, set(g))
+        g = example_graph().to_undirected()
+        remove_small_subgraphs(g, min_nodes=2)
+        self.assertEqual({'a', 'b', 'c', 'x', 'y'}, set(g))
+
+    def test_remove_connected_nodes(self):
+        g = example_graph()
+        remove_least_connected_nodes(g, min_degree=1)
+        self.assertNotIn('z', g)
+        remove_highly_connected_nodes(g, max_degree=1)
+        self.assertEqual({'x', 'y'}, set(g))
+
+
+
+class TestSaveGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.graphs = [example_graph(), nx.MultiDiGraph(example_graph())]
+        for g in self.graphs:
+            g.add_node('a', type='metabolite', viz_color='green')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_json_writers(self):
+        for g in self.graphs:
+            outfile = os.path.join(self.tmpdir, 'g.json')
+            save_graph(g, outfile)
+            with open(outfile) as f:
+                self.assertEqual(json.loads(json.dumps(nx.cytoscape_data(g))),
+                                 json.load(f))
+            save_graph(g, outfile + '.gz')
+            with gzip.open(outfile + '.gz', 'rt') as f, open(outfile) as f_:
+                self.assertEqual(f_.read(), f.read())
+            outfile = os.path.join(self.tmpdir, 'g.d3js.json')
+            save_graph(g, outfile)
+            with open(outfile) as f:
+                self.assertEqual(networkx2d3_json(g), json.load(f))
+
+    def test_layout(self):
+        g = nx.disjoint_union(nx.complete_graph(8, nx.DiGraph()),
+                              nx.complete_graph(8, nx.DiGraph()))
+        pos = layout_positions(g)
+        self.assertEqual(set(g), set(pos))
+        self.assertTrue(all(0 <= c <= 1000 for p in pos.values() for c in p))
+
+        def distance(u, v):
+            return ((pos[u][0] - pos[v][0]) ** 2 +
+                    (pos[u][1] - pos[v][1]) ** 2) ** 0.5
+        # nodes of the same clique are closer than nodes of the other clique
+        self.assertLess(max(distance(0, v) for v in range(1, 8)),
+                        min(distance(0, v) for v in range(8, 16)))
+        outfile = os.path.join(self.tmpdir, 'g.json')
+        save_graph(g, outfile, layout=True)
+        with open(outfile) as f:
+            nodes = json.load(f)['elements']['nodes']
+        self.assertEqual({'x': pos[0][0], 'y': pos[0][1]},
+                         nodes[0]['position'])
+
+    def test_npz(self):
+        for g in self.graphs:
+            outfile = os.path.join(self.tmpdir, 'g.npz')
+            save_graph(g, outfile)
+            g_ = load_npz(outfile)
+            self.assertEqual(type(g), type(g_))
+            self.assertEqual(g.graph, g_.graph)
+            self.assertEqual(list(g.nodes(data=True)),
+                             list(g_.nodes(data=True)))
+            self.assertEqual(list(g.edges(data=True)),
+                             list(g_.edges(data=True)))
+            self.assertRaises(ValueError, save_graph, g, outfile + '.gz')
+            cg = load_npz(outfile, csr=True)
+            self.assertEqual(list(g), cg.nodes)
+            self.assertEqual({'reactions': ['r2', 'r3'], 'weight': 1},
+                             cg.edge_label(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,9 +6,11 @@ import unittest
 
 import networkx as nx
 
-from hmdb.index import DOCTYPE_METABOLITE, DOCTYPE_PROTEIN
-from hmdb.queries import QueryHMDB
+from hmdb.index import DOCTYPE_EDGES, DOCTYPE_METABOLITE, DOCTYPE_PROTEIN, \
+    metabolite_protein_edges
+from hmdb.queries import MetaboliteProteinEdges, QueryHMDB
 from nosqlbiosets.dbutils import DBconnection
+from stubs import Collection, DBC
 
 EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
                         '../docs/example-graphs/')
@@ -178,5 +180,63 @@ class TestQueryHMDB(unittest.TestCase):
             assert gfunc in (i['_id'] for i in r)
 
 
+class TestHMDBEdges(unittest.TestCase):
+
+    def setUp(self):
+        def protein(acc, gene, ptype, function, metabolites):
+            return {"accession": acc, "gene_name": gene,
+                    "protein_type": ptype, "general_function": function,
+                    "metabolite_associations": {"metabolite": [
+                        {"accession": a, "name": n} for a, n in metabolites]}}
+        proteins = [
+            protein("P1", "ABAT", "Enzyme", "transaminase activity",
+                    [("M1", "GABA"), ("M2", "Pyruvate")]),
+            protein("P2", "ALB", "Unknown", "binding",
+                    [("M1", "GABA"), ("M2", "Pyruvate"), ("M3", "Urea")]),
+            protein("P3", "SLC6A1", "Transporter", "transporter activity",
+                    [("M1", "GABA")])]
+        self.edgescl = Collection([e for p in proteins
+                                   for e in metabolite_protein_edges(p)])
+        self.dbc = DBC({DOCTYPE_EDGES: self.edgescl})
+        self.dbc.generations[DOCTYPE_EDGES] = 1
+        MetaboliteProteinEdges.tables.clear()
+        self.edges = MetaboliteProteinEdges(self.dbc)
+
+    def test_connected_metabolites(self):
+        r = self.edges.connected_metabolites([("M1", "GABA")])
+        self.assertEqual(
+            [{"m1": "GABA", "gene": "ABAT", "type": "Enzyme",
+              "m2": "Pyruvate"},
+             {"m1": "GABA", "gene": "ALB", "type": "Unknown",
+              "m2": "Pyruvate"},
+             {"m1": "GABA", "gene": "ALB", "type": "Unknown", "m2": "Urea"}],
+            sorted(r, key=lambda i: (i["gene"], i["m2"])))
+        # Proteins with more than max_associations metabolites are skipped
+        r = self.edges.connected_metabolites([("M1", "GABA")], 2)
+        self.assertEqual({("ABAT", "Pyruvate")},
+                         {(i["gene"], i["m2"]) for i in r})
+        self.assertEqual([], self.edges.connected_metabolites(
+            [("M1", "GABA")], 1))
+        self.assertEqual([], self.edges.connected_metabolites(
+            [("M9", "Unknown")]))
+
+    def test_protein_functions_and_generations(self):
+        self.assertEqual(
+            [{"_id": "binding", "count": 2},
+             {"_id": "transaminase activity", "count": 2},
+             {"_id": "transporter activity", "count": 1}],
+            sorted(self.edges.protein_functions(["M1", "M2"]),
+                   key=lambda i: (-i["count"], i["_id"])))
+        # Edges are read once for each generation of the edges collection
+        n = len(self.edgescl.docs)
+        self.assertEqual(n, self.edgescl.reads)
+        self.assertTrue(self.edges.available())
+        self.edges.protein_functions(["M2"])
+        self.assertEqual(n, self.edgescl.reads)
+        self.dbc.generations[DOCTYPE_EDGES] = 2
+        self.edges.protein_functions(["M3"])
+        self.assertEqual(2 * n, self.edgescl.reads)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+""" Tests with PubTator queries that don't require database connections """
+import unittest
+
+from nosqlbiosets.pubtator.index import MDB_ENTITY2PMIDS
+from nosqlbiosets.pubtator.query import intersect_sorted, QueryPubTator
+from stubs import Collection, DBC
+
+
+def buckets(pmids):
+    # {id, bucket} -> PMIDs documents
+    return Collection([{"_id": {"id": id_, "bucket": b}, "pmids": pmids_}
+                       for (id_, b), pmids_ in pmids.items()])
+
+
+class TestPubTatorComentions(unittest.TestCase):
+
+    def setUp(self):
+        self.genes = buckets({
+            ("1", 1): [500001, 600000], ("1", 0): [3, 5, 9],
+            ("2", 0): [1, 5, 9, 11], ("2", 1): [600000],
+            ("3", 2): [1000001]})
+        self.diseases = buckets({("D1", 0): [5, 7], ("D1", 1): [600000]})
+        self.qry = QueryPubTator.__new__(QueryPubTator)
+        self.qry.dbc = DBC({MDB_ENTITY2PMIDS['gene2pub']: self.genes,
+                            MDB_ENTITY2PMIDS['disease2pub']: self.diseases})
+
+    def test_intersect_sorted(self):
+        self.assertEqual([], list(intersect_sorted([], [1, 2])))
+        self.assertEqual([], list(intersect_sorted([1, 2], [])))
+        self.assertEqual([2, 5], list(intersect_sorted([1, 2, 4, 5, 8],
+                                                       iter([2, 3, 5, 9]))))
+
+    def test_comentions(self):
+        self.assertEqual([3, 5, 9, 500001, 600000],
+                         list(self.qry.pmids("1")))
+        self.assertEqual([], self.qry.comentions())
+        self.assertEqual([], self.qry.comentions(["4"]))
+        self.assertEqual([5, 9, 600000], self.qry.comentions(["1", "2"]))
+        self.assertEqual([5, 600000], self.qry.comentions(["1", "2"],
+                                                          ["D1"]))
+        self.assertEqual([5, 7, 600000], self.qry.comentions(None, ["D1"]))
+        self.assertEqual([], self.qry.comentions(["1", "3"]))
+        # Intersection stops reading buckets when one of the lists ends
+        self.genes.reads = 0
+        self.assertEqual([], self.qry.comentions(["1", "4"]))
+        self.assertEqual(1, self.genes.reads)
+
+
+if __name__ == '__main__':
+    unittest.main()
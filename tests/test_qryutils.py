@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+""" Tests with query utilities that don't require database connections """
+import shutil
+import tempfile
+import time
+import unittest
+
+from nosqlbiosets.objutils import namekeys
+from nosqlbiosets.qryutils import IdResolver, Query, QueryCache, \
+    QueryProfiler, esstream, prefixquery
+from stubs import Collection, DBC
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = QueryCache(maxsize=2)
+        keys = [cache.key("uniprot", "aggregate_query", [{"$match": {"a": i}}])
+                for i in range(3)]
+        for i, key in enumerate(keys):
+            cache.set(key, [{"total": i}])
+        self.assertIsNone(cache.get(keys[0]))
+        self.assertEqual([{"total": 2}], cache.get(keys[2]))
+        # Hits return copies, callers can't change cached results
+        cache.get(keys[2])[0]["total"] = 10
+        self.assertEqual([{"total": 2}], cache.get(keys[2]))
+
+    def test_key_order_is_significant(self):
+        k1 = QueryCache.key([{"$sort": {"a": 1, "b": -1}}])
+        k2 = QueryCache.key([{"$sort": {"b": -1, "a": 1}}])
+        self.assertNotEqual(k1, k2)
+
+    def test_ttl_and_disk_tier(self):
+        diskdir = tempfile.mkdtemp()
+        cache = QueryCache(ttl=0.2, diskdir=diskdir)
+        key = cache.key("faers", "count", {"a": 1})
+        cache.set(key, 42)
+        # New cache objects, such as in other processes, read the disk tier
+        self.assertEqual(42, QueryCache(diskdir=diskdir).get(key))
+        time.sleep(0.3)
+        self.assertIsNone(cache.get(key))
+        shutil.rmtree(diskdir)
+
+
+class PagedES(object):
+    """ Minimal Elasticsearch client with point-in-time searches """
+
+    def __init__(self, ndocs):
+        self.docs = [{"_id": str(i), "_source": {"n": i}, "sort": [i]}
+                     for i in range(ndocs)]
+        self.pits = set()
+
+    def info(self):
+        return {"version": {"number": "7.17.0"}}
+
+    def open_point_in_time(self, index, keep_alive):
+        self.pits.add("pit1")
+        return {"id": "pit1"}
+
+    def close_point_in_time(self, body):
+        self.pits.remove(body["id"])
+
+    def search(self, body):
+        assert body["pit"]["id"] in self.pits
+        i = body["search_after"][0] + 1 if "search_after" in body else 0
+        return {"hits": {"hits": self.docs[i:i + body["size"]]}}
+
+
+class TestESStream(unittest.TestCase):
+
+    def test_search_after_pages(self):
+        for ndocs in [0, 10, 25]:
+            es = PagedES(ndocs)
+            docs = list(esstream(es, "test", None, pagesize=10))
+            self.assertEqual(list(range(ndocs)), [d["n"] for d in docs])
+            self.assertEqual(str(ndocs - 1), docs[-1]["_id"] if docs
+                             else "-1")
+            self.assertEqual(0, len(es.pits))
+
+
+class TestIdResolver(unittest.TestCase):
+
+    def test_chunks_missing_and_multiple_matches(self):
+        chunks = []
+
+        def lookup(ids, source, target):
+            chunks.append(len(ids))
+            for id_ in ids:
+                n = int(id_[1:])
+                for i in range(n % 3):  # no mappings for every third id
+                    yield id_, "%s%d.%d" % (target, n, i)
+
+        resolver = IdResolver(lookup, chunksize=10, nthreads=3)
+        ids = ["C%d" % i for i in range(25)]
+        r = resolver.resolve_ids(ids + ids[:5], "kegg", "M")
+        self.assertEqual([10, 10, 5], sorted(chunks, reverse=True))
+        self.assertEqual(set(ids), set(r))
+        self.assertEqual([], r["C3"])
+        self.assertEqual(["M4.0"], r["C4"])
+        self.assertEqual(["M5.0", "M5.1"], r["C5"])
+        # Recent mappings, including missing ones, are not queried again
+        r = resolver.resolve_ids(["C3", "C5", "C30"], "kegg", "M")
+        self.assertEqual([10, 10, 5, 1], sorted(chunks, reverse=True))
+        self.assertEqual(["M5.0", "M5.1"], r["C5"])
+
+    def test_unsupported_mappings(self):
+        qry = Query.__new__(Query)
+        qry.idresolver = None
+        with self.assertRaisesRegex(ValueError, "'kegg' to 'M'"):
+            qry.resolve_ids(["C1"], "kegg", "M")
+
+
+class TestPrefixQuery(unittest.TestCase):
+
+    def test_namekeys_prefix_ranges(self):
+        keys = namekeys("D-Xylose",
+                        ["Xylitol", {"#text": " 7-select  Advil PM"}],
+                        None, "xylitol")
+        self.assertEqual(["7-select advil pm", "d-xylose", "xylitol"], keys)
+        for qterm, matches in [("XYLI", ["xylitol"]), ("d-x", ["d-xylose"]),
+                               ("7-Select Advil", ["7-select advil pm"]),
+                               ("xyz", [])]:
+            r = prefixquery(qterm)["namekeys"]["$elemMatch"]
+            self.assertEqual(matches,
+                             [k for k in keys if r["$gte"] <= k < r["$lt"]])
+        self.assertEqual({}, prefixquery(" "))
+
+
+class TestQueryProfiler(unittest.TestCase):
+
+    def test_instrument_histogram_and_slow_log(self):
+        class Qry(object):
+            def names(self, n, wait=0):
+                time.sleep(wait)
+                return ["n%d" % i for i in range(n)]
+
+        logdir = tempfile.mkdtemp()
+        logfile = logdir + "/slowqueries.log"
+        profiler = QueryProfiler(slowms=50, logfile=logfile)
+        qry = profiler.instrument(Qry())
+        for i in range(9):
+            self.assertEqual(3, len(qry.names(3)))
+        qry.names(2, wait=0.06)
+        m = profiler.methods["Qry.names"]
+        self.assertEqual(10, m["n"])
+        self.assertEqual(29, m["docs"])
+        self.assertEqual(10, sum(m["histogram"]))
+        self.assertLessEqual(profiler.percentile("Qry.names", 50), 5)
+        self.assertGreaterEqual(profiler.percentile("Qry.names", 100), 60)
+        self.assertEqual(1, len(profiler.slowqueries))
+        with open(logfile) as f:
+            self.assertEqual(1, len(f.readlines()))
+        self.assertIn("Qry.names", profiler.report())
+        shutil.rmtree(logdir)
+
+    def test_profiled_cursors(self):
+        qry = Query.__new__(Query)
+        docs = [{"_id": i} for i in range(3)]
+        qry.dbc = DBC({"c": Collection(docs)})
+        qry.index, qry.mdbcollection = "test", "c"
+        qry.cache, qry.profiler = None, QueryProfiler(slowms=None)
+        cr = qry.query({}, method="ids")
+        self.assertEqual(3, len(cr.sort("_id", -1).docs))
+        self.assertNotIn("ids", qry.profiler.methods)
+        self.assertEqual(docs[::-1], list(cr))
+        m = qry.profiler.methods["ids"]
+        self.assertEqual((1, 3), (m["n"], m["docs"]))
+        # Cursors that are not read to the end are recorded when closed
+        qry.aggregate_query([{"$match": {}}]).close()
+        m = qry.profiler.methods["Query.aggregate_query"]
+        self.assertEqual((1, 0), (m["n"], m["docs"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
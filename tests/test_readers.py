@@ -5,10 +5,10 @@ import unittest
 from geneinfo.ensembl_regbuild import connectgffdb
 from geneinfo.ensembl_regbuild import regregions_reader
 from geneinfo.ensembl_regbuild import tfs_reader
-from geneinfo.rnacentral_idmappings import mappingreader
-from hmdb.index import parse_hmdb_xmlfile
-from nosqlbiosets.modelseed.index import read_modelseed_datafile, \
-    updatecompoundrecord, updatereactionrecord
+from geneinfo.rnacentral_idmappings import mappingreader, rnacentral_xrefs
+from hmdb.index import metabolite_protein_edges, parse_hmdb_xmlfile
+from nosqlbiosets.modelseed.index import equation_compoundids, \
+    read_modelseed_datafile, updatecompoundrecord, updatereactionrecord
 from nosqlbiosets.kegg.index import read_and_index_kegg_xmltarfile
 from nosqlbiosets.metanetx.index import *
 from nosqlbiosets.pubtator.index import parse_pub2gene_lines
@@ -40,6 +40,28 @@ class TestDataReaders(unittest.TestCase):
         print(r)
         self.assertEqual(r['_id'], 'rxn00001')
 
+    def test_modelseed_equation_compoundids(self):
+        eq = '(1) cpd00001[0] + (0.5) cpd00002[0] <= (2) cpd00009[1]'
+        self.assertEqual(equation_compoundids(eq),
+                         (['cpd00009'], ['cpd00001', 'cpd00002']))
+        self.assertEqual(equation_compoundids('cpd00001'), (None, None))
+
+    def test_modelseed_compound_names_table(self):
+        import shutil
+        import tempfile
+        from nosqlbiosets.modelseed.query import CompoundNames
+        table = {'cpd00001': 'H2O', 'cpd00002': 'a\tb\\n\rc\u2028d\x0b',
+                 'cpd00003': 'line1\nline2\\'}
+        tmpdir = tempfile.mkdtemp()
+        path = tmpdir + "/names.tsv"
+        CompoundNames.savetable(table, path)
+        with open(path, 'rb') as f:
+            self.assertEqual(3, f.read().count(b'\n'))
+        self.assertEqual(table, CompoundNames.readtable(path))
+        CompoundNames.savetable({}, path)
+        self.assertEqual({}, CompoundNames.readtable(path))
+        shutil.rmtree(tmpdir)
+
     def test_rnacentral_idmapping_reader(self):
         infile = self.data + "rnacentral-id-mappings-first100.tsv"
         idlist = [r for r in mappingreader(infile)]
@@ -48,6 +70,9 @@ class TestDataReaders(unittest.TestCase):
         self.assertEqual(r['_id'], 'URS0000000001')
         self.assertEqual(len(r['mappings']), 11)
         assert r['mappings'][0]['type'] == 'rRNA'
+        xrefs = list(rnacentral_xrefs(r))
+        self.assertEqual(('rnacentral', 'URS0000000001'), xrefs[0])
+        self.assertEqual(12, len(xrefs))
         r = idlist[-1]
         assert r['mappings'][-1]['gene'] == 'trnL'
 
@@ -63,6 +88,108 @@ class TestDataReaders(unittest.TestCase):
         tflist = [r for r in tfs_reader(db)]
         self.assertEqual(len(tflist), 1000)
 
+    def test_ensembl_regbuild_overlaps(self):
+        from geneinfo.ensembl_regbuild import binfromrange, overlappingbins
+        from geneinfo.qryregbuild import IntervalCache
+        infile = self.data + "hg38.ensrb_features.r88.first100.gff"
+        regions = [r for r in regregions_reader(connectgffdb(infile))]
+        cache = IntervalCache(regions)
+        self.assertEqual(len(cache), 100)
+        tests = [("18", 76429000, 76429380), ("X", 40737000, 40800000),
+                 ("X", 1, 40733599), ("8", 66406000, 66406001),
+                 ("MT", 1, 16569)]
+        for chr_, start, end in tests:
+            expected = {r['_id'] for r in regions if r['chr'] == chr_ and
+                        r['start'] <= end and r['end'] >= start}
+            found = cache.overlaps(chr_, start, end)
+            self.assertEqual(expected, {r['_id'] for r in found})
+            for r in found:
+                self.assertIn(binfromrange(r['start'], r['end']),
+                              overlappingbins(start, end))
+        self.assertEqual(585, binfromrange(1, 1 << 17))
+        self.assertEqual(73, binfromrange(1, (1 << 17) + 1))
+
+    def test_ensembl_regbuild_es_overlaps_paging(self):
+        from geneinfo.qryregbuild import QueryRegBuild
+        infile = self.data + "hg38.ensrb_features.r88.first100.gff"
+        regions = [r for r in regregions_reader(connectgffdb(infile))]
+        # features with the same start positions span page boundaries
+        regions += [dict(r, _id=r['_id'] + '.copy') for r in regions[:40]]
+
+        class ES(object):
+            """ Minimal Elasticsearch client for the overlap queries """
+            def search(self, index, body):
+                docs = []
+                for r in regions:
+                    match = True
+                    for f in body['query']['bool']['filter']:
+                        if 'term' in f:
+                            match &= r['chr'] == f['term']['chr']
+                        elif 'loc' in f['range']:
+                            loc = f['range']['loc']
+                            match &= r['start'] <= loc['lte'] and \
+                                r['end'] >= loc['gte']
+                        else:
+                            match &= r['start'] >= f['range']['start']['gte']
+                    for f in body['query']['bool'].get('must_not', []):
+                        match &= r['_id'] not in f['ids']['values']
+                    if match:
+                        docs.append(r)
+                docs.sort(key=lambda r: r['start'])
+                return {"hits": {"hits": [
+                    {"_id": r['_id'], "_source": dict(r)}
+                    for r in docs[:body['size']]]}}
+
+            def msearch(self, body):
+                return {"responses": [self.search(None, b)
+                                      for b in body[1::2]]}
+
+        qry = QueryRegBuild.__new__(QueryRegBuild)
+        qry.index = "regbuild"
+        qry.cache = None
+
+        class DBC(object):
+            db = 'Elasticsearch'
+            es = ES()
+        qry.dbc = DBC()
+        tests = [("X", 1, 140733599), ("5", 1, 10 ** 9), ("1", 1, 10 ** 9),
+                 ("18", 76429000, 76429380),
+                 ("MT", 1, 16569)]
+        for size in [3, 4, 1000]:
+            r = qry.overlaps(tests, size=size)
+            for (chr_, start, end), found in zip(tests, r):
+                expected = sorted(
+                    r_['_id'] for r_ in regions if r_['chr'] == chr_ and
+                    r_['start'] <= end and r_['end'] >= start)
+                self.assertEqual(expected, sorted(f['_id'] for f in found))
+
+    def test_uniprot_taxonomy_intervals(self):
+        from nosqlbiosets.uniprot.index import taxonomy_tree
+        organisms = [
+            ("1", ["Bacteria", "Bacillota", "Bacilli"]),
+            ("2", ["Bacteria", "Bacillota", "Clostridia"]),
+            ("3", ["Bacteria", "Pseudomonadota"]),
+            ("4", ["Bacteria", "Bacillota", "Bacilli"]),
+            ("5", ["Eukaryota"])]
+        nodes = taxonomy_tree(organisms)
+        orgs = {n['taxid']: n for n in nodes if 'taxid' in n}
+
+        def lca(taxids):
+            left = min(orgs[i]['left'] for i in taxids)
+            right = max(orgs[i]['right'] for i in taxids)
+            return max((n for n in nodes
+                        if n['left'] <= left and n['right'] >= right),
+                       key=lambda n: n['left'])['lineage']
+        self.assertEqual(["Bacteria", "Bacillota", "Bacilli"], lca(["1", "4"]))
+        self.assertEqual(["Bacteria", "Bacillota"], lca(["1", "2"]))
+        self.assertEqual(["Bacteria"], lca(["2", "3", "4"]))
+        self.assertEqual([], lca(["1", "5"]))
+        self.assertEqual(["Eukaryota"], lca(["5"]))
+        node = [n for n in nodes if n.get('name') == "Bacillota"][0]
+        self.assertEqual({"1", "2", "4"},
+                         {i for i, n in orgs.items()
+                          if node['left'] < n['left'] < node['right']})
+
     def test_gene2pubtator_reader(self):
         infile = self.data + "gene2pubtator.sample"
         r = 0
@@ -71,6 +198,29 @@ class TestDataReaders(unittest.TestCase):
             mappinglist = [m for m in db]
             self.assertEqual(len(mappinglist), 1916)
 
+    def test_gene2pubtator_neo4j_csvfiles(self):
+        import csv
+        import shutil
+        import tempfile
+        from nosqlbiosets.neo4jimport import Neo4jImportFiles
+        from nosqlbiosets.pubtator.index import neo4j_csvfiles
+        infile = self.data + "gene2pubtator.sample"
+        outdir = tempfile.mkdtemp()
+        files = Neo4jImportFiles(outdir)
+        with open(infile) as inf:
+            n = neo4j_csvfiles(files, inf, 'gene2pub')
+        self.assertGreaterEqual(n, 1916)
+        self.assertEqual(['Pub', 'Gene'], [l for l, _ in files.nodefiles])
+        with open(files.relfiles[0][1]) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual([':START_ID(Pub)', ':END_ID(Gene)',
+                          'mentions:string[]', 'resource:string[]'], rows[0])
+        self.assertEqual(n, len(rows) - 1)
+        script = files.save_importscript()
+        with open(script) as f:
+            self.assertIn("--relationships=mentions=", f.read())
+        shutil.rmtree(outdir)
+
     def hmdb_reader_helper(self, _, entry):
         self.assertTrue('accession' in entry)
         self.nhmdbentries += 1
@@ -90,6 +240,23 @@ class TestDataReaders(unittest.TestCase):
         parse_hmdb_xmlfile(self.hmdbproteins, self.hmdb_reader_helper)
         self.assertEqual(self.nhmdbentries, 10)
 
+    def test_hmdb_metabolite_protein_edges(self):
+        entry = {'accession': 'HMDBP00001', 'gene_name': 'ABAT',
+                 'protein_type': 'Enzyme',
+                 'general_function': 'Involved in transaminase activity',
+                 'metabolite_associations': {'metabolite': {
+                     'accession': 'HMDB0000112',
+                     'name': 'gamma-Aminobutyric acid'}}}
+        r = metabolite_protein_edges(entry)
+        self.assertEqual([{"metabolite": 'HMDB0000112',
+                           "metabolite_name": 'gamma-Aminobutyric acid',
+                           "protein": 'HMDBP00001', "gene": 'ABAT',
+                           "type": 'Enzyme',
+                           "function": 'Involved in transaminase activity'}],
+                         r)
+        entry['metabolite_associations'] = None
+        self.assertEqual([], metabolite_protein_edges(entry))
+
     compoundsxreffile = data + "metanetx/chem_xref.tsv"
     compoundsfile = data + "metanetx/chem_prop.tsv"
 
@@ -132,6 +299,16 @@ class TestDataReaders(unittest.TestCase):
                                  '1 MNXM3150@MNXD1 = 1 MNXM3150@MNXD2')
                 break
 
+    def test_metanetx_parse_equation(self):
+        reactants, products = parse_equation(
+            '1 MNXM3150@MNXD1 + 0.5 MNXM1@MNXD1 = 2 MNXM3150@MNXD2')
+        self.assertEqual(reactants, [
+            {'id': 'MNXM3150', 'coef': 1.0, 'compartment': 'MNXD1'},
+            {'id': 'MNXM1', 'coef': 0.5, 'compartment': 'MNXD1'}])
+        self.assertEqual(products, [
+            {'id': 'MNXM3150', 'coef': 2.0, 'compartment': 'MNXD2'}])
+        self.assertEqual((None, None), parse_equation('1 MNXM1@MNXD1'))
+
     def kegg_xmlreader_helper(self, _, entry):
         self.assertTrue('name' in entry)
         self.nkeggentries += 1
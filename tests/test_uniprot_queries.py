@@ -3,7 +3,10 @@
 
 import unittest
 
-from nosqlbiosets.uniprot.query import QueryUniProt, idmatch
+from nosqlbiosets.uniprot.index import FACET_MAXSIZE, FACETS, mongodb_facets
+from nosqlbiosets.uniprot.query import FACETS_SUFFIX, QueryUniProt, \
+    _facetkey, idmatch
+from stubs import Collection, DBC
 
 MDBHOST = "tests.cbrc.kaust.edu.sa"
 MDB_DB = "embm"
@@ -21,12 +24,11 @@ class TestQueryUniProt(unittest.TestCase):
 
     def test_kegg_geneid_queries_es(self):
         ids = qryuniprot_es.getnamesforkegg_geneids(
-            ['hsa:7157', 'hsa:121504'], "Elasticsearch")
+            ['hsa:7157', 'hsa:121504'])
         self.assertListEqual(['H4_HUMAN', 'P53_HUMAN'], sorted(set(ids)))
 
     def test_kegg_geneid_queries_mdb(self):
-        db = "MongoDB"
-        ids = qryuniprot.getnamesforkegg_geneids(['hsa:7157', 'hsa:121504'], db)
+        ids = qryuniprot.getnamesforkegg_geneids(['hsa:7157', 'hsa:121504'])
         self.assertSetEqual(set(ids), {'P53_HUMAN', 'H4_HUMAN'})
 
     def test_genes_linkedto_keggreaction(self, db="MongoDB"):
@@ -233,5 +235,58 @@ class TestQueryUniProt(unittest.TestCase):
                 self.assertAlmostEqual(orgs, len(organisms[nametype]), delta=50)
 
 
+class TestUniProtFacets(unittest.TestCase):
+
+    def setUp(self):
+        counts = [{"type": "primary", "name": "g%d" % i, "total": 10 - i}
+                  for i in range(5)]
+        database = dict()
+        Collection([
+            {"_id": "ec:genes:1.1.1.1", "counts": counts, "n": 5},
+            # counts were truncated while saving the summaries
+            {"_id": "organism:GO:9606", "counts": counts[:3], "n": 8}],
+            "uniprot" + FACETS_SUFFIX, database)
+        self.qry = QueryUniProt.__new__(QueryUniProt)
+        self.qry.dbc = DBC(database)
+        self.qry.mdbcollection = "uniprot"
+
+    def test_facetkey(self):
+        self.assertEqual(("ec", "1.1.1.1"),
+                         _facetkey({"dbReference.id": "1.1.1.1"}))
+        self.assertEqual(("organism", "9606"),
+                         _facetkey({"organism.dbReference.id": "9606"}))
+        for qc in [None, {}, {"dbReference.id": {"$in": ["1.1.1.1"]}},
+                   {"dbReference.id": "1.1.1.1", "dbReference.type": "EC"},
+                   {"gene.name.#text": "ABAT"}]:
+            self.assertIsNone(_facetkey(qc))
+
+    def test_getfacet_truncation(self):
+        qc = {"dbReference.id": "1.1.1.1"}
+        self.assertEqual(["g0", "g1"], [i["name"] for i in
+                                        self.qry.getfacet("genes", qc, 2)])
+        self.assertEqual(5, len(self.qry.getfacet("genes", qc)))
+        self.assertEqual(5, len(self.qry.getfacet("genes", qc, 100)))
+        self.assertIsNone(self.qry.getfacet("GO", qc))
+        self.assertIsNone(self.qry.getfacet("genes", {"gene.name": "x"}))
+        qc = {"organism.dbReference.id": "9606"}
+        self.assertEqual(3, len(self.qry.getfacet("GO", qc, 3)))
+        self.assertIsNone(self.qry.getfacet("GO", qc, 4))
+        self.assertIsNone(self.qry.getfacet("GO", qc))
+
+    def test_mongodb_facets_pipelines(self):
+        mcl = Collection(name="uniprot", database=dict())
+        Collection(name="uniprot" + FACETS_SUFFIX, database=mcl.database)
+        mongodb_facets(mcl)
+        # organisms facet is not saved for organism keys
+        self.assertEqual(2 * len(FACETS) - 1, len(mcl.pipelines))
+        for agpl in mcl.pipelines:
+            project = agpl[-2]["$project"]
+            self.assertEqual(["$counts", FACET_MAXSIZE],
+                             project["counts"]["$slice"])
+            self.assertEqual(1, project["n"])
+            self.assertEqual({"into": "uniprot" + FACETS_SUFFIX},
+                             agpl[-1]["$merge"])
+
+
 if __name__ == '__main__':
     unittest.main()